@@ -3,27 +3,184 @@ Lehigh Student Academic Marketplace
 A comprehensive marketplace for textbooks, supplies, and academic essentials
 """
 
-from flask import Flask, render_template, request, jsonify, session, send_from_directory
+from flask import Flask, g, render_template, request, jsonify, session, send_file, send_from_directory
 from werkzeug.utils import secure_filename
 import json
+import mimetypes
 import os
-from datetime import datetime
+import time
 
+from planner.assets import StaticAssets
 from planner.budget_planner import BudgetPlanner
+from planner.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY
+from planner.storage import ContentStore
+from planner.workers import is_worker_import
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'lehigh-marketplace-2025'
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB
 
-# Ensure directories exist
-os.makedirs('data', exist_ok=True)
-os.makedirs('uploads', exist_ok=True)
-os.makedirs('uploads/syllabi', exist_ok=True)
-os.makedirs('uploads/listings', exist_ok=True)
 
-# Initialize planner
-budget_planner = BudgetPlanner()
+def init_services():
+    """Create the upload directories, stores and planner the routes use"""
+    global syllabus_store, static_assets, budget_planner
+    
+    # Ensure directories exist
+    os.makedirs('data', exist_ok=True)
+    os.makedirs('uploads', exist_ok=True)
+    os.makedirs('uploads/syllabi', exist_ok=True)
+    os.makedirs('uploads/listings', exist_ok=True)
+    
+    # Syllabi are stored by content hash, so re-uploads of the same file share one copy
+    syllabus_store = ContentStore(os.path.join(app.config['UPLOAD_FOLDER'], 'syllabi'))
+    
+    # Content fingerprints and precompressed variants of files under static/
+    static_assets = StaticAssets(app.static_folder)
+    
+    # Initialize planner (UNIQUE_NICKNAMES=1 makes nicknames unique, ignoring case;
+    # IMAGE_PROXY_HOSTS adds comma-separated hosts the image proxy may fetch from and
+    # IMAGE_CACHE_MB sets its disk budget)
+    budget_planner = BudgetPlanner(
+        unique_nicknames=os.environ.get('UNIQUE_NICKNAMES', '') in ('1', 'true', 'yes'),
+        image_proxy_hosts=[h.strip() for h in os.environ.get('IMAGE_PROXY_HOSTS', '').split(',') if h.strip()],
+        image_cache_bytes=int(os.environ.get('IMAGE_CACHE_MB', 512)) * 1024 * 1024
+    )
+
+
+# Syllabus and image worker processes re-import this file; they only run
+# planner job functions, so they skip the planner and its data files
+if not is_worker_import(__name__):
+    init_services()
+
+# Longest time (seconds) a long-poll request is held open waiting for changes
+LONG_POLL_MAX_WAIT = 25
+
+# Largest page of messages returned by the conversation endpoint
+MAX_MESSAGE_PAGE = 100
+
+# Most schedules accepted by one bulk budget estimate request
+MAX_BULK_SCHEDULES = 5000
+
+# Largest page of reports returned by the moderation queue endpoint
+MAX_REPORT_PAGE = 200
+
+# Browser cache lifetime (seconds) of proxied remote images
+REMOTE_IMAGE_MAX_AGE = 24 * 3600
+
+# Cache lifetime (seconds) of responses that never change: fingerprinted
+# static URLs and content-addressed uploads
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+IMMUTABLE_CACHE_CONTROL = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+
+# Accounts allowed to review reports (comma-separated MODERATOR_EMAILS env var)
+MODERATOR_EMAILS = {e.strip() for e in os.environ.get('MODERATOR_EMAILS', '').split(',') if e.strip()}
+
+
+# Clients allowed to scrape /metrics: loopback plus comma-separated METRICS_ALLOWED_IPS
+METRICS_ALLOWED_IPS = {'127.0.0.1', '::1'} | {
+    ip.strip() for ip in os.environ.get('METRICS_ALLOWED_IPS', '').split(',') if ip.strip()}
+
+# Request metrics, labelled by route pattern (not the raw path) so label values stay bounded
+REQUEST_SECONDS = REGISTRY.histogram(
+    'http_request_duration_seconds', 'HTTP request latency', ['method', 'endpoint', 'status'])
+REQUEST_ERRORS = REGISTRY.counter(
+    'http_request_errors_total', 'HTTP responses with a 5xx status, including errors caught by routes',
+    ['method', 'endpoint', 'status'])
+REQUESTS_IN_FLIGHT = REGISTRY.gauge('http_requests_in_flight', 'HTTP requests being handled', ['endpoint'])
+
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.request_started = time.perf_counter()
+    REQUESTS_IN_FLIGHT.inc(g.metrics_endpoint)
+
+
+@app.after_request
+def record_response_status(response):
+    g.response_status = response.status_code
+    return response
+
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    """Record latency and errors; runs even when a route raised"""
+    started = g.pop('request_started', None)
+    if started is None:
+        return
+    endpoint = g.metrics_endpoint
+    status = str(g.get('response_status', 500))
+    REQUESTS_IN_FLIGHT.dec(endpoint)
+    REQUEST_SECONDS.observe(time.perf_counter() - started, request.method, endpoint, status)
+    if status.startswith('5'):
+        REQUEST_ERRORS.inc(request.method, endpoint, status)
+
+
+def _long_poll_params():
+    """Parse the `since` version and `wait` timeout of a long-poll request.
+    
+    `since` falls back to the If-None-Match header so plain ETag revalidation
+    short-circuits the same way.
+    """
+    since = request.args.get('since') or request.headers.get('If-None-Match', '').strip('W/"')
+    try:
+        since = int(since)
+    except (TypeError, ValueError):
+        since = None
+    try:
+        wait = min(max(float(request.args.get('wait', 0)), 0), LONG_POLL_MAX_WAIT)
+    except ValueError:
+        wait = 0
+    return since, wait
+
+
+def _versioned_response(payload, version):
+    """JSON response tagged with a change version, or 304 if payload is None"""
+    response = jsonify(payload) if payload is not None else app.response_class(status=304)
+    response.set_etag(str(version))
+    response.headers['X-Messages-Version'] = str(version)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics (only for METRICS_ALLOWED_IPS)"""
+    if request.remote_addr not in METRICS_ALLOWED_IPS:
+        return jsonify({'success': False, 'error': 'Forbidden'}), 403
+    return app.response_class(REGISTRY.render(), content_type=METRICS_CONTENT_TYPE)
+
+
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    """Add ?v=<content hash> to url_for('static', ...) so a changed file gets a new URL"""
+    if endpoint == 'static' and 'filename' in values and 'v' not in values:
+        fingerprint = static_assets.fingerprint(values['filename'])
+        if fingerprint:
+            values['v'] = fingerprint
+
+
+@app.endpoint('static')
+def static_file(filename):
+    """Static files, cached forever when requested by their current fingerprint.
+    
+    A precompressed .br/.gz sibling is sent when the client accepts it.
+    Other requests (no or stale ?v=) revalidate against the content ETag.
+    """
+    fingerprint = static_assets.fingerprint(filename)
+    served, encoding = static_assets.negotiate(filename, request.headers.get('Accept-Encoding', ''))
+    response = send_from_directory(app.static_folder, served,
+                                   mimetype=mimetypes.guess_type(filename)[0],
+                                   etag=f"{fingerprint}-{encoding or 'identity'}")
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    if fingerprint and request.args.get('v') == fingerprint:
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 
 @app.route('/')
@@ -69,9 +226,27 @@ def messages_page():
 
 
 # Serve uploaded listing images
-@app.route('/uploads/listings/<filename>')
+@app.route('/uploads/listings/<path:filename>')
 def uploaded_listing_image(filename):
-    return send_from_directory(os.path.join(app.root_path, app.config['UPLOAD_FOLDER'], 'listings'), filename)
+    """Listing photos (with Range support); content-addressed files are immutable"""
+    directory = os.path.join(app.root_path, app.config['UPLOAD_FOLDER'], 'listings')
+    if budget_planner.listing_images.digest_of(filename) is None:
+        # Older timestamp-named uploads
+        return send_from_directory(directory, filename)
+    # The name is derived from the bytes, so it is a strong ETag
+    response = send_from_directory(directory, filename, etag=os.path.basename(filename))
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+
+@app.route('/images/remote')
+def remote_image():
+    """Remote listing image (?url=, optional &variant=thumb|detail&format=jpeg|webp) from the local cache"""
+    result = budget_planner.image_proxy.get(request.args.get('url', ''),
+                                            request.args.get('variant'), request.args.get('format'))
+    if 'error' in result:
+        return jsonify({'success': False, 'error': result['error']}), result.get('status', 502)
+    return send_file(result['path'], mimetype=result['content_type'], max_age=REMOTE_IMAGE_MAX_AGE)
 
 
 @app.route('/api/marketplace/upload_image', methods=['POST'])
@@ -84,11 +259,9 @@ def upload_listing_image():
         if file.filename == '':
             return jsonify({'success': False, 'error': 'No file selected'}), 400
 
-        filename = secure_filename(f"{datetime.utcnow().strftime('%Y%m%d%H%M%S')}_{file.filename}")
-        dest = os.path.join(app.config['UPLOAD_FOLDER'], 'listings', filename)
-        file.save(dest)
-
-        public_url = f"/uploads/listings/{filename}"
+        # Stored by content hash (identical photos share one file); thumbnail and
+        # detail variants are rendered off the request path
+        public_url = budget_planner.store_listing_image(file.stream, secure_filename(file.filename))
         return jsonify({'success': True, 'url': public_url})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -141,6 +314,8 @@ def login():
         nickname_validation = budget_planner.validate_nickname(nickname)
         if not nickname_validation['valid']:
             return jsonify({'success': False, 'error': nickname_validation['error']}), 400
+        if budget_planner.unique_nicknames and not budget_planner.is_nickname_available(nickname, email):
+            return jsonify({'success': False, 'error': 'That nickname is already taken'}), 409
         
         # Server-side CAPTCHA validation - STRICT: Must pass to login
         if captcha_answer is None or not captcha_question:
@@ -165,6 +340,8 @@ def login():
         
         # Create or get user
         user = budget_planner.get_or_create_user(email, nickname)
+        if 'error' in user:
+            return jsonify({'success': False, 'error': user['error']}), user.get('status', 400)
         return jsonify({
             'success': True, 
             'user': {
@@ -208,8 +385,34 @@ def create_listing():
     """Create a new marketplace listing"""
     try:
         data = request.json
+        # Checked before creating, so the new listing does not count as its own duplicate
+        duplicate_check = budget_planner.check_duplicate_listing(data.get('isbn', ''), data.get('seller_email', ''))
         listing = budget_planner.create_marketplace_listing(data)
-        return jsonify({'success': True, 'listing': listing})
+        if 'error' in listing:
+            return jsonify({'success': False, 'error': listing['error']}), listing.get('status', 400)
+        return jsonify({'success': True, 'listing': listing, 'duplicate_check': duplicate_check})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/marketplace/listings/import', methods=['POST'])
+def import_listings():
+    """Create many listings at once (moderated in a single batch)"""
+    try:
+        data = request.json
+        result = budget_planner.import_marketplace_listings(data.get('listings', []))
+        return jsonify({'success': True, **result})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/marketplace/isbn/<isbn>', methods=['GET'])
+def get_isbn_summary(isbn):
+    """Active listings summary for an ISBN, plus a duplicate check for ?seller_email="""
+    try:
+        summary = budget_planner.get_isbn_summary(isbn)
+        duplicate_check = budget_planner.check_duplicate_listing(isbn, request.args.get('seller_email', ''))
+        return jsonify({'success': True, 'summary': summary, 'duplicate_check': duplicate_check})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -232,6 +435,8 @@ def update_listing(listing_id):
     try:
         data = request.json
         listing = budget_planner.update_listing(listing_id, data)
+        if listing and 'error' in listing:
+            return jsonify({'success': False, 'error': listing['error']}), listing.get('status', 400)
         return jsonify({'success': True, 'listing': listing})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -293,16 +498,32 @@ def upload_syllabus():
             return jsonify({'success': False, 'error': 'No file selected'}), 400
         
         filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], 'syllabi', filename)
-        file.save(filepath)
+        extension = os.path.splitext(filename)[1].lower()
+        content_hash, filepath, _ = syllabus_store.put_stream(file.stream, extension)
         
-        # Parse syllabus (mocked)
-        extracted = budget_planner.parse_syllabus(filepath)
+        # Parse in the background; clients poll the job status endpoint. A
+        # syllabus seen before comes back already done.
+        job_id = budget_planner.submit_syllabus(filepath, filename, content_hash)
+        job = budget_planner.get_syllabus_job(job_id)
         
         return jsonify({
             'success': True,
-            'extracted': extracted
-        })
+            'job_id': job_id,
+            'job': job,
+            'status_url': f'/api/syllabus/jobs/{job_id}'
+        }), 200 if job['status'] == 'done' else 202
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/syllabus/jobs/<job_id>', methods=['GET'])
+def get_syllabus_job(job_id):
+    """Status (and, once done, the extracted materials) of a syllabus parsing job"""
+    try:
+        job = budget_planner.get_syllabus_job(job_id)
+        if not job:
+            return jsonify({'success': False, 'error': 'Job not found'}), 404
+        return jsonify({'success': True, 'job': job})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -348,6 +569,20 @@ def get_class_recommendations():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/classes', methods=['GET'])
+def find_classes():
+    """Look up catalog classes by ?department= and/or ?isbn="""
+    try:
+        department = request.args.get('department', '')
+        isbn = request.args.get('isbn', '')
+        if not department and not isbn:
+            return jsonify({'success': False, 'error': 'department or isbn required'}), 400
+        classes = budget_planner.find_classes(department, isbn)
+        return jsonify({'success': True, 'classes': classes})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 # Messaging
 @app.route('/api/messages/conversations', methods=['GET'])
 def get_conversations():
@@ -356,8 +591,53 @@ def get_conversations():
         email = request.headers.get('X-User-Email', '')
         if not email:
             return jsonify({'success': False, 'error': 'Email required'}), 400
+        
+        # Long-poll: hold the request until the inbox changes past `since`
+        since, wait = _long_poll_params()
+        version = budget_planner.wait_for_inbox_change(email, since, wait)
+        if version == since:
+            return _versioned_response(None, version)
+        
         conversations = budget_planner.get_conversations(email)
-        return jsonify(conversations)
+        return _versioned_response(conversations, version)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/messages/conversations/listing/<listing_id>', methods=['GET'])
+def get_listing_conversation(listing_id):
+    """Get (or with ?create=1, start) the user's conversation about a listing"""
+    try:
+        email = request.headers.get('X-User-Email', '')
+        if not email:
+            return jsonify({'error': 'Email required', 'status': 400}), 400
+        recipient_email = request.args.get('recipient_email', '')
+        if not recipient_email:
+            return jsonify({'error': 'recipient_email required', 'status': 400}), 400
+        create = request.args.get('create', '').lower() in ('1', 'true', 'yes')
+        conversation = budget_planner.get_conversation_for_listing(email, recipient_email, listing_id, create)
+        if isinstance(conversation, dict) and 'error' in conversation:
+            return jsonify(conversation), conversation.get('status', 500)
+        return jsonify({'success': True, 'conversation': conversation})
+    except Exception as e:
+        return jsonify({'error': str(e), 'status': 500}), 500
+
+
+@app.route('/api/messages/unread_count', methods=['GET'])
+def get_unread_count():
+    """Get the user's total unread message count (navbar badge)"""
+    try:
+        email = request.headers.get('X-User-Email', '')
+        if not email:
+            return jsonify({'success': False, 'error': 'Email required'}), 400
+        
+        since, wait = _long_poll_params()
+        version = budget_planner.wait_for_inbox_change(email, since, wait)
+        if version == since:
+            return _versioned_response(None, version)
+        
+        unread_count = budget_planner.get_unread_count(email)
+        return _versioned_response({'success': True, 'unread_count': unread_count}, version)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -369,10 +649,26 @@ def get_conversation_messages(conversation_id):
         email = request.headers.get('X-User-Email', '')
         if not email:
             return jsonify({'error': 'Email required', 'status': 400}), 400
-        messages = budget_planner.get_conversation_messages(conversation_id, email)
+        
+        # Long-poll: hold the request until the conversation changes past `since`
+        since, wait = _long_poll_params()
+        if since is not None and budget_planner.is_conversation_participant(conversation_id, email):
+            version = budget_planner.wait_for_conversation_change(conversation_id, since, wait)
+            if version == since:
+                return _versioned_response(None, version)
+        else:
+            version = budget_planner.get_conversation_version(conversation_id)
+        
+        # Optional pagination: ?limit=N[&before=<message_id>]
+        limit = request.args.get('limit', type=int)
+        if limit is not None:
+            limit = min(max(limit, 1), MAX_MESSAGE_PAGE)
+        before = request.args.get('before') or None
+        
+        messages = budget_planner.get_conversation_messages(conversation_id, email, limit, before)
         if isinstance(messages, dict) and 'error' in messages:
             return jsonify(messages), messages.get('status', 500)
-        return jsonify(messages)
+        return _versioned_response(messages, version)
     except Exception as e:
         return jsonify({'error': str(e), 'status': 500}), 500
 
@@ -425,6 +721,47 @@ def report_message(message_id):
         return jsonify({'error': str(e), 'status': 500}), 500
 
 
+@app.route('/api/moderation/reports', methods=['GET'])
+def get_moderation_queue():
+    """Page through reported messages (moderators only)"""
+    try:
+        email = request.headers.get('X-User-Email', '')
+        if not email:
+            return jsonify({'error': 'Email required', 'status': 400}), 400
+        if email not in MODERATOR_EMAILS:
+            return jsonify({'error': 'Moderator access required', 'status': 403}), 403
+        
+        status = request.args.get('status', 'pending')
+        offset = max(request.args.get('offset', 0, type=int), 0)
+        limit = min(max(request.args.get('limit', 50, type=int), 1), MAX_REPORT_PAGE)
+        queue = budget_planner.get_moderation_queue(status, offset, limit)
+        return jsonify({'success': True, **queue})
+    except Exception as e:
+        return jsonify({'error': str(e), 'status': 500}), 500
+
+
+@app.route('/api/moderation/reports/resolve', methods=['POST'])
+def resolve_reports():
+    """Resolve a batch of reports (moderators only)"""
+    try:
+        email = request.headers.get('X-User-Email', '')
+        if not email:
+            return jsonify({'error': 'Email required', 'status': 400}), 400
+        if email not in MODERATOR_EMAILS:
+            return jsonify({'error': 'Moderator access required', 'status': 403}), 403
+        
+        data = request.json or {}
+        report_ids = data.get('report_ids', [])
+        if not isinstance(report_ids, list):
+            return jsonify({'error': 'report_ids must be a list', 'status': 400}), 400
+        result = budget_planner.resolve_reports(report_ids, email, data.get('action', 'dismiss'), data.get('note', ''))
+        if isinstance(result, dict) and 'error' in result:
+            return jsonify(result), result.get('status', 500)
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({'error': str(e), 'status': 500}), 500
+
+
 @app.route('/api/users/block', methods=['POST'])
 def block_user():
     """Block a user"""
@@ -481,6 +818,25 @@ def estimate_budget():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/budget/estimate/bulk', methods=['POST'])
+def estimate_budgets_bulk():
+    """Estimate budgets for many students' schedules in one request"""
+    try:
+        schedules = (request.json or {}).get('schedules', [])
+        if not isinstance(schedules, list):
+            return jsonify({'success': False, 'error': 'schedules must be a list'}), 400
+        if len(schedules) > MAX_BULK_SCHEDULES:
+            return jsonify({'success': False, 'error': f'At most {MAX_BULK_SCHEDULES} schedules per request'}), 400
+        estimates = budget_planner.estimate_semester_budgets(schedules)
+        # Echo each schedule's optional id so callers can match results
+        for schedule, estimate in zip(schedules, estimates):
+            if 'id' in schedule:
+                estimate['id'] = schedule['id']
+        return jsonify({'success': True, 'estimates': estimates})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 if __name__ == '__main__':
     print("=" * 60)
     print("Lehigh Student Academic Marketplace")
@@ -489,4 +845,4 @@ if __name__ == '__main__':
     print("Open your browser to: http://localhost:5000")
     print("=" * 60)
     print("\nPress Ctrl+C to stop the server\n")
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    app.run(debug=True, host='0.0.0.0', port=5000, threaded=True)
@@ -0,0 +1,187 @@
+"""
+Benchmark the compiled moderation engine against the original _moderate_content.
+
+Runs both implementations over a corpus of hand-picked edge cases plus a
+seeded batch of generated chat messages, fails if any verdict differs, and
+reports the time per message for each. Nickname verdicts are compared
+against the original validate_nickname word checks the same way.
+
+Usage: python benchmark_moderation.py [generated_count]
+"""
+
+import random
+import re
+import sys
+import time
+
+from planner.moderation import DEFAULT_RULES, ModerationEngine
+
+
+def legacy_moderate_content(content):
+    """The original BudgetPlanner._moderate_content, kept as the reference"""
+    profanity_list = [
+        'fuck', 'shit', 'ass', 'bitch', 'damn', 'crap', 'hell',
+        'bastard', 'dick', 'pussy', 'cock', 'slut', 'whore'
+    ]
+
+    content_lower = content.lower()
+    for word in profanity_list:
+        if word in content_lower:
+            return {'allowed': False, 'reason': 'Inappropriate language detected'}
+
+    if len(content) > 20:
+        if content.isupper():
+            return {'allowed': False, 'reason': 'Please do not use all caps'}
+
+        for i in range(len(content) - 5):
+            if len(set(content[i:i+6])) == 1:
+                return {'allowed': False, 'reason': 'Spam detected'}
+
+    scam_patterns = [
+        r'venmo.*\$\d+',
+        r'paypal.*\$\d+',
+        r'cash.*app',
+        r'send.*money',
+        r'bitcoin',
+        r'cryptocurrency'
+    ]
+
+    for pattern in scam_patterns:
+        if re.search(pattern, content_lower):
+            return {'allowed': False, 'reason': 'Suspicious content detected. Please use safe payment methods.'}
+
+    return {'allowed': True, 'reason': ''}
+
+
+def legacy_nickname_inappropriate(nickname):
+    """The original validate_nickname word checks (word list now lives in the rules)"""
+    inappropriate_words = DEFAULT_RULES['nickname']['profanity']
+    nickname_lower = nickname.lower()
+    nickname_stripped = re.sub(r'[0-9]', '', nickname_lower)
+    for word in inappropriate_words:
+        if word in nickname_lower or word in nickname_stripped:
+            return True
+
+    leetspeak_replacements = [
+        (r'[1!]', 'i'), (r'[3]', 'e'), (r'[4]', 'a'),
+        (r'[5]', 's'), (r'[7]', 't'), (r'[0]', 'o'),
+    ]
+    nickname_leetspeak = nickname_lower
+    for pattern, replacement in leetspeak_replacements:
+        nickname_leetspeak = re.sub(pattern, replacement, nickname_leetspeak)
+    return any(word in nickname_leetspeak for word in inappropriate_words)
+
+
+NICKNAMES = [
+    'Alex M.', 'Sarah K', 'mike_t', 'Jordan-L', 'Hawk 2025', 'MODERATOR', 'm0d',
+    'h3ll0', 'sh1t', 'k1ll3r', 'n1gg3r', 'Assistant', 'Classy', 'Roothless',
+    'Hatem', 'Dr. Death', 'fu2ck', 'a55', 'Gr8 Deals', 'plain name', '', 'Ünïcödé',
+]
+
+# Hand-picked messages covering every rule, rule precedence and edge cases
+CORPUS = [
+    '',
+    'Is this for sale?',
+    'Hi, is the textbook still available?',
+    'Hello! Can we meet at the library?',           # 'hell' substring
+    'I need this for my class tomorrow',            # 'ass' substring
+    'Scunthorpe is a town',
+    'What the FUCK',
+    'this is shit',
+    'Bastard edition lol',
+    'crappy condition?',
+    'damn that is cheap',
+    'Is the lab coat size M?',
+    'CAN YOU MEET TODAY AT FIVE PM',                # all caps, long
+    'CAN YOU MEET',                                 # all caps, short
+    'CAN YOU MEET TODAY 123 456 789',               # caps with digits
+    '!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!',               # no cased characters
+    'Is it available?????? please reply',           # run of 6
+    'Is it available????? please reply',            # run of 5
+    'nooooooooo way that is too much',
+    'aaaaaa',                                       # run of 6, too short to check
+    'short text aaaaaaaaaa',                        # exactly 21 characters
+    'tabs\t\t\t\t\t\t inside a long message',
+    'newlines\n\n\n\n\n\n inside a long message',
+    'I can venmo you $40 tonight',
+    'venmo me 40',
+    'Venmo\n$40 works?',                            # '.' does not cross newlines
+    'paypal is fine, $35 total',
+    'do you take cash app',
+    'cashapp?',
+    'please send the money first',
+    'send me your address, then money order',
+    'I only accept bitcoin',
+    'Cryptocurrency accepted',
+    'shit, can I venmo $20',                        # profanity wins over scam
+    'SEND MONEY NOW SEND MONEY NOW',                # caps wins over scam
+    'Ünïcödé téxt is fine here',
+    'ÜNÏCÖDÉ TÉXT IN ALL CAPS HERE',
+    'emoji 😀😀😀😀😀😀 spam in a long message',
+    'Can you do $45 for the Campbell Biology book?',
+    'Meet at Rauch at 3pm? I can pay cash.',
+]
+
+# Fragments used to generate realistic chat traffic for the timing run
+_FRAGMENTS = [
+    'hi', 'is this still available', 'can you do', '$40', '$25', 'for the book',
+    'meet at the library', 'tomorrow', 'after class', 'thanks', 'great condition',
+    'what edition', 'calculator', 'lab coat', 'ok', 'sounds good', 'venmo', 'paypal',
+    'cash', 'app', 'send', 'money', 'bitcoin', 'hello', 'class', 'pass', 'HEY',
+    'PLEASE', '!!!!!!', 'sooooo', 'mini fridge', 'TI-84', 'pickup at Rauch',
+    'is the price negotiable', 'I can pay in cash', 'the access code works',
+]
+
+
+def generate_messages(count, seed=42):
+    """Generate a reproducible batch of chat-like messages"""
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(count):
+        text = ' '.join(rng.choice(_FRAGMENTS) for _ in range(rng.randint(1, 12)))
+        if rng.random() < 0.05:
+            text = text.upper()
+        messages.append(text)
+    return messages
+
+
+def time_per_message(make_check, messages, repeat=3):
+    """Best-of-N average seconds per message, with a fresh checker each run"""
+    best = float('inf')
+    for _ in range(repeat):
+        check = make_check()
+        start = time.perf_counter()
+        for message in messages:
+            check(message)
+        best = min(best, time.perf_counter() - start)
+    return best / len(messages)
+
+
+def main():
+    generated_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    messages = CORPUS + generate_messages(generated_count)
+    engine = ModerationEngine()
+
+    mismatches = [m for m in messages if engine.check(m) != legacy_moderate_content(m)]
+    blocked = sum(1 for m in messages if not engine.check(m)['allowed'])
+    print(f'Messages checked: {len(messages)} ({len(set(messages))} distinct, {blocked} blocked)')
+    print(f'Verdict mismatches: {len(mismatches)}')
+    for message in mismatches[:10]:
+        print(f'  {message!r}: legacy={legacy_moderate_content(message)} engine={engine.check(message)}')
+
+    nickname_mismatches = [n for n in NICKNAMES
+                           if (not engine.check(n, 'nickname')['allowed']) != legacy_nickname_inappropriate(n)]
+    print(f'Nickname mismatches: {len(nickname_mismatches)} of {len(NICKNAMES)}')
+    for nickname in nickname_mismatches:
+        print(f'  {nickname!r}')
+
+    legacy_time = time_per_message(lambda: legacy_moderate_content, messages)
+    engine_time = time_per_message(lambda: ModerationEngine().check, messages)
+    print(f'Legacy:   {legacy_time * 1e6:8.2f} us/message')
+    print(f'Compiled: {engine_time * 1e6:8.2f} us/message ({legacy_time / engine_time:.1f}x faster)')
+
+    return 1 if mismatches or nickname_mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
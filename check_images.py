@@ -1,16 +1,227 @@
+"""
+Check that listing images exist and actually load.
+
+Every distinct image URL is probed once (HEAD, falling back to a one-byte
+GET) on a bounded thread pool with a per-request timeout. Results are cached
+with a TTL, so reruns only re-probe stale URLs. --report writes a JSON report,
+and --fix replaces broken images with the category placeholder in a single
+write of listings.json.
+
+    python check_images.py [--workers 16] [--timeout 5] [--report report.json] [--fix]
+        [--base-url http://127.0.0.1:5000]
+"""
+
+import argparse
 import json
+import os
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from planner.budget_planner import BudgetPlanner
+
+LISTINGS_FILE = 'data/listings.json'
+CACHE_FILE = 'data/image_check_cache.json'
+
+# Seconds a probe result is reused before the URL is checked again
+CACHE_TTL = 6 * 3600
+
+# Probe outcomes: 'ok'; 'broken' (the server answered, but not with an image);
+# 'unreachable' (timeout, DNS or connection failure, 5xx - possibly transient)
+OK, BROKEN, UNREACHABLE = 'ok', 'broken', 'unreachable'
+
+
+def probe(url, timeout=5.0, base_url=None):
+    """Check one image URL; returns {'status', 'code', 'content_type', 'error'}"""
+    if url.startswith('/') and not base_url:
+        # Local upload without a running server to ask: check the file itself
+        exists = os.path.isfile(urllib.parse.unquote(urllib.parse.urlsplit(url).path).lstrip('/'))
+        return {'status': OK if exists else BROKEN, 'code': None, 'content_type': None,
+                'error': None if exists else 'file not found'}
+    if url.startswith('/'):
+        url = base_url.rstrip('/') + url
+
+    headers = {'User-Agent': 'LehighMarketplace-ImageCheck/1.0', 'Accept': 'image/*'}
+    result = None
+    for method, extra in (('HEAD', {}), ('GET', {'Range': 'bytes=0-0'})):
+        request = urllib.request.Request(url, method=method, headers=dict(headers, **extra))
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                content_type = response.headers.get_content_type()
+                if content_type.startswith('image/') or not response.headers.get('Content-Type'):
+                    return {'status': OK, 'code': response.status, 'content_type': content_type, 'error': None}
+                result = {'status': BROKEN, 'code': response.status, 'content_type': content_type,
+                          'error': 'not an image'}
+        except urllib.error.HTTPError as e:
+            status = UNREACHABLE if e.code >= 500 or e.code == 429 else BROKEN
+            result = {'status': status, 'code': e.code, 'content_type': None, 'error': str(e.reason)}
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            return {'status': UNREACHABLE, 'code': None, 'content_type': None,
+                    'error': str(getattr(e, 'reason', e))}
+        # Some hosts reject or mishandle HEAD; only a GET answer is final
+    return result
+
+
+def check_urls(urls, workers=16, timeout=5.0, base_url=None, cache=None, ttl=CACHE_TTL):
+    """Probe URLs concurrently, reusing fresh cache entries; returns {url: result} and updates cache"""
+    cache = cache if cache is not None else {}
+    now = time.time()
+    results = {}
+    stale = []
+    for url in urls:
+        entry = cache.get(url)
+        if entry and now - entry.get('checked_at', 0) < ttl:
+            results[url] = dict(entry, cached=True)
+        else:
+            stale.append(url)
+
+    if stale:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            probes = pool.map(lambda url: probe(url, timeout, base_url), stale)
+            for url, result in zip(stale, probes):
+                result['checked_at'] = now
+                cache[url] = result
+                results[url] = dict(result, cached=False)
+    return results
+
+
+def listing_image_urls(listing):
+    """A listing's image URLs (image_url first), without duplicates"""
+    urls = [listing.get('image_url')] + list(listing.get('image_urls') or [])
+    return [url for url in dict.fromkeys(urls) if url]
+
+
+def build_report(listings, results):
+    """Machine-readable report: per-image results for every listing plus totals"""
+    images = []
+    for listing in listings:
+        for url in listing_image_urls(listing):
+            result = results[url]
+            images.append({
+                'id': listing.get('id'),
+                'title': listing.get('title'),
+                'image_url': url,
+                'status': result['status'],
+                'code': result['code'],
+                'content_type': result['content_type'],
+                'error': result['error'],
+                'cached': result['cached']
+            })
+    missing = [{'id': l.get('id'), 'title': l.get('title')} for l in listings if not listing_image_urls(l)]
+    summary = {status: sum(1 for image in images if image['status'] == status)
+               for status in (OK, BROKEN, UNREACHABLE)}
+    return {
+        'checked_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'total_listings': len(listings),
+        'distinct_urls': len(results),
+        'summary': dict(summary, missing=len(missing)),
+        'missing': missing,
+        'images': images
+    }
+
+
+def fix_broken_images(listings_file, results):
+    """Replace broken images with the placeholder; one write of listings.json; returns fixed listing ids"""
+    with open(listings_file, 'r') as f:
+        listings = json.load(f)
+
+    fixed = []
+    for listing in listings:
+        broken = {url for url in listing_image_urls(listing)
+                  if results.get(url, {}).get('status') == BROKEN}
+        if not broken:
+            continue
+        if listing.get('image_urls'):
+            listing['image_urls'] = [url for url in listing['image_urls'] if url not in broken]
+        if listing.get('image_url') in broken:
+            remaining = listing.get('image_urls') or []
+            listing['image_url'] = remaining[0] if remaining else BudgetPlanner.placeholder_image_url(listing)
+        fixed.append(listing.get('id'))
+
+    if fixed:
+        _write_json_atomic(listings_file, listings)
+    return fixed
+
+
+def _read_json(path, default):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return default
+
+
+def _write_json_atomic(path, data):
+    """Write JSON through a temporary file so an interrupted write never truncates it"""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.tmp-', suffix='.json')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that listing images load')
+    parser.add_argument('--listings', default=LISTINGS_FILE)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--timeout', type=float, default=5.0)
+    parser.add_argument('--cache', default=CACHE_FILE, help="Probe result cache ('' to disable)")
+    parser.add_argument('--ttl', type=float, default=CACHE_TTL, help='Seconds a cached result is reused')
+    parser.add_argument('--base-url', help='Origin for relative URLs such as /uploads/... '
+                                           '(default: check the files on disk)')
+    parser.add_argument('--report', help="Write a JSON report to this file ('-' for stdout)")
+    parser.add_argument('--fix', action='store_true', help='Replace broken images with placeholders')
+    args = parser.parse_args()
+
+    with open(args.listings, 'r') as f:
+        listings = json.load(f)
+
+    cache = _read_json(args.cache, {}) if args.cache else {}
+    urls = list(dict.fromkeys(url for listing in listings for url in listing_image_urls(listing)))
+    results = check_urls(urls, args.workers, args.timeout, args.base_url, cache, args.ttl)
+    if args.cache:
+        _write_json_atomic(args.cache, cache)
+    report = build_report(listings, results)
+
+    if args.fix:
+        report['fixed'] = fix_broken_images(args.listings, results)
+
+    if args.report == '-':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+        return
+    if args.report:
+        _write_json_atomic(args.report, report)
+
+    summary = report['summary']
+    print(f'Total listings: {len(listings)}')
+    print(f'With images: {len(listings) - summary["missing"]}')
+    print(f'Missing images: {summary["missing"]}')
+    print(f'Images checked: {len(report["images"])} ({len(urls)} distinct URLs)')
+    print(f'  OK: {summary[OK]}  Broken: {summary[BROKEN]}  Unreachable: {summary[UNREACHABLE]}')
+
+    if report['missing']:
+        print('\nMissing images:')
+        for item in report['missing']:
+            print(f'  - {item["id"]}: {item["title"]}')
 
-with open('data/listings.json', 'r') as f:
-    listings = json.load(f)
+    problems = [image for image in report['images'] if image['status'] != OK]
+    if problems:
+        print('\nBroken or unreachable images:')
+        for image in problems:
+            print(f'  - {image["id"]}: {image["status"]} ({image["code"] or image["error"]}) {image["image_url"]}')
 
-missing = [l for l in listings if not l.get('image_url')]
-has_images = len([l for l in listings if l.get('image_url')])
+    if args.fix:
+        print(f'\nReplaced broken images in {len(report["fixed"])} listings')
 
-print(f'Total listings: {len(listings)}')
-print(f'With images: {has_images}')
-print(f'Missing images: {len(missing)}')
 
-if missing:
-    print('\nMissing images:')
-    for item in missing:
-        print(f'  - {item["id"]}: {item["title"]}')
+if __name__ == '__main__':
+    main()
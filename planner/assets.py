@@ -0,0 +1,133 @@
+"""
+Static Assets
+Content fingerprints for cache-busting static URLs and precompressed (.br/.gz) variants
+"""
+
+import gzip
+import hashlib
+import os
+import sys
+import threading
+
+try:
+    import brotli
+except ImportError:  # optional: without it only .gz variants are generated
+    brotli = None
+
+
+# Content encodings served from precompressed files, in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# File types worth precompressing
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.html', '.txt')
+
+
+class StaticAssets:
+    """Fingerprints and encoding negotiation for files under a static folder.
+
+    fingerprint() is a short hash of a file's bytes, cached per file and
+    recomputed only when its size or modification time changes, so a URL
+    carrying it changes exactly when the file does and can be cached forever.
+    negotiate() picks a precompressed sibling (style.css.br, style.css.gz)
+    the client accepts, if one exists and is not older than the file.
+    """
+
+    FINGERPRINT_LENGTH = 12
+
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+        self._lock = threading.Lock()
+        self._fingerprints = {}
+
+    def fingerprint(self, filename):
+        """Short content hash of a static file, or None if it does not exist"""
+        path = self._path(filename)
+        try:
+            stat = os.stat(path) if path else None
+        except OSError:
+            stat = None
+        if stat is None:
+            return None
+
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._fingerprints.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+
+        hasher = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                hasher.update(chunk)
+        fingerprint = hasher.hexdigest()[:self.FINGERPRINT_LENGTH]
+        with self._lock:
+            self._fingerprints[path] = (key, fingerprint)
+        return fingerprint
+
+    def negotiate(self, filename, accept_encoding=''):
+        """(file to send, content encoding or None) for a request's Accept-Encoding header"""
+        accepted = _accepted_encodings(accept_encoding)
+        path = self._path(filename)
+        if not accepted or not path:
+            return filename, None
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return filename, None
+        for encoding, suffix in ENCODINGS:
+            if encoding not in accepted:
+                continue
+            try:
+                if os.path.getmtime(path + suffix) >= mtime:
+                    return filename + suffix, encoding
+            except OSError:
+                continue
+        return filename, None
+
+    def precompress(self):
+        """Write .gz (and, with the brotli package, .br) next to every compressible file; returns the count"""
+        written = 0
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                if not name.endswith(COMPRESSIBLE_EXTENSIONS):
+                    continue
+                path = os.path.join(directory, name)
+                with open(path, 'rb') as f:
+                    data = f.read()
+                _write_if_smaller(path + '.gz', gzip.compress(data, compresslevel=9, mtime=0), len(data))
+                if brotli is not None:
+                    _write_if_smaller(path + '.br', brotli.compress(data, quality=11), len(data))
+                written += 1
+        return written
+
+    def _path(self, filename):
+        """Absolute path of a file inside the root, or None if it would escape it"""
+        path = os.path.realpath(os.path.join(self.root, filename))
+        return path if path.startswith(self.root + os.sep) else None
+
+
+def _accepted_encodings(header):
+    """Content codings a client accepts (ignoring q=0)"""
+    accepted = set()
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        params = params.replace(' ', '')
+        if coding and params not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def _write_if_smaller(path, data, original_size):
+    """Write a compressed variant unless it would not save anything"""
+    if len(data) >= original_size:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+if __name__ == '__main__':
+    # python -m planner.assets [static folder]: precompress assets before deploying
+    folder = sys.argv[1] if len(sys.argv) > 1 else 'static'
+    print(f'Precompressed {StaticAssets(folder).precompress()} files in {folder}')
@@ -3,12 +3,48 @@ Lehigh Student Academic Marketplace
 Comprehensive marketplace with smart features
 """
 
+import atexit
+import bisect
+import copy
+import itertools
 import json
+import math
 import os
 import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
 from datetime import datetime, timedelta
 
+from planner.class_registry import ClassRegistry, normalize_class_code, normalize_isbn
+from planner.image_proxy import ImageProxy
+from planner.images import ImagePipeline
+from planner.metrics import REGISTRY, timed_methods
+from planner.moderation import ModerationEngine
+from planner.price_sources import MarketplacePriceSource, PriceAggregator, load_price_sources
+from planner.price_stats import QuantileSketch
+from planner.storage import ContentStore
+from planner.syllabus import analyze_syllabus
+from planner.workers import process_pool
 
+
+# Latency and exceptions of every public BudgetPlanner method
+METHOD_SECONDS = REGISTRY.histogram(
+    'planner_method_duration_seconds', 'Time spent in BudgetPlanner methods', ['method'])
+METHOD_ERRORS = REGISTRY.counter(
+    'planner_method_errors_total', 'Exceptions raised by BudgetPlanner methods', ['method'])
+
+# JSON file traffic, labelled by data file name ('other' for files outside data/)
+JSON_READ_BYTES = REGISTRY.counter('planner_json_read_bytes_total', 'Bytes read by _load_json', ['file'])
+JSON_WRITTEN_BYTES = REGISTRY.counter('planner_json_written_bytes_total', 'Bytes written by _save_json', ['file'])
+JSON_PARSE_SECONDS = REGISTRY.histogram('planner_json_parse_seconds', 'Time parsing JSON files', ['file'])
+JSON_DUMP_SECONDS = REGISTRY.histogram('planner_json_dump_seconds', 'Time serializing JSON files', ['file'])
+JSON_IO_SECONDS = REGISTRY.histogram(
+    'planner_json_io_seconds', 'Time reading or writing JSON files', ['file', 'operation'])
+
+
+@timed_methods(METHOD_SECONDS, METHOD_ERRORS)
 class BudgetPlanner:
     """Manages Lehigh marketplace and academic planning"""
     
@@ -36,7 +72,7 @@ class BudgetPlanner:
         }
     }
     
-    # Common Lehigh classes with textbook mappings
+    # Built-in classes with textbook mappings (data/classes.json extends and overrides these)
     LEHIGH_CLASSES = {
         'EECS 183': {
             'name': 'Introduction to Computer Science',
@@ -64,7 +100,30 @@ class BudgetPlanner:
         }
     }
     
-    def __init__(self):
+    # Reports after which a message is hidden until a moderator reviews it
+    AUTO_HIDE_REPORTS = 3
+    
+    # Seconds the report writer waits to batch bursts of reports into one save
+    REPORTS_FLUSH_DELAY = 1.0
+    
+    # Active listings for one ISBN at which a new listing is flagged as heavily listed
+    HEAVILY_LISTED_THRESHOLD = 5
+    
+    # Listings needed in a price-history group before suggest_price trusts it
+    MIN_PRICE_SAMPLES = 3
+    
+    # Editions suggest_price distinguishes; anything else counts as current
+    EDITIONS = ('current', 'previous', 'older')
+    
+    # Worker processes parsing syllabi, and how many finished jobs to remember
+    SYLLABUS_WORKERS = 2
+    SYLLABUS_JOBS_KEPT = 1000
+    
+    # Seconds an unreferenced listing image is kept after its last upload, so a
+    # photo uploaded for a listing that is still being created is not collected
+    ORPHAN_IMAGE_GRACE = 3600
+    
+    def __init__(self, unique_nicknames=False, image_proxy_hosts=(), image_cache_bytes=ImageProxy.MAX_CACHE_BYTES):
         self.data_dir = 'data'
         self.listings_file = os.path.join(self.data_dir, 'listings.json')
         self.users_file = os.path.join(self.data_dir, 'users.json')
@@ -74,6 +133,125 @@ class BudgetPlanner:
         self.conversations_file = os.path.join(self.data_dir, 'conversations.json')
         self.blocks_file = os.path.join(self.data_dir, 'blocks.json')
         self.reports_file = os.path.join(self.data_dir, 'reports.json')
+        self.moderation_rules_file = os.path.join(self.data_dir, 'moderation_rules.json')
+        self.price_sources_file = os.path.join(self.data_dir, 'price_sources.json')
+        self.listing_images_dir = os.path.join('uploads', 'listings')
+        self.remote_images_dir = os.path.join('uploads', 'remote')
+        
+        # Serializes every load-modify-save of listings.json (so new ids are checked
+        # against the listings on disk and concurrent edits are not lost), together
+        # with the index update for the change. The lazy listing indexes are built
+        # under it too, so a build sees each write either in the file or as a delta,
+        # never both or neither. Taken before the stats and images locks.
+        self._listings_lock = threading.RLock()
+        
+        # When set, nicknames must be unique (case-insensitive) across users
+        self.unique_nicknames = unique_nicknames
+        
+        # User directory (email -> user) and lowercased nickname -> email,
+        # loaded lazily from users.json
+        self._users_lock = threading.Lock()
+        self._users = None
+        self._nickname_owners = {}
+        
+        # Course catalog indexed by code, department and ISBN, hot-reloaded from classes.json
+        self.class_registry = ClassRegistry(self.classes_file, self.LEHIGH_CLASSES)
+        
+        # Price comparison sources from price_sources.json plus our own listings,
+        # queried concurrently
+        self.price_aggregator = PriceAggregator(
+            load_price_sources(self.price_sources_file) + [MarketplacePriceSource(self)])
+        
+        # Background syllabus parsing (process pool started on first upload)
+        self._syllabus_lock = threading.Lock()
+        self._syllabus_pool = None
+        self._syllabus_jobs = OrderedDict()
+        
+        # Uploaded listing photos stored by content hash, with thumbnail and
+        # detail-size variants rendered in a background process pool
+        self.listing_images = ContentStore(self.listing_images_dir)
+        self.image_pipeline = ImagePipeline(self.listing_images_dir, '/uploads/listings')
+        
+        # Remote listing images (seed data, placeholders) fetched once and served
+        # from a local LRU cache; image_proxy_hosts adds hosts it may fetch from
+        self.image_proxy = ImageProxy(self.remote_images_dir, '/images/remote',
+                                      allowed_hosts=ImageProxy.DEFAULT_HOSTS + tuple(image_proxy_hosts),
+                                      max_bytes=image_cache_bytes)
+        
+        # Stored image name -> number of listings using it, built lazily. Images
+        # no listing uses (dropped by their last listing, or uploaded and never
+        # attached) are deleted once ORPHAN_IMAGE_GRACE has passed; a timer
+        # retries the ones still within the grace period.
+        self._images_lock = threading.Lock()
+        self._image_refs = None
+        self._orphan_images = set()
+        self._orphan_sweep = None
+        
+        # Compiled moderation rules, hot-reloaded when the rules file changes
+        self.moderation = ModerationEngine(self.moderation_rules_file)
+        
+        # Change versions for long-polling clients. Versions are seeded from the
+        # clock so a client holding a version from before a restart never matches.
+        self._change_cond = threading.Condition()
+        self._base_version = int(time.time() * 1000)
+        self._change_seq = self._base_version
+        self._user_versions = {}
+        self._conversation_versions = {}
+        
+        # Materialized per-user inbox (email -> conversation id -> summary), built
+        # lazily from disk and then maintained by the write paths below. The
+        # messages themselves are held here too: every message by id, and each
+        # conversation's message ids oldest first (with each id's position in
+        # that list), so a page of history is a slice rather than a file scan.
+        # Conversation records are kept the same way and conversations.json is
+        # only ever written from them, under the lock.
+        self._index_lock = threading.RLock()
+        self._inbox = None
+        self._conversations = []
+        self._conversations_by_id = {}
+        self._inbox_conversations = {}
+        self._listing_conversations = {}
+        self._conversation_keys = {}
+        self._unread_totals = {}
+        self._messages = []
+        self._messages_by_id = {}
+        self._conversation_messages = {}
+        self._message_positions = {}
+        
+        # Active-listing price aggregates per (class_code, textbook), built lazily
+        # and kept current by the listing write paths
+        self._stats_lock = threading.Lock()
+        self._textbook_stats = None
+        self._textbook_stats_version = None
+        self._textbook_stats_keys = {}
+        
+        # ISBN -> active listings ({'listings': id -> listing, 'prices': sorted}),
+        # built lazily and maintained alongside the textbook aggregates
+        self._isbn_listings = None
+        
+        # Price history of active and sold listings: quantile sketches keyed by
+        # ('isbn', isbn, condition, edition) and ('category', category, condition, edition)
+        self._price_history = None
+        
+        # Block lists as sets in both directions (blocker -> blocked users and
+        # blocked user -> blockers), loaded lazily from blocks.json
+        self._blocks_lock = threading.Lock()
+        self._blocks = None
+        self._blocked_by_user = {}
+        self._blockers_of_user = {}
+        
+        # Report index (report id -> report, in filing order) with per-message
+        # counts and per-status queues. reports.json is written behind by a
+        # background thread so filing a report never rewrites the whole file.
+        self._reports_lock = threading.Lock()
+        self._reports = None
+        self._message_report_counts = {}
+        self._reports_by_status = {}
+        self._reports_dirty = threading.Event()
+        self._reports_flush_lock = threading.Lock()
+        self._reports_writer = None
+        atexit.register(self.flush_reports)
+        
         self._initialize_data()
     
     def _initialize_data(self):
@@ -100,27 +278,64 @@ class BudgetPlanner:
     # User Management
     def get_or_create_user(self, email, nickname=None):
         """Get or create a user"""
-        users = self._load_json(self.users_file)
-        user = next((u for u in users if u['email'] == email), None)
-        
-        if not user:
-            user = {
-                'email': email,
-                'nickname': nickname or email.split('@')[0],
-                'created_at': datetime.now().isoformat(),
-                'classes': [],
-                'major': ''
-            }
-            users.append(user)
-        else:
-            # Update nickname if provided
-            if nickname and nickname != user.get('nickname'):
-                user['nickname'] = nickname
-                user['updated_at'] = datetime.now().isoformat()
-        
-        self._save_json(self.users_file, users)
+        users = self._get_users()
+        with self._users_lock:
+            user = users.get(email)
+            
+            if nickname and self.unique_nicknames:
+                owner = self._nickname_owners.get(nickname.lower())
+                if owner and owner != email:
+                    return {'error': 'That nickname is already taken', 'status': 409}
+            
+            if not user:
+                user = {
+                    'email': email,
+                    'nickname': nickname or self._default_nickname(email),
+                    'created_at': datetime.now().isoformat(),
+                    'classes': [],
+                    'major': ''
+                }
+                users[email] = user
+                nickname_changed = True
+            else:
+                # Update nickname if provided
+                nickname_changed = bool(nickname) and nickname != user.get('nickname')
+                if nickname_changed:
+                    self._release_nickname(user)
+                    user['nickname'] = nickname
+                    user['updated_at'] = datetime.now().isoformat()
+            
+            # Only rewrite users.json when something actually changed
+            if nickname_changed:
+                self._nickname_owners.setdefault(user['nickname'].lower(), email)
+                self._save_json(self.users_file, list(users.values()))
+            user = dict(user)
+        
+        if nickname_changed:
+            self._refresh_inbox_entries(self._inbox_conversation_ids(email))
         return user
     
+    def get_user(self, email):
+        """Get a user by email, or None"""
+        users = self._get_users()
+        with self._users_lock:
+            user = users.get(email)
+            return dict(user) if user else None
+    
+    def is_nickname_available(self, nickname, email=None):
+        """Check whether a nickname is free (case-insensitive), ignoring `email`'s own"""
+        self._get_users()
+        with self._users_lock:
+            owner = self._nickname_owners.get(nickname.lower())
+        return owner is None or owner == email
+    
+    def resolve_nicknames(self, emails):
+        """Map each known email to its user's nickname in one pass"""
+        users = self._get_users()
+        with self._users_lock:
+            return {email: users[email].get('nickname', 'Unknown')
+                    for email in emails if email in users}
+    
     def validate_nickname(self, nickname):
         """Validate nickname appropriateness"""
         if not nickname or len(nickname.strip()) < 2:
@@ -129,61 +344,10 @@ class BudgetPlanner:
         if len(nickname) > 30:
             return {'valid': False, 'error': 'Nickname must be 30 characters or less'}
         
-        # Comprehensive list of offensive words
-        inappropriate_words = [
-            # Swear words
-            'arse', 'arsehead', 'arsehole', 'ass', 'asshole', 'ass hole',
-            'bastard', 'bitch', 'bloody', 'bollocks', 'brotherfucker', 'bugger', 'bullshit',
-            'child-fucker', 'cock', 'cocksucker', 'crap', 'cunt',
-            'dammit', 'damn', 'damned', 'damn it', 'dick', 'dick-head', 'dickhead', 'dumb ass', 'dumb-ass', 'dumbass', 'dyke',
-            'fag', 'faggot', 'father-fucker', 'fatherfucker', 'fuck', 'fucked', 'fucker', 'fucking',
-            'god dammit', 'goddammit', 'god damn', 'goddamn', 'goddamned', 'goddamnit', 'godsdamn',
-            'hell', 'holy shit', 'horseshit',
-            'jackarse', 'jack-ass', 'jackass', 'jesus christ', 'jesus fuck', 'jesus harold christ', 'jesus h. christ', 'jesus wept',
-            'kike',
-            'mental',
-            'mother fucker', 'mother-fucker', 'motherfucker',
-            'nigger', 'nigga', 'nigra',  # n-word and variants
-            'pigfucker', 'piss', 'prick', 'pussy',
-            'shit', 'shit ass', 'shite', 'sibling fucker', 'sisterfuck', 'sisterfucker', 'slut', 'son of a bitch', 'son of a whore', 'spastic', 'sweet jesus',
-            'tranny', 'twat',
-            'wanker',
-            # Additional offensive terms
-            'admin', 'administrator', 'moderator', 'mod', 'root',
-            'nazi', 'hitler', 'kill', 'death', 'murder', 'hate'
-        ]
-        
-        nickname_lower = nickname.lower()
-        # Create a version with numbers removed to catch leetspeak variants
-        nickname_stripped = re.sub(r'[0-9]', '', nickname_lower)
-        
-        # Check for inappropriate words
-        for word in inappropriate_words:
-            # Check if word appears in nickname directly
-            if word in nickname_lower:
-                return {'valid': False, 'error': 'Nickname contains inappropriate content'}
-            # Also check with numbers stripped (catches n1gger, n1gga, etc.)
-            if word in nickname_stripped:
-                return {'valid': False, 'error': 'Nickname contains inappropriate content'}
-        
-        # Additional check for common leetspeak variants of offensive words
-        # Replace numbers with letters that sound similar and check again
-        leetspeak_replacements = [
-            (r'[1!]', 'i'),
-            (r'[3]', 'e'),
-            (r'[4]', 'a'),
-            (r'[5]', 's'),
-            (r'[7]', 't'),
-            (r'[0]', 'o'),
-        ]
-        
-        nickname_leetspeak = nickname_lower
-        for pattern, replacement in leetspeak_replacements:
-            nickname_leetspeak = re.sub(pattern, replacement, nickname_leetspeak)
-        
-        for word in inappropriate_words:
-            if word in nickname_leetspeak:
-                return {'valid': False, 'error': 'Nickname contains inappropriate content'}
+        # Offensive words (with leetspeak variants) come from the shared moderation rules
+        moderation_result = self.moderation.check(nickname, 'nickname')
+        if not moderation_result['allowed']:
+            return {'valid': False, 'error': moderation_result['reason']}
         
         # Check pattern
         if not re.match(r'^[A-Za-z0-9\s\.\-_]+$', nickname):
@@ -274,17 +438,81 @@ class BudgetPlanner:
         # Sort by date (newest first)
         listings.sort(key=lambda x: x.get('created_at', ''), reverse=True)
         
-        return listings
+        return self.image_pipeline.attach_variants(listings, self.image_proxy)
     
     def create_marketplace_listing(self, data):
         """Create a new marketplace listing"""
-        listings = self._load_json(self.listings_file)
+        moderation_result = self._moderate_listing_text([data])[0]
+        if not moderation_result['allowed']:
+            return {'error': moderation_result['reason'], 'status': 400}
+        if self._parse_price(data.get('price', 0)) is None:
+            return {'error': 'Price must be a number', 'status': 400}
         
-        new_listing = {
-            'id': f"listing_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
+        with self._listings_lock:
+            listings = self._load_json(self.listings_file)
+            new_listing = self._build_listing(data, self._new_listing_id({l['id'] for l in listings}))
+            listings.append(new_listing)
+            self._save_json(self.listings_file, listings)
+            self._update_listing_indexes(added=[new_listing])
+        
+        return new_listing
+    
+    def import_marketplace_listings(self, items):
+        """Create many listings at once, screening all of their text in one batch"""
+        verdicts = self._moderate_listing_text(items)
+        
+        created = []
+        rejected = []
+        with self._listings_lock:
+            listings = self._load_json(self.listings_file)
+            # Ids on disk and ids already given out in this batch
+            taken = {l['id'] for l in listings}
+            for i, (item, verdict) in enumerate(zip(items, verdicts)):
+                if not verdict['allowed']:
+                    rejected.append({'index': i, 'title': item.get('title', ''), 'error': verdict['reason']})
+                    continue
+                if self._parse_price(item.get('price', 0)) is None:
+                    rejected.append({'index': i, 'title': item.get('title', ''), 'error': 'Price must be a number'})
+                    continue
+                listing = self._build_listing(item, self._new_listing_id(taken))
+                taken.add(listing['id'])
+                created.append(listing)
+            
+            if created:
+                listings.extend(created)
+                self._save_json(self.listings_file, listings)
+                self._update_listing_indexes(added=created)
+        
+        return {'created': created, 'rejected': rejected}
+    
+    def _new_listing_id(self, taken):
+        """A listing id ("listing_<timestamp>_<random hex>") not in `taken`"""
+        while True:
+            listing_id = f"listing_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+            if listing_id not in taken:
+                return listing_id
+    
+    def _moderate_listing_text(self, items):
+        """Screen the title and description of each listing, one verdict per listing"""
+        texts = []
+        for item in items:
+            texts.extend([item.get('title', ''), item.get('description', '')])
+        verdicts = self.moderation.check_many(texts, 'listing')
+        
+        results = []
+        for i in range(len(items)):
+            title_verdict, description_verdict = verdicts[2 * i], verdicts[2 * i + 1]
+            results.append(title_verdict if not title_verdict['allowed'] else description_verdict)
+        return results
+    
+    def _build_listing(self, data, listing_id):
+        """Build a new active listing record from submitted data"""
+        image_urls = list(data.get('image_urls') or [])
+        return {
+            'id': listing_id,
             'title': data.get('title', ''),
             'description': data.get('description', ''),
-            'price': float(data.get('price', 0)),
+            'price': self._parse_price(data.get('price', 0)),
             'condition': data.get('condition', 'Good'),
             'category': data.get('category', 'textbooks'),
             'subcategory': data.get('subcategory', ''),
@@ -292,7 +520,8 @@ class BudgetPlanner:
             'seller_email': data.get('seller_email', ''),
             'seller_name': data.get('seller_name', ''),
             'contact': data.get('contact', ''),
-            'image_url': data.get('image_url', ''),
+            'image_url': data.get('image_url') or (image_urls[0] if image_urls else ''),
+            'image_urls': image_urls,
             'isbn': data.get('isbn', ''),
             'edition': data.get('edition', ''),
             'created_at': datetime.now().isoformat(),
@@ -300,43 +529,89 @@ class BudgetPlanner:
             'views': 0,
             'bookmarks': 0
         }
-        
-        listings.append(new_listing)
-        self._save_json(self.listings_file, listings)
-        
-        return new_listing
+    
+    @staticmethod
+    def _parse_price(value):
+        """A submitted price as a float, or None if it is not a finite number"""
+        try:
+            price = float(value)
+        except (TypeError, ValueError):
+            return None
+        return price if math.isfinite(price) else None
     
     def get_listing(self, listing_id):
         """Get a single listing"""
         listings = self._load_json(self.listings_file)
-        return next((l for l in listings if l['id'] == listing_id), None)
+        listing = next((l for l in listings if l['id'] == listing_id), None)
+        return self.image_pipeline.attach_variants([listing], self.image_proxy)[0] if listing else None
     
     def update_listing(self, listing_id, data):
         """Update a listing"""
-        listings = self._load_json(self.listings_file)
-        for i, listing in enumerate(listings):
-            if listing['id'] == listing_id:
-                listings[i].update(data)
-                listings[i]['updated_at'] = datetime.now().isoformat()
-                break
-        self._save_json(self.listings_file, listings)
+        if 'title' in data or 'description' in data:
+            moderation_result = self._moderate_listing_text([data])[0]
+            if not moderation_result['allowed']:
+                return {'error': moderation_result['reason'], 'status': 400}
+        if 'price' in data:
+            price = self._parse_price(data['price'])
+            if price is None:
+                return {'error': 'Price must be a number', 'status': 400}
+            data = dict(data, price=price)
+        
+        with self._listings_lock:
+            listings = self._load_json(self.listings_file)
+            previous = None
+            for i, listing in enumerate(listings):
+                if listing['id'] == listing_id:
+                    previous = dict(listing)
+                    listings[i].update(data)
+                    listings[i]['updated_at'] = datetime.now().isoformat()
+                    break
+            self._save_json(self.listings_file, listings)
+            if previous:
+                self._update_listing_indexes(added=[listings[i]], removed=[previous])
+        self._refresh_inbox_entries(self._listing_conversation_ids(listing_id))
         return next((l for l in listings if l['id'] == listing_id), None)
     
     def delete_listing(self, listing_id):
         """Delete a listing"""
-        listings = self._load_json(self.listings_file)
-        listings = [l for l in listings if l['id'] != listing_id]
-        self._save_json(self.listings_file, listings)
+        with self._listings_lock:
+            listings = self._load_json(self.listings_file)
+            removed = [l for l in listings if l['id'] == listing_id]
+            listings = [l for l in listings if l['id'] != listing_id]
+            self._save_json(self.listings_file, listings)
+            self._update_listing_indexes(removed=removed)
+        self._refresh_inbox_entries(self._listing_conversation_ids(listing_id))
     
     def mark_listing_sold(self, listing_id):
         """Mark a listing as sold"""
-        listings = self._load_json(self.listings_file)
-        for listing in listings:
-            if listing['id'] == listing_id:
-                listing['status'] = 'sold'
-                listing['sold_at'] = datetime.now().isoformat()
-                break
-        self._save_json(self.listings_file, listings)
+        with self._listings_lock:
+            listings = self._load_json(self.listings_file)
+            previous = None
+            for listing in listings:
+                if listing['id'] == listing_id:
+                    previous = dict(listing)
+                    listing['status'] = 'sold'
+                    listing['sold_at'] = datetime.now().isoformat()
+                    break
+            self._save_json(self.listings_file, listings)
+            if previous:
+                self._update_listing_indexes(added=[listing], removed=[previous])
+    
+    def store_listing_image(self, stream, filename=''):
+        """Save an uploaded listing photo under its content hash; returns its public URL"""
+        extension = os.path.splitext(filename)[1].lower()
+        if not re.fullmatch(r'\.[a-z0-9]{1,5}', extension):
+            extension = ''
+        digest, path, created = self.listing_images.put_stream(stream, extension)
+        name = self.listing_images.name_for(digest, os.path.splitext(path)[1])
+        if created:
+            self.image_pipeline.submit(name)
+        else:
+            # Re-uploaded: restart the grace period so it is not collected before the listing is saved
+            os.utime(path)
+        # Collected after the grace period unless a listing starts using it
+        self._update_image_refs(uploaded=[name])
+        return self.image_pipeline.url_prefix + name
     
     # Bookmarks
     def get_bookmarks(self, email):
@@ -346,7 +621,7 @@ class BudgetPlanner:
         listing_ids = [b['listing_id'] for b in user_bookmarks]
         
         listings = self._load_json(self.listings_file)
-        return [l for l in listings if l['id'] in listing_ids]
+        return self.image_pipeline.attach_variants([l for l in listings if l['id'] in listing_ids], self.image_proxy)
     
     def toggle_bookmark(self, listing_id, email):
         """Toggle bookmark on a listing"""
@@ -369,85 +644,196 @@ class BudgetPlanner:
         self._save_json(self.bookmarks_file, bookmarks)
         
         # Update listing bookmark count
-        listings = self._load_json(self.listings_file)
-        for listing in listings:
-            if listing['id'] == listing_id:
-                listing['bookmarks'] = len([b for b in bookmarks if b.get('listing_id') == listing_id])
-                break
-        self._save_json(self.listings_file, listings)
+        with self._listings_lock:
+            listings = self._load_json(self.listings_file)
+            for listing in listings:
+                if listing['id'] == listing_id:
+                    listing['bookmarks'] = len([b for b in bookmarks if b.get('listing_id') == listing_id])
+                    break
+            self._save_json(self.listings_file, listings)
         
         return bookmarked
     
     # Syllabus Parsing (Mocked)
     def parse_syllabus(self, filepath):
         """Parse syllabus to extract required materials"""
-        # Mock extraction - in real app would use OCR/NLP
-        extracted = {
-            'class_code': 'EECS 183',
-            'class_name': 'Introduction to Computer Science',
-            'textbooks': [
-                {'title': 'Starting Out with Python', 'isbn': '9780135929032', 'required': True},
-                {'title': 'Python Programming: An Introduction to Computer Science', 'isbn': '9781590282755', 'required': False}
-            ],
-            'supplies': ['Calculator', 'USB Drive'],
-            'instructor_notes': 'Previous editions acceptable'
+        return self._build_syllabus_result(analyze_syllabus(filepath))
+    
+    def submit_syllabus(self, filepath, filename='', content_hash=None):
+        """Queue a syllabus for parsing in the worker pool and return its job id.
+        
+        With a content hash the job id is the hash, so a syllabus that is
+        already parsed or being parsed gets its existing job back. The analysis
+        is also cached next to the file, so identical uploads skip parsing
+        even after a restart.
+        """
+        job_id = content_hash or uuid.uuid4().hex
+        cache_path = f'{filepath}.analysis.json' if content_hash else None
+        with self._syllabus_lock:
+            existing = self._syllabus_jobs.get(job_id)
+            if existing and existing['status'] != 'failed':
+                self._syllabus_jobs.move_to_end(job_id)
+                return job_id
+        
+        job = {
+            'id': job_id,
+            'filename': filename or os.path.basename(filepath),
+            'status': 'queued',
+            'created_at': datetime.now().isoformat()
         }
-        return extracted
+        cached = self._load_json(cache_path) if cache_path and os.path.exists(cache_path) else None
+        if cached:
+            job.update({
+                'status': 'done',
+                'extracted': self._build_syllabus_result(cached),
+                'finished_at': job['created_at']
+            })
+        
+        with self._syllabus_lock:
+            self._syllabus_jobs[job_id] = job
+            while len(self._syllabus_jobs) > self.SYLLABUS_JOBS_KEPT:
+                self._syllabus_jobs.popitem(last=False)
+            if cached:
+                return job_id
+            if self._syllabus_pool is None:
+                self._syllabus_pool = process_pool(self.SYLLABUS_WORKERS)
+            future = self._syllabus_pool.submit(analyze_syllabus, filepath)
+            job['future'] = future
+        future.add_done_callback(lambda done: self._finish_syllabus_job(job_id, done, cache_path))
+        return job_id
     
-    # Price Comparison (Mocked)
+    def get_syllabus_job(self, job_id):
+        """Status of a syllabus job ('queued', 'running', 'done' or 'failed'), or None"""
+        with self._syllabus_lock:
+            job = self._syllabus_jobs.get(job_id)
+            if not job:
+                return None
+            job = dict(job)
+        future = job.pop('future', None)
+        if job['status'] == 'queued' and future is not None and future.running():
+            job['status'] = 'running'
+        return job
+    
+    def _finish_syllabus_job(self, job_id, future, cache_path=None):
+        """Record a finished job's result (runs when the worker completes)"""
+        try:
+            analysis = future.result()
+            update = {'status': 'done', 'extracted': self._build_syllabus_result(analysis)}
+            if cache_path:
+                self._save_json(cache_path, analysis)
+        except Exception as e:
+            update = {'status': 'failed', 'error': str(e) or e.__class__.__name__}
+        update['finished_at'] = datetime.now().isoformat()
+        with self._syllabus_lock:
+            job = self._syllabus_jobs.get(job_id)
+            if job:
+                job.update(update)
+                job.pop('future', None)
+    
+    def _build_syllabus_result(self, analysis):
+        """Match a syllabus analysis against the class registry.
+        
+        The first class code found in the registry is the syllabus's class.
+        Its catalog textbooks are listed (those mentioned in the text first),
+        followed by any other valid ISBNs found in the text.
+        """
+        found_codes = [code for code in analysis['class_codes'] if code in self.class_registry]
+        class_code = found_codes[0] if found_codes else next(iter(analysis['class_codes']), '')
+        class_info = self.class_registry.get(class_code) if found_codes else None
+        text_lower = analysis['text'].lower()
+        
+        textbooks = []
+        for textbook in (class_info['textbooks'] if class_info else []):
+            mentioned = (textbook['isbn'] in analysis['isbns']) or textbook['title'].lower() in text_lower
+            textbooks.append(dict(textbook, mentioned=bool(mentioned)))
+        textbooks.sort(key=lambda t: not t['mentioned'])
+        
+        listed = {t['isbn'] for t in textbooks if t['isbn']}
+        for isbn in analysis['isbns']:
+            if isbn in listed:
+                continue
+            matches = self.class_registry.by_isbn(isbn)
+            textbooks.append({
+                'title': matches[0]['title'] if matches else '',
+                'isbn': isbn,
+                'required': matches[0]['required'] if matches else True,
+                'mentioned': True
+            })
+        
+        return {
+            'class_code': class_code,
+            'class_name': class_info['name'] if class_info else '',
+            'other_class_codes': found_codes[1:],
+            'textbooks': textbooks,
+            'supplies': list(class_info['supplies']) if class_info else [],
+            'instructor_notes': analysis['instructor_notes']
+        }
+    
+    # Price Comparison
     def compare_prices(self, title='', isbn='', author=''):
         """Compare prices across platforms"""
-        base_price = 120.00  # Mock base price
+        result = self.price_aggregator.compare(title, isbn, author)
+        sources = [dict(offer, platform=platform) for platform, offer in result['offers']]
+        
+        best_deal = None
+        if sources:
+            best = min(sources, key=lambda source: source['price'])
+            best_deal = {
+                'platform': best['platform'],
+                'price': best['price'],
+                'savings': round(max(source['price'] for source in sources) - best['price'], 2)
+            }
         
         comparison = {
             'title': title or 'Textbook',
             'isbn': isbn,
-            'sources': [
-                {
-                    'platform': 'Amazon Used',
-                    'price': round(base_price * 0.6, 2),
-                    'condition': 'Good',
-                    'link': '#',
-                    'availability': 'In Stock'
-                },
-                {
-                    'platform': 'Chegg Rental',
-                    'price': round(base_price * 0.3, 2),
-                    'condition': 'New',
-                    'link': '#',
-                    'availability': 'Available',
-                    'duration': 'Semester'
-                },
-                {
-                    'platform': 'ThriftBooks',
-                    'price': round(base_price * 0.5, 2),
-                    'condition': 'Very Good',
-                    'link': '#',
-                    'availability': 'In Stock'
-                },
-                {
-                    'platform': 'Lehigh Marketplace',
-                    'price': round(base_price * 0.55, 2),
-                    'condition': 'Like New',
-                    'link': '#',
-                    'availability': '3 listings available'
-                }
-            ],
-            'best_deal': {
-                'platform': 'Chegg Rental',
-                'price': round(base_price * 0.3, 2),
-                'savings': round(base_price * 0.7, 2)
-            }
+            'sources': sources,
+            'unavailable': result['unavailable'],
+            'best_deal': best_deal
         }
         
         return comparison
     
-    # AI Price Suggestion (Mocked)
+    # AI Price Suggestion
     def suggest_price(self, data):
-        """Suggest fair price based on condition, edition, demand"""
-        base_price = float(data.get('retail_price', 100))
+        """Suggest fair price based on condition, edition, demand.
+        
+        Uses the price history of active and sold listings with the same ISBN,
+        or failing that the same category, in the same condition and edition:
+        the median is suggested and the interquartile range given as the range.
+        Groups with fewer than MIN_PRICE_SAMPLES listings fall back to fixed
+        multipliers of the retail price.
+        """
         condition = data.get('condition', 'Good')
-        edition = data.get('edition', 'current')
+        edition = self._edition_key(data.get('edition', 'current'))
+        
+        history = self._get_price_history()
+        groups = []
+        if data.get('isbn'):
+            groups.append((('isbn', normalize_isbn(data['isbn']), condition, edition), 'this ISBN'))
+        if data.get('category'):
+            groups.append((('category', data['category'], condition, edition), data['category']))
+        
+        with self._stats_lock:
+            for key, label in groups:
+                sketch = history.get(key)
+                if sketch and sketch.count >= self.MIN_PRICE_SAMPLES:
+                    return {
+                        'suggested_price': round(sketch.quantile(0.5), 2),
+                        'price_range': {
+                            'min': round(sketch.quantile(0.25), 2),
+                            'max': round(sketch.quantile(0.75), 2)
+                        },
+                        'reasoning': f"Based on {sketch.count} {condition} condition, {edition} edition listings for {label}",
+                        'market_average': round(sketch.mean, 2),
+                        'sample_size': sketch.count
+                    }
+        
+        return self._suggest_price_from_retail(data, condition, edition)
+    
+    def _suggest_price_from_retail(self, data, condition, edition):
+        """Fallback suggestion from fixed condition, edition and demand multipliers"""
+        base_price = float(data.get('retail_price', 100))
         class_code = data.get('class_code', '')
         
         # Condition multipliers
@@ -467,7 +853,7 @@ class BudgetPlanner:
         
         # Demand multiplier (based on class popularity)
         demand_mult = 1.0
-        if class_code in self.LEHIGH_CLASSES:
+        if class_code in self.class_registry:
             demand_mult = 1.1  # Popular class = higher demand
         
         suggested = base_price * condition_mult.get(condition, 0.6) * edition_mult.get(edition, 1.0) * demand_mult
@@ -479,16 +865,73 @@ class BudgetPlanner:
                 'max': round(suggested * 1.1, 2)
             },
             'reasoning': f"Based on {condition} condition, {edition} edition, and class demand",
-            'market_average': round(suggested * 0.95, 2)
+            'market_average': round(suggested * 0.95, 2),
+            'sample_size': 0
         }
         
         return suggestion
     
+    def _edition_key(self, edition):
+        """Normalize a listing's edition to one of EDITIONS"""
+        edition = (edition or '').strip().lower()
+        return edition if edition in self.EDITIONS else 'current'
+    
+    def _get_price_history(self):
+        """Return the price-history sketches, building them on first use"""
+        with self._stats_lock:
+            if self._price_history is not None:
+                return self._price_history
+        with self._listings_lock, self._stats_lock:
+            if self._price_history is None:
+                self._price_history = {}
+                self._apply_price_history(self._load_json(self.listings_file), 1)
+            return self._price_history
+    
+    def _apply_price_history(self, listings, sign):
+        """Add (sign=1) or remove (sign=-1) active and sold listings; callers hold the stats lock"""
+        for listing in listings:
+            if listing.get('status') not in ('active', 'sold'):
+                continue
+            price = self._parse_price(listing.get('price', 0))
+            if price is None:
+                continue
+            
+            condition = listing.get('condition', 'Good')
+            edition = self._edition_key(listing.get('edition'))
+            keys = [('category', listing.get('category', 'textbooks'), condition, edition)]
+            isbn = normalize_isbn(listing.get('isbn'))
+            if isbn:
+                keys.append(('isbn', isbn, condition, edition))
+            
+            for key in keys:
+                sketch = self._price_history.get(key)
+                if sign > 0:
+                    if sketch is None:
+                        sketch = self._price_history[key] = QuantileSketch()
+                    sketch.add(price)
+                elif sketch is not None:
+                    sketch.remove(price)
+                    if sketch.count <= 0:
+                        del self._price_history[key]
+    
     # Class Recommendations
+    def find_classes(self, department='', isbn=''):
+        """Look up catalog classes by department and/or required textbook ISBN"""
+        if isbn:
+            codes = dict.fromkeys(m['class_code'] for m in self.class_registry.by_isbn(isbn))
+            classes = [self.class_registry.get(code) for code in codes]
+            if department:
+                classes = [c for c in classes if c['department'] == department.strip().upper()]
+        elif department:
+            classes = self.class_registry.by_department(department)
+        else:
+            classes = []
+        return copy.deepcopy(classes)
+    
     def get_class_recommendations(self, class_code):
         """Get recommended items for a class"""
-        class_code = class_code.upper()
-        class_info = self.LEHIGH_CLASSES.get(class_code, {})
+        class_code = normalize_class_code(class_code)
+        class_info = self.class_registry.get(class_code)
         
         if not class_info:
             return {
@@ -504,21 +947,23 @@ class BudgetPlanner:
             'electronics': []
         }
         
-        # Get marketplace listings for recommended items
-        listings = self._load_json(self.listings_file)
-        active_listings = [l for l in listings if l.get('status') == 'active']
-        
-        for textbook in class_info.get('textbooks', []):
-            # Find listings for this textbook
-            matching = [l for l in active_listings if textbook.lower() in l.get('title', '').lower()]
-            avg_price = sum([l['price'] for l in matching]) / len(matching) if matching else 0
-            
-            recommendations['textbooks'].append({
-                'title': textbook,
-                'required': True,
-                'average_price': round(avg_price, 2),
-                'listings_available': len(matching)
-            })
+        # Active listings for each textbook, from the maintained aggregates
+        textbook_stats = self._get_textbook_stats()
+        with self._stats_lock:
+            for textbook in class_info['textbooks']:
+                stats = textbook_stats.get((class_code, textbook['title']))
+                count = len(stats['prices']) if stats else 0
+                avg_price = stats['sum'] / count if count else 0
+                
+                recommendations['textbooks'].append({
+                    'title': textbook['title'],
+                    'isbn': textbook['isbn'],
+                    'required': textbook['required'],
+                    'average_price': round(avg_price, 2),
+                    'min_price': stats['prices'][0] if count else None,
+                    'max_price': stats['prices'][-1] if count else None,
+                    'listings_available': count
+                })
         
         for supply in class_info.get('supplies', []):
             recommendations['supplies'].append({
@@ -528,6 +973,256 @@ class BudgetPlanner:
         
         return recommendations
     
+    def _get_textbook_stats(self):
+        """Return the (class_code, textbook) price aggregates, building them on first use"""
+        version = self.class_registry.refresh()
+        with self._stats_lock:
+            if self._textbook_stats is not None and self._textbook_stats_version == version:
+                return self._textbook_stats
+        with self._listings_lock, self._stats_lock:
+            if self._textbook_stats is None:
+                self._textbook_stats = {}
+                self._textbook_stats_version = version
+                self._textbook_stats_keys = self.class_registry.textbook_keys()
+                self._apply_textbook_stats(self._load_json(self.listings_file), 1)
+            elif self._textbook_stats_version != version:
+                self._reindex_textbook_stats(version)
+            return self._textbook_stats
+    
+    def _update_textbook_stats(self, added=(), removed=()):
+        """Move changed listings in and out of the aggregates, once built; callers hold the listings lock"""
+        version = self.class_registry.refresh()
+        with self._stats_lock:
+            if self._textbook_stats is None:
+                return
+            # Reindexed aggregates come from the listings file, which already has this change
+            refreshed = self._reindex_textbook_stats(version) if self._textbook_stats_version != version else set()
+            self._apply_textbook_stats(removed, -1, skip=refreshed)
+            self._apply_textbook_stats(added, 1, skip=refreshed)
+    
+    def _reindex_textbook_stats(self, version):
+        """Bring the aggregates up to a reloaded catalog; callers hold the stats lock.
+        
+        Only textbooks that were added, removed or given different ISBNs are
+        touched: their aggregates are dropped, and the new ones are filled from
+        the listings. A reload that leaves the textbooks alone costs nothing.
+        Returns the keys that were refilled.
+        """
+        keys = self.class_registry.textbook_keys()
+        changed = {key for key in keys.keys() | self._textbook_stats_keys.keys()
+                   if keys.get(key) != self._textbook_stats_keys.get(key)}
+        for key in changed:
+            self._textbook_stats.pop(key, None)
+        added = {key for key in changed if key in keys}
+        if added:
+            self._apply_textbook_stats(self._load_json(self.listings_file), 1, only=added)
+        self._textbook_stats_keys = keys
+        self._textbook_stats_version = version
+        return added
+    
+    def _apply_textbook_stats(self, listings, sign, only=None, skip=()):
+        """Add (sign=1) or remove (sign=-1) active listings; callers hold the stats lock.
+        
+        Each aggregate keeps the price sum and a sorted price list, so count,
+        average, min and max are all constant-time reads. Listings are matched
+        to catalog textbooks by ISBN and title through the registry's lookup
+        tables, not by scanning the catalog. `only` limits the update to some
+        aggregates and `skip` leaves some out.
+        """
+        for listing in listings:
+            if listing.get('status') != 'active':
+                continue
+            price = self._parse_price(listing.get('price', 0))
+            if price is None:
+                continue
+            keys = self.class_registry.match_textbooks(listing.get('title', ''), listing.get('isbn', ''))
+            if only is not None:
+                keys &= only
+            for key in keys - set(skip):
+                stats = self._textbook_stats.setdefault(key, {'sum': 0.0, 'prices': []})
+                if sign > 0:
+                    bisect.insort(stats['prices'], price)
+                    stats['sum'] += price
+                else:
+                    index = bisect.bisect_left(stats['prices'], price)
+                    if index < len(stats['prices']) and stats['prices'][index] == price:
+                        del stats['prices'][index]
+                        stats['sum'] -= price
+                    if not stats['prices']:
+                        del self._textbook_stats[key]
+    
+    # ISBN index
+    def get_isbn_summary(self, isbn):
+        """Count, lowest and median price of the active listings for an ISBN"""
+        isbn = normalize_isbn(isbn)
+        index = self._get_isbn_index()
+        with self._stats_lock:
+            entry = index.get(isbn)
+            prices = entry['prices'] if entry else []
+            count = len(prices)
+            if count:
+                middle = count // 2
+                median = prices[middle] if count % 2 else (prices[middle - 1] + prices[middle]) / 2
+            return {
+                'isbn': isbn,
+                'count': count,
+                'min_price': prices[0] if count else None,
+                'median_price': round(median, 2) if count else None,
+                'lowest': dict(min(entry['listings'].values(), key=lambda l: l['price'])) if count else None
+            }
+    
+    def check_duplicate_listing(self, isbn, seller_email=''):
+        """Flag a new listing whose ISBN is already heavily listed or listed by the same seller"""
+        isbn = normalize_isbn(isbn)
+        if not isbn:
+            return {'isbn': '', 'active_listings': 0, 'own_listing_ids': [], 'heavily_listed': False}
+        index = self._get_isbn_index()
+        with self._stats_lock:
+            listings = index.get(isbn, {}).get('listings', {})
+            own_listing_ids = [listing_id for listing_id, l in listings.items()
+                               if seller_email and l['seller_email'] == seller_email]
+            return {
+                'isbn': isbn,
+                'active_listings': len(listings),
+                'own_listing_ids': own_listing_ids,
+                'heavily_listed': len(listings) >= self.HEAVILY_LISTED_THRESHOLD
+            }
+    
+    def _update_listing_indexes(self, added=(), removed=()):
+        """Move changed listings in and out of the maintained listing indexes; callers hold the listings lock"""
+        self._update_textbook_stats(added, removed)
+        with self._stats_lock:
+            if self._isbn_listings is not None:
+                self._apply_isbn_index(removed, -1)
+                self._apply_isbn_index(added, 1)
+            if self._price_history is not None:
+                self._apply_price_history(removed, -1)
+                self._apply_price_history(added, 1)
+        self._update_image_refs(added, removed)
+    
+    def _get_isbn_index(self):
+        """Return the ISBN -> active listings index, building it on first use"""
+        with self._stats_lock:
+            if self._isbn_listings is not None:
+                return self._isbn_listings
+        with self._listings_lock, self._stats_lock:
+            if self._isbn_listings is None:
+                self._isbn_listings = {}
+                self._apply_isbn_index(self._load_json(self.listings_file), 1)
+            return self._isbn_listings
+    
+    def _apply_isbn_index(self, listings, sign):
+        """Add (sign=1) or remove (sign=-1) active listings; callers hold the stats lock"""
+        for listing in listings:
+            isbn = normalize_isbn(listing.get('isbn'))
+            if not isbn or listing.get('status') != 'active':
+                continue
+            price = self._parse_price(listing.get('price', 0))
+            if price is None:
+                continue
+            
+            if sign > 0:
+                entry = self._isbn_listings.setdefault(isbn, {'listings': {}, 'prices': []})
+                entry['listings'][listing['id']] = {
+                    'id': listing['id'],
+                    'title': listing.get('title', ''),
+                    'price': price,
+                    'condition': listing.get('condition', ''),
+                    'seller_email': listing.get('seller_email', '')
+                }
+                bisect.insort(entry['prices'], price)
+                continue
+            
+            entry = self._isbn_listings.get(isbn)
+            indexed = entry['listings'].pop(listing['id'], None) if entry else None
+            if not indexed:
+                continue
+            index = bisect.bisect_left(entry['prices'], indexed['price'])
+            if index < len(entry['prices']) and entry['prices'][index] == indexed['price']:
+                del entry['prices'][index]
+            if not entry['listings']:
+                del self._isbn_listings[isbn]
+    
+    def _update_image_refs(self, added=(), removed=(), uploaded=()):
+        """Move changed listings' image references and delete images no listing uses any more"""
+        with self._listings_lock, self._images_lock:
+            if self._image_refs is None:
+                # Built from the listings file just written, which already reflects this change
+                self._image_refs = {}
+                self._apply_image_refs(self._load_json(self.listings_file), 1)
+                # Every stored image is a candidate, so uploads from before a restart that
+                # never made it into a listing are collected too
+                self._orphan_images.update(self._stored_image_names())
+            else:
+                self._apply_image_refs(added, 1)
+                self._apply_image_refs(removed, -1)
+            for listing in removed:
+                self._orphan_images.update(name for name in self._listing_image_names(listing)
+                                           if not self._image_refs.get(name))
+            self._orphan_images.update(uploaded)
+            if not self._orphan_images:
+                return
+            orphans = [name for name in self._orphan_images if not self._image_refs.get(name)]
+            self._orphan_images.clear()
+        
+        cutoff = time.time() - self.ORPHAN_IMAGE_GRACE
+        kept = []
+        for name in orphans:
+            digest, extension = self.listing_images.parse_name(name)
+            path = self.listing_images.path_for(digest, extension)
+            try:
+                if os.path.getmtime(path) > cutoff:
+                    kept.append(name)
+                    continue
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.image_pipeline.discard(name)
+        if kept:
+            # Retried on the next listing change or upload, or by the sweep timer
+            with self._images_lock:
+                self._orphan_images.update(kept)
+                if self._orphan_sweep is None:
+                    self._orphan_sweep = threading.Timer(self.ORPHAN_IMAGE_GRACE, self._sweep_orphan_images)
+                    self._orphan_sweep.daemon = True
+                    self._orphan_sweep.start()
+    
+    def _sweep_orphan_images(self):
+        """Timer callback: collect the orphans that were still within the grace period"""
+        with self._images_lock:
+            self._orphan_sweep = None
+        self._update_image_refs()
+    
+    def _apply_image_refs(self, listings, sign):
+        """Add (sign=1) or remove (sign=-1) listings' image references; callers hold the images lock"""
+        for listing in listings:
+            for name in self._listing_image_names(listing):
+                count = self._image_refs.get(name, 0) + sign
+                if count > 0:
+                    self._image_refs[name] = count
+                else:
+                    self._image_refs.pop(name, None)
+    
+    def _stored_image_names(self):
+        """Names of all listing images in the content store (not their variants)"""
+        names = []
+        for directory, _, files in os.walk(self.listing_images.root):
+            shard = os.path.relpath(directory, self.listing_images.root)
+            for file_name in files:
+                name = f'{shard}/{file_name}'
+                if self.listing_images.parse_name(name):
+                    names.append(name)
+        return names
+    
+    def _listing_image_names(self, listing):
+        """Stored (content-addressed) image names a listing refers to"""
+        prefix = self.image_pipeline.url_prefix
+        urls = set(listing.get('image_urls') or [])
+        urls.add(listing.get('image_url') or '')
+        return {url[len(prefix):] for url in urls
+                if isinstance(url, str) and url.startswith(prefix)
+                and self.listing_images.parse_name(url[len(prefix):])}
+    
     # Messaging
     def get_messages(self, email):
         """Get user's messages"""
@@ -559,7 +1254,6 @@ class BudgetPlanner:
         conversation = self._get_or_create_conversation(sender_email, recipient_email, listing_id)
         
         # Create message
-        messages = self._load_json(self.messages_file)
         timestamp = datetime.now().isoformat()
         
         new_message = {
@@ -573,157 +1267,204 @@ class BudgetPlanner:
             'read': False
         }
         
-        messages.append(new_message)
-        self._save_json(self.messages_file, messages)
-        
-        # Update conversation last_message
-        conversations = self._load_json(self.conversations_file)
-        for conv in conversations:
-            if conv['id'] == conversation['id']:
+        with self._index_lock:
+            self._messages.append(new_message)
+            self._save_json(self.messages_file, self._messages)
+            self._index_message(new_message)
+            new_message = copy.deepcopy(new_message)
+            
+            # Update conversation last_message
+            conv = self._conversations_by_id.get(conversation['id'])
+            if conv:
                 conv['last_message'] = content[:50]
                 conv['last_message_time'] = timestamp
-                break
-        self._save_json(self.conversations_file, conversations)
+                self._save_json(self.conversations_file, self._conversations)
+        
+        self._record_inbox_message(conversation, new_message)
+        self._notify_change(conversation['participants'], conversation['id'])
         
         return new_message
     
     def get_conversations(self, email):
-        """Get all conversations for a user"""
-        conversations = self._load_json(self.conversations_file)
-        messages = self._load_json(self.messages_file)
-        users = self._load_json(self.users_file)
-        listings = self._load_json(self.listings_file)
-        
-        user_conversations = []
-        for conv in conversations:
-            if email in conv['participants']:
-                # Get other participant (skip if same user twice - edge case)
-                other_participants = [p for p in conv['participants'] if p != email]
-                if not other_participants:
-                    # Skip conversations where user is talking to themselves
-                    continue
-                other_email = other_participants[0]
-                
-                # Try to get user from users table first
-                other_user = next((u for u in users if u['email'] == other_email), None)
-                
-                # Get listing info (need it to potentially get seller name)
-                listing = None
-                if conv.get('listing_id'):
-                    listing = next((l for l in listings if l['id'] == conv['listing_id']), None)
-                
-                # Determine nickname - prefer user table, fallback to listing seller name
-                other_nickname = 'Unknown'
-                if other_user:
-                    other_nickname = other_user.get('nickname', 'Unknown')
-                elif listing and listing.get('contact') == other_email:
-                    # User not in users table, but they're the seller in the listing
-                    other_nickname = listing.get('seller_name', 'Unknown')
-                
-                # Count unread messages
-                unread = len([m for m in messages if m['conversation_id'] == conv['id'] 
-                             and m['sender_email'] != email and not m.get('read', False)])
-                
-                listing_data = None
-                if listing:
-                    # Get first image from image_urls array or legacy image_url
-                    image_url = ''
-                    if listing.get('image_urls') and len(listing['image_urls']) > 0:
-                        image_url = listing['image_urls'][0]
-                    elif listing.get('image_url'):
-                        image_url = listing['image_url']
-                    
-                    listing_data = {
-                        'id': listing['id'],
-                        'title': listing['title'],
-                        'image_url': image_url
-                    }
-                
-                user_conversations.append({
-                    'id': conv['id'],
-                    'other_user': {
-                        'email': other_email,
-                        'nickname': other_nickname
-                    },
-                    'listing': listing_data,
-                    'last_message': conv.get('last_message', ''),
-                    'last_message_time': conv.get('last_message_time', conv['created_at']),
-                    'unread_count': unread
-                })
+        """Get all conversations for a user from the materialized inbox"""
+        inbox = self._get_inbox()
+        blocked = self._blocked_set(email)
+        with self._index_lock:
+            user_conversations = copy.deepcopy([c for c in inbox.get(email, {}).values()
+                                                if c['other_user']['email'] not in blocked])
         
         # Sort by last message time
         user_conversations.sort(key=lambda x: x['last_message_time'], reverse=True)
         return user_conversations
     
-    def get_conversation_messages(self, conversation_id, email):
-        """Get all messages in a conversation"""
-        conversations = self._load_json(self.conversations_file)
-        conversation = next((c for c in conversations if c['id'] == conversation_id), None)
-        
-        if not conversation:
-            return {'error': 'Conversation not found', 'status': 404}
-        
-        # Verify user is participant
-        if email not in conversation['participants']:
-            return {'error': 'Unauthorized', 'status': 403}
-        
-        # Get messages
-        messages = self._load_json(self.messages_file)
-        conv_messages = [m for m in messages if m['conversation_id'] == conversation_id]
-        conv_messages.sort(key=lambda x: x['timestamp'])
-        
-        # Mark messages as read
-        for msg in conv_messages:
-            if msg['sender_email'] != email and not msg.get('read', False):
-                msg['read'] = True
-        self._save_json(self.messages_file, messages)
-        
-        return conv_messages
+    def get_conversation_messages(self, conversation_id, email, limit=None, before=None):
+        """Get messages in a conversation.
+        
+        Without `limit` the whole thread is returned. With `limit` a page of the
+        newest messages sent before the `before` message id (or the newest
+        overall) is returned, oldest first, as {'messages', 'has_more',
+        'next_before'} so clients can walk back through long threads. Pages
+        are sliced from the conversation's indexed message ids, and only the
+        messages returned are marked read.
+        """
+        self._get_inbox()
+        blocked = self._blocked_set(email)
+        with self._index_lock:
+            conversation = self._inbox_conversations.get(conversation_id)
+            
+            if not conversation:
+                return {'error': 'Conversation not found', 'status': 404}
+            
+            # Verify user is participant
+            if email not in conversation['participants']:
+                return {'error': 'Unauthorized', 'status': 403}
+            
+            message_ids = self._conversation_messages.get(conversation_id, [])
+            end = len(message_ids)
+            if before:
+                message = self._messages_by_id.get(before)
+                if not message or message['conversation_id'] != conversation_id:
+                    return {'error': 'Unknown message cursor', 'status': 400}
+                end = self._message_positions[before]
+            
+            # Walk back from the cursor, leaving out messages from users the reader has blocked
+            page = []
+            start = end
+            while start > 0 and (limit is None or len(page) < limit):
+                start -= 1
+                message = self._messages_by_id[message_ids[start]]
+                if message['sender_email'] not in blocked:
+                    page.append(message)
+            page.reverse()
+            
+            # Mark the returned messages as read
+            unread = [m for m in page if m['sender_email'] != email and not m.get('read', False)]
+            for message in unread:
+                message['read'] = True
+            if unread:
+                self._save_json(self.messages_file, self._messages)
+                self._mark_inbox_read(conversation_id, email, len(unread))
+            page = copy.deepcopy(page)
+        
+        if unread:
+            self._notify_change(conversation['participants'], conversation_id)
+        
+        if limit is None:
+            return page
+        return {
+            'messages': page,
+            'has_more': start > 0,
+            'next_before': page[0]['id'] if start > 0 else None
+        }
+    
+    def get_conversation_for_listing(self, email, other_email, listing_id, create=False):
+        """Get the user's conversation with another user about a listing.
+        
+        Returns the inbox summary of the conversation, creating the
+        conversation first when `create` is set, or None if there is none.
+        """
+        if email == other_email:
+            return {'error': 'You cannot message yourself', 'status': 400}
+        
+        key = (tuple(sorted([email, other_email])), listing_id)
+        inbox = self._get_inbox()
+        with self._index_lock:
+            conversation_id = self._conversation_keys.get(key)
+        
+        if not conversation_id:
+            if not create:
+                return None
+            conversation = self._get_or_create_conversation(email, other_email, listing_id)
+            conversation_id = conversation['id']
+            self._notify_change(conversation['participants'], conversation_id)
+        
+        with self._index_lock:
+            return copy.deepcopy(inbox[email][conversation_id])
+    
+    def get_unread_count(self, email):
+        """Get the total number of unread messages across a user's conversations"""
+        inbox = self._get_inbox()
+        blocked = self._blocked_set(email)
+        with self._index_lock:
+            total = self._unread_totals.get(email, 0)
+            if blocked:
+                # Conversations with blocked users are hidden, so are their unread messages
+                total -= sum(c['unread_count'] for c in inbox.get(email, {}).values()
+                             if c['other_user']['email'] in blocked)
+            return total
+    
+    def is_conversation_participant(self, conversation_id, email):
+        """Check whether a user takes part in a conversation"""
+        self._get_inbox()
+        with self._index_lock:
+            meta = self._inbox_conversations.get(conversation_id)
+            return bool(meta) and email in meta['participants']
+    
+    def get_inbox_version(self, email):
+        """Get the change version of a user's conversation list"""
+        with self._change_cond:
+            return self._user_versions.get(email, self._base_version)
+    
+    def get_conversation_version(self, conversation_id):
+        """Get the change version of a single conversation"""
+        with self._change_cond:
+            return self._conversation_versions.get(conversation_id, self._base_version)
+    
+    def wait_for_inbox_change(self, email, since, timeout):
+        """Block until the user's inbox version differs from `since` or the timeout passes"""
+        return self._wait_for_version(self._user_versions, email, since, timeout)
+    
+    def wait_for_conversation_change(self, conversation_id, since, timeout):
+        """Block until the conversation version differs from `since` or the timeout passes"""
+        return self._wait_for_version(self._conversation_versions, conversation_id, since, timeout)
     
     def react_to_message(self, message_id, email, reaction):
         """Add or remove a reaction to a message"""
-        messages = self._load_json(self.messages_file)
-        message = next((m for m in messages if m['id'] == message_id), None)
-        
-        if not message:
-            return {'error': 'Message not found', 'status': 404}
-        
-        # Verify user is in conversation
-        conversations = self._load_json(self.conversations_file)
-        conversation = next((c for c in conversations if c['id'] == message['conversation_id']), None)
-        if not conversation or email not in conversation['participants']:
-            return {'error': 'Unauthorized', 'status': 403}
-        
-        # Toggle reaction
-        reactions = message.get('reactions', [])
-        existing = next((r for r in reactions if r['user'] == email), None)
-        
-        if existing:
-            if existing['type'] == reaction:
-                # Remove reaction
-                reactions = [r for r in reactions if r['user'] != email]
+        self._get_inbox()
+        with self._index_lock:
+            message = self._messages_by_id.get(message_id)
+            
+            if not message:
+                return {'error': 'Message not found', 'status': 404}
+            
+            # Verify user is in conversation
+            conversation = self._inbox_conversations.get(message['conversation_id'])
+            if not conversation or email not in conversation['participants']:
+                return {'error': 'Unauthorized', 'status': 403}
+            
+            # Toggle reaction
+            reactions = message.get('reactions', [])
+            existing = next((r for r in reactions if r['user'] == email), None)
+            
+            if existing:
+                if existing['type'] == reaction:
+                    # Remove reaction
+                    reactions = [r for r in reactions if r['user'] != email]
+                else:
+                    # Update reaction
+                    existing['type'] = reaction
             else:
-                # Update reaction
-                existing['type'] = reaction
-        else:
-            # Add new reaction
-            reactions.append({'user': email, 'type': reaction})
+                # Add new reaction
+                reactions.append({'user': email, 'type': reaction})
+            
+            message['reactions'] = reactions
+            self._save_json(self.messages_file, self._messages)
+            reactions = copy.deepcopy(reactions)
         
-        message['reactions'] = reactions
-        self._save_json(self.messages_file, messages)
+        self._notify_change(conversation['participants'], message['conversation_id'])
         
         return {'success': True, 'reactions': reactions}
     
     def report_message(self, message_id, reporter_email, reason):
         """Report a message for moderation"""
-        messages = self._load_json(self.messages_file)
-        message = next((m for m in messages if m['id'] == message_id), None)
+        self._get_inbox()
+        with self._index_lock:
+            found = message_id in self._messages_by_id
         
-        if not message:
+        if not found:
             return {'error': 'Message not found', 'status': 404}
         
         # Create report
-        reports = self._load_json(self.reports_file)
         new_report = {
             'id': f"report_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}",
             'message_id': message_id,
@@ -733,142 +1474,543 @@ class BudgetPlanner:
             'status': 'pending'
         }
         
-        reports.append(new_report)
-        self._save_json(self.reports_file, reports)
+        self._get_reports()
+        with self._reports_lock:
+            self._index_report(new_report)
+            report_count = self._message_report_counts[message_id]
+        self._schedule_reports_flush()
         
-        # Auto-hide message if multiple reports
-        message_reports = [r for r in reports if r['message_id'] == message_id]
-        if len(message_reports) >= 3:
-            message['hidden'] = True
-            self._save_json(self.messages_file, messages)
+        # Auto-hide message once it reaches the report threshold
+        if report_count == self.AUTO_HIDE_REPORTS:
+            self._set_messages_hidden([message_id], True)
         
-        return {'success': True, 'report': new_report}
+        return {'success': True, 'report': dict(new_report)}
     
-    def block_user(self, blocker_email, blocked_email):
-        """Block a user from sending messages"""
-        blocks = self._load_json(self.blocks_file)
+    def get_moderation_queue(self, status='pending', offset=0, limit=50):
+        """Page through reports with a given status, oldest first.
+        
+        Each report carries the reported message's current content, sender and
+        hidden flag, plus how many reports that message has received.
+        """
+        reports = self._get_reports()
+        with self._reports_lock:
+            report_ids = self._reports_by_status.get(status, {})
+            total = len(report_ids)
+            page = [dict(reports[report_id])
+                    for report_id in itertools.islice(report_ids, offset, offset + limit)]
+            for report in page:
+                report['message_report_count'] = self._message_report_counts.get(report['message_id'], 0)
+        
+        if page:
+            self._get_inbox()
+            with self._index_lock:
+                for report in page:
+                    message = self._messages_by_id.get(report['message_id'])
+                    report['message'] = {
+                        'content': message['content'],
+                        'sender_email': message['sender_email'],
+                        'conversation_id': message['conversation_id'],
+                        'hidden': message.get('hidden', False)
+                    } if message else None
+        
+        return {'reports': page, 'total': total, 'offset': offset, 'limit': limit}
+    
+    def resolve_reports(self, report_ids, moderator_email, action='dismiss', note=''):
+        """Resolve pending reports in bulk.
+        
+        `action` is 'dismiss' (leave the messages as they are), 'hide' (hide the
+        reported messages) or 'restore' (unhide them).
+        """
+        if action not in ('dismiss', 'hide', 'restore'):
+            return {'error': 'Invalid action', 'status': 400}
+        
+        reports = self._get_reports()
+        resolved_at = datetime.now().isoformat()
+        message_ids = set()
+        resolved = 0
+        with self._reports_lock:
+            for report_id in report_ids:
+                report = reports.get(report_id)
+                if not report or report['status'] == 'resolved':
+                    continue
+                self._reports_by_status.get(report['status'], {}).pop(report_id, None)
+                report.update({
+                    'status': 'resolved',
+                    'resolution': action,
+                    'resolved_by': moderator_email,
+                    'resolved_at': resolved_at,
+                    'note': note
+                })
+                self._reports_by_status.setdefault('resolved', {})[report_id] = None
+                message_ids.add(report['message_id'])
+                resolved += 1
         
-        # Check if already blocked
-        existing = next((b for b in blocks if b['blocker'] == blocker_email and b['blocked'] == blocked_email), None)
-        if existing:
-            return {'success': True, 'message': 'User already blocked'}
+        if resolved:
+            self._schedule_reports_flush()
+        if action != 'dismiss' and message_ids:
+            self._set_messages_hidden(message_ids, action == 'hide')
         
-        new_block = {
-            'id': f"block_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}",
-            'blocker': blocker_email,
-            'blocked': blocked_email,
-            'timestamp': datetime.now().isoformat()
-        }
+        return {'success': True, 'resolved': resolved}
+    
+    def flush_reports(self):
+        """Write the report index to reports.json if it has unsaved changes"""
+        with self._reports_flush_lock:
+            with self._reports_lock:
+                if self._reports is None or not self._reports_dirty.is_set():
+                    return
+                self._reports_dirty.clear()
+                snapshot = [dict(report) for report in self._reports.values()]
+            self._save_json(self.reports_file, snapshot)
+    
+    def block_user(self, blocker_email, blocked_email):
+        """Block a user from sending messages"""
+        self._get_blocks()
+        with self._blocks_lock:
+            # Check if already blocked
+            if blocked_email in self._blocked_by_user.get(blocker_email, ()):
+                return {'success': True, 'message': 'User already blocked'}
+            
+            new_block = {
+                'id': f"block_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}",
+                'blocker': blocker_email,
+                'blocked': blocked_email,
+                'timestamp': datetime.now().isoformat()
+            }
+            
+            self._index_block(new_block)
+            self._save_json(self.blocks_file, self._blocks)
         
-        blocks.append(new_block)
-        self._save_json(self.blocks_file, blocks)
+        # The blocker's inbox and threads now hide the blocked user
+        self._notify_change([blocker_email])
         
         return {'success': True, 'block': new_block}
     
     def get_blocked_users(self, email):
         """Get list of users blocked by this user"""
-        blocks = self._load_json(self.blocks_file)
-        blocked = [b['blocked'] for b in blocks if b['blocker'] == email]
-        return blocked
+        self._get_blocks()
+        with self._blocks_lock:
+            return sorted(self._blocked_by_user.get(email, ()))
     
     def delete_conversation(self, user_email, conversation_id):
         """Delete a conversation for a user"""
-        conversations = self._load_json(self.conversations_file)
-        
-        # Find conversation
-        conv = next((c for c in conversations if c['id'] == conversation_id), None)
-        if not conv:
-            return {'error': 'Conversation not found', 'status': 404}
-        
-        # Check if user is participant
-        if user_email not in conv['participants']:
-            return {'error': 'Unauthorized', 'status': 403}
-        
-        # Delete all messages in this conversation
-        messages = self._load_json(self.messages_file)
-        messages = [m for m in messages if m.get('conversation_id') != conversation_id]
-        self._save_json(self.messages_file, messages)
-        
-        # Delete the conversation
-        conversations = [c for c in conversations if c['id'] != conversation_id]
-        self._save_json(self.conversations_file, conversations)
+        self._get_inbox()
+        with self._index_lock:
+            # Find conversation
+            conv = self._conversations_by_id.get(conversation_id)
+            if not conv:
+                return {'error': 'Conversation not found', 'status': 404}
+            
+            # Check if user is participant
+            if user_email not in conv['participants']:
+                return {'error': 'Unauthorized', 'status': 403}
+            
+            # Delete all messages in this conversation
+            removed_ids = list(self._conversation_messages.get(conversation_id, []))
+            self._messages = [m for m in self._messages if m.get('conversation_id') != conversation_id]
+            self._save_json(self.messages_file, self._messages)
+            
+            # Delete the conversation
+            self._conversations = [c for c in self._conversations if c['id'] != conversation_id]
+            del self._conversations_by_id[conversation_id]
+            self._save_json(self.conversations_file, self._conversations)
+            
+            self._remove_inbox_conversation(conversation_id, removed_ids)
+        self._notify_change(conv['participants'], conversation_id)
         
         return {'success': True, 'message': 'Conversation deleted'}
     
     def _get_or_create_conversation(self, email1, email2, listing_id=None):
         """Get existing conversation or create new one"""
-        conversations = self._load_json(self.conversations_file)
-        
-        # Check for existing conversation
         participants = sorted([email1, email2])
-        existing = next((c for c in conversations if sorted(c['participants']) == participants 
-                        and c.get('listing_id') == listing_id), None)
-        
-        if existing:
-            return existing
-        
-        # Create new conversation
-        new_conversation = {
-            'id': f"conv_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}",
-            'participants': participants,
-            'listing_id': listing_id,
-            'created_at': datetime.now().isoformat(),
-            'last_message': '',
-            'last_message_time': datetime.now().isoformat()
-        }
-        
-        conversations.append(new_conversation)
-        self._save_json(self.conversations_file, conversations)
-        
-        return new_conversation
+        key = (tuple(participants), listing_id)
+        self._get_inbox()
+        
+        # Look up and create under the index lock so concurrent first
+        # messages cannot open duplicate threads
+        with self._index_lock:
+            conversation_id = self._conversation_keys.get(key)
+            if conversation_id:
+                return dict(self._inbox_conversations[conversation_id], id=conversation_id)
+            
+            # Create new conversation
+            new_conversation = {
+                'id': f"conv_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}",
+                'participants': participants,
+                'listing_id': listing_id,
+                'created_at': datetime.now().isoformat(),
+                'last_message': '',
+                'last_message_time': datetime.now().isoformat()
+            }
+            
+            self._conversations.append(new_conversation)
+            self._conversations_by_id[new_conversation['id']] = new_conversation
+            self._save_json(self.conversations_file, self._conversations)
+            
+            nicknames = self.resolve_nicknames(participants)
+            listings_by_id = {l['id']: l for l in self._load_json(self.listings_file)}
+            self._index_conversation(new_conversation, nicknames, listings_by_id)
+            return dict(new_conversation)
     
     def _is_blocked(self, sender_email, recipient_email):
         """Check if sender is blocked by recipient"""
-        blocks = self._load_json(self.blocks_file)
-        return any(b['blocker'] == recipient_email and b['blocked'] == sender_email for b in blocks)
+        self._get_blocks()
+        with self._blocks_lock:
+            return recipient_email in self._blockers_of_user.get(sender_email, ())
+    
+    def _blocked_set(self, email):
+        """Snapshot of the users a user has blocked"""
+        self._get_blocks()
+        with self._blocks_lock:
+            return frozenset(self._blocked_by_user.get(email, ()))
+    
+    def _get_users(self):
+        """Return the user directory, indexing users.json on first use"""
+        with self._users_lock:
+            if self._users is None:
+                self._users = {}
+                self._nickname_owners = {}
+                for user in self._load_json(self.users_file):
+                    self._users[user['email']] = user
+                    if user.get('nickname'):
+                        self._nickname_owners.setdefault(user['nickname'].lower(), user['email'])
+            return self._users
+    
+    def _default_nickname(self, email):
+        """The email's local part, numbered (sam2, sam3, ...) while unique nicknames are taken; callers hold the users lock"""
+        base = email.split('@')[0]
+        if not self.unique_nicknames:
+            return base
+        nickname = base
+        suffix = 2
+        while self._nickname_owners.get(nickname.lower()) not in (None, email):
+            nickname = f'{base}{suffix}'
+            suffix += 1
+        return nickname
+    
+    def _release_nickname(self, user):
+        """Free a user's current nickname in the uniqueness index; callers hold the users lock"""
+        key = (user.get('nickname') or '').lower()
+        if self._nickname_owners.get(key) == user['email']:
+            del self._nickname_owners[key]
+    
+    def _get_blocks(self):
+        """Return the block list, indexing it from blocks.json on first use"""
+        with self._blocks_lock:
+            if self._blocks is None:
+                self._blocks = []
+                self._blocked_by_user = {}
+                self._blockers_of_user = {}
+                for block in self._load_json(self.blocks_file):
+                    self._index_block(block)
+            return self._blocks
+    
+    def _index_block(self, block):
+        """Add a block to the list and both set indexes; callers hold the blocks lock"""
+        self._blocks.append(block)
+        self._blocked_by_user.setdefault(block['blocker'], set()).add(block['blocked'])
+        self._blockers_of_user.setdefault(block['blocked'], set()).add(block['blocker'])
+    
+    # Inbox summaries
+    def _get_inbox(self):
+        """Return the per-user inbox index, building it from disk on first use"""
+        with self._index_lock:
+            if self._inbox is None:
+                self._build_inbox()
+            return self._inbox
+    
+    def _build_inbox(self):
+        """Build inbox summaries for every user in one pass over the data files"""
+        conversations = self._load_json(self.conversations_file)
+        messages = self._load_json(self.messages_file)
+        nicknames = self.resolve_nicknames({email for c in conversations for email in c['participants']})
+        listings_by_id = {l['id']: l for l in self._load_json(self.listings_file)}
+        
+        # Count unread messages per (conversation, reader) with a single scan
+        participants = {c['id']: c['participants'] for c in conversations}
+        unread = {}
+        for msg in messages:
+            if msg.get('read', False):
+                continue
+            for email in participants.get(msg['conversation_id'], []):
+                if email != msg['sender_email']:
+                    key = (msg['conversation_id'], email)
+                    unread[key] = unread.get(key, 0) + 1
+        
+        self._inbox = {}
+        self._inbox_conversations = {}
+        self._listing_conversations = {}
+        self._conversation_keys = {}
+        self._unread_totals = {}
+        for conv in conversations:
+            self._index_conversation(conv, nicknames, listings_by_id, unread)
+        
+        self._conversations = conversations
+        self._conversations_by_id = {conv['id']: conv for conv in conversations}
+        self._messages = messages
+        self._messages_by_id = {}
+        self._conversation_messages = {}
+        self._message_positions = {}
+        for msg in sorted(messages, key=lambda m: m['timestamp']):
+            self._index_message(msg)
+    
+    def _index_message(self, message):
+        """Append a message to its conversation's ordered ids; callers hold the index lock"""
+        message_ids = self._conversation_messages.setdefault(message['conversation_id'], [])
+        self._message_positions[message['id']] = len(message_ids)
+        message_ids.append(message['id'])
+        self._messages_by_id[message['id']] = message
+    
+    def _index_conversation(self, conv, nicknames, listings_by_id, unread=None):
+        """Add a conversation's summary to each participant's inbox"""
+        unread = unread or {}
+        listing_id = conv.get('listing_id')
+        self._inbox_conversations[conv['id']] = {
+            'participants': list(conv['participants']),
+            'listing_id': listing_id
+        }
+        self._conversation_keys[(tuple(sorted(conv['participants'])), listing_id)] = conv['id']
+        if listing_id:
+            self._listing_conversations.setdefault(listing_id, set()).add(conv['id'])
+        listing = listings_by_id.get(listing_id) if listing_id else None
+        
+        for email in conv['participants']:
+            # Skip conversations where user is talking to themselves
+            other_participants = [p for p in conv['participants'] if p != email]
+            if not other_participants:
+                continue
+            other_email = other_participants[0]
+            unread_count = unread.get((conv['id'], email), 0)
+            self._unread_totals[email] = self._unread_totals.get(email, 0) + unread_count
+            self._inbox.setdefault(email, {})[conv['id']] = {
+                'id': conv['id'],
+                'other_user': {
+                    'email': other_email,
+                    'nickname': self._resolve_nickname(other_email, nicknames, listing)
+                },
+                'listing': self._listing_card(listing),
+                'last_message': conv.get('last_message', ''),
+                'last_message_time': conv.get('last_message_time', conv['created_at']),
+                'unread_count': unread_count
+            }
+    
+    def _resolve_nickname(self, email, nicknames, listing=None):
+        """Nickname from resolve_nicknames, falling back to the listing's seller name"""
+        if email in nicknames:
+            return nicknames[email]
+        if listing and listing.get('contact') == email:
+            # User not in users table, but they're the seller in the listing
+            return listing.get('seller_name', 'Unknown')
+        return 'Unknown'
+    
+    def _listing_card(self, listing):
+        """Compact listing info shown next to a conversation"""
+        if not listing:
+            return None
+        # Get first image from image_urls array or legacy image_url
+        image_url = ''
+        if listing.get('image_urls') and len(listing['image_urls']) > 0:
+            image_url = listing['image_urls'][0]
+        elif listing.get('image_url'):
+            image_url = listing['image_url']
+        return {
+            'id': listing['id'],
+            'title': listing['title'],
+            'image_url': image_url
+        }
+    
+    def _record_inbox_message(self, conversation, message):
+        """Update both participants' summaries after a message is sent"""
+        with self._index_lock:
+            if self._inbox is None:
+                return
+            for email in conversation['participants']:
+                entry = self._inbox.get(email, {}).get(conversation['id'])
+                if not entry:
+                    continue
+                entry['last_message'] = message['content'][:50]
+                entry['last_message_time'] = message['timestamp']
+                if email != message['sender_email']:
+                    entry['unread_count'] += 1
+                    self._unread_totals[email] = self._unread_totals.get(email, 0) + 1
+    
+    def _mark_inbox_read(self, conversation_id, email, count):
+        """Take `count` newly read messages off a reader's unread count"""
+        with self._index_lock:
+            if self._inbox is None:
+                return
+            entry = self._inbox.get(email, {}).get(conversation_id)
+            if entry:
+                count = min(count, entry['unread_count'])
+                self._unread_totals[email] = self._unread_totals.get(email, 0) - count
+                entry['unread_count'] -= count
+    
+    def _remove_inbox_conversation(self, conversation_id, message_ids=()):
+        """Drop a deleted conversation (and its messages) from every participant's inbox"""
+        with self._index_lock:
+            if self._inbox is None:
+                return
+            for message_id in message_ids:
+                self._messages_by_id.pop(message_id, None)
+                self._message_positions.pop(message_id, None)
+            self._conversation_messages.pop(conversation_id, None)
+            meta = self._inbox_conversations.pop(conversation_id, None)
+            if not meta:
+                return
+            self._conversation_keys.pop((tuple(sorted(meta['participants'])), meta['listing_id']), None)
+            for email in meta['participants']:
+                entry = self._inbox.get(email, {}).pop(conversation_id, None)
+                if entry:
+                    self._unread_totals[email] = self._unread_totals.get(email, 0) - entry['unread_count']
+            if meta['listing_id']:
+                self._listing_conversations.get(meta['listing_id'], set()).discard(conversation_id)
+    
+    def _inbox_conversation_ids(self, email):
+        """Ids of the conversations a user takes part in"""
+        with self._index_lock:
+            if self._inbox is None:
+                return []
+            return list(self._inbox.get(email, {}).keys())
+    
+    def _listing_conversation_ids(self, listing_id):
+        """Ids of the conversations about a listing"""
+        with self._index_lock:
+            if self._inbox is None:
+                return []
+            return list(self._listing_conversations.get(listing_id, ()))
+    
+    def _refresh_inbox_entries(self, conversation_ids):
+        """Recompute nicknames and listing cards after a user or listing changes"""
+        if not conversation_ids:
+            return
+        with self._index_lock:
+            emails = {email for conversation_id in conversation_ids
+                      for email in self._inbox_conversations.get(conversation_id, {}).get('participants', [])}
+        nicknames = self.resolve_nicknames(emails)
+        listings_by_id = {l['id']: l for l in self._load_json(self.listings_file)}
+        
+        changed = set()
+        with self._index_lock:
+            for conversation_id in conversation_ids:
+                meta = self._inbox_conversations.get(conversation_id)
+                if not meta:
+                    continue
+                listing = listings_by_id.get(meta['listing_id']) if meta['listing_id'] else None
+                for email in meta['participants']:
+                    entry = self._inbox.get(email, {}).get(conversation_id)
+                    if not entry:
+                        continue
+                    entry['other_user']['nickname'] = self._resolve_nickname(
+                        entry['other_user']['email'], nicknames, listing)
+                    entry['listing'] = self._listing_card(listing)
+                    changed.add(email)
+        
+        if changed:
+            self._notify_change(changed)
+    
+    def _notify_change(self, emails, conversation_id=None):
+        """Bump change versions and wake any long-polling requests"""
+        with self._change_cond:
+            self._change_seq += 1
+            for email in emails:
+                self._user_versions[email] = self._change_seq
+            if conversation_id:
+                self._conversation_versions[conversation_id] = self._change_seq
+            self._change_cond.notify_all()
+    
+    def _wait_for_version(self, versions, key, since, timeout):
+        """Wait on the change condition until versions[key] != since, return the current version"""
+        deadline = time.monotonic() + timeout
+        with self._change_cond:
+            while True:
+                current = versions.get(key, self._base_version)
+                remaining = deadline - time.monotonic()
+                if since is None or current != since or remaining <= 0:
+                    return current
+                self._change_cond.wait(remaining)
     
     def _moderate_content(self, content):
         """Check content for inappropriate material"""
-        # Profanity filter
-        profanity_list = [
-            'fuck', 'shit', 'ass', 'bitch', 'damn', 'crap', 'hell',
-            'bastard', 'dick', 'pussy', 'cock', 'slut', 'whore'
-        ]
-        
-        content_lower = content.lower()
-        for word in profanity_list:
-            if word in content_lower:
-                return {'allowed': False, 'reason': 'Inappropriate language detected'}
-        
-        # Spam detection (too many repeated characters or all caps)
-        if len(content) > 20:
-            if content.isupper():
-                return {'allowed': False, 'reason': 'Please do not use all caps'}
-            
-            # Check for excessive character repetition
-            for i in range(len(content) - 5):
-                if len(set(content[i:i+6])) == 1:
-                    return {'allowed': False, 'reason': 'Spam detected'}
-        
-        # Detect potential scam patterns
-        scam_patterns = [
-            r'venmo.*\$\d+',
-            r'paypal.*\$\d+',
-            r'cash.*app',
-            r'send.*money',
-            r'bitcoin',
-            r'cryptocurrency'
-        ]
-        
-        for pattern in scam_patterns:
-            if re.search(pattern, content_lower):
-                return {'allowed': False, 'reason': 'Suspicious content detected. Please use safe payment methods.'}
-        
-        return {'allowed': True, 'reason': ''}
+        return self.moderation.check(content)
+    
+    # Report queue
+    def _get_reports(self):
+        """Return the report index, loading it from reports.json on first use"""
+        with self._reports_lock:
+            if self._reports is None:
+                self._reports = {}
+                self._message_report_counts = {}
+                self._reports_by_status = {}
+                for report in self._load_json(self.reports_file):
+                    self._index_report(report)
+            return self._reports
+    
+    def _index_report(self, report):
+        """Add a report to the index; callers hold the reports lock"""
+        self._reports[report['id']] = report
+        message_id = report['message_id']
+        self._message_report_counts[message_id] = self._message_report_counts.get(message_id, 0) + 1
+        self._reports_by_status.setdefault(report.get('status', 'pending'), {})[report['id']] = None
+    
+    def _schedule_reports_flush(self):
+        """Mark the report index dirty and make sure the writer thread is running"""
+        with self._reports_lock:
+            self._reports_dirty.set()
+            if self._reports_writer is None:
+                self._reports_writer = threading.Thread(
+                    target=self._write_reports, name='reports-writer', daemon=True)
+                self._reports_writer.start()
+    
+    def _write_reports(self):
+        """Background writer: save the report index shortly after it changes"""
+        while True:
+            self._reports_dirty.wait()
+            time.sleep(self.REPORTS_FLUSH_DELAY)
+            self.flush_reports()
+    
+    def _set_messages_hidden(self, message_ids, hidden):
+        """Hide or unhide messages and wake the affected conversations"""
+        self._get_inbox()
+        conversation_ids = set()
+        with self._index_lock:
+            for message_id in set(message_ids):
+                message = self._messages_by_id.get(message_id)
+                if message and message.get('hidden', False) != hidden:
+                    message['hidden'] = hidden
+                    conversation_ids.add(message['conversation_id'])
+            if not conversation_ids:
+                return
+            self._save_json(self.messages_file, self._messages)
+        
+        for conversation_id in conversation_ids:
+            with self._index_lock:
+                meta = self._inbox_conversations.get(conversation_id)
+            if meta:
+                self._notify_change(meta['participants'], conversation_id)
     
     # Budget Estimation
     def estimate_semester_budget(self, data):
         """Estimate semester budget"""
+        return self.estimate_semester_budgets([data])[0]
+    
+    def estimate_semester_budgets(self, schedules):
+        """Estimate budgets for many schedules at once.
+        
+        Each class's textbook cost is looked up once from the price aggregates
+        and shared by every schedule that includes it.
+        """
+        class_costs = {}
+        for data in schedules:
+            for class_code in data.get('classes', []):
+                class_code = class_code.upper()
+                if class_code not in class_costs:
+                    recommendations = self.get_class_recommendations(class_code)
+                    class_costs[class_code] = sum(t.get('average_price', 0)
+                                                  for t in recommendations.get('textbooks', []))
+        
+        return [self._estimate_budget(data, class_costs) for data in schedules]
+    
+    def _estimate_budget(self, data, class_costs):
+        """Budget estimate for one schedule, given each class's textbook cost"""
         classes = data.get('classes', [])
         estimated_budget = data.get('estimated_budget', 0)
         
@@ -881,10 +2023,8 @@ class BudgetPlanner:
         }
         
         for class_code in classes:
-            recommendations = self.get_class_recommendations(class_code)
-            for textbook in recommendations.get('textbooks', []):
-                breakdown['textbooks'] += textbook.get('average_price', 0)
-                total_estimated += textbook.get('average_price', 0)
+            breakdown['textbooks'] += class_costs[class_code.upper()]
+            total_estimated += class_costs[class_code.upper()]
         
         # Add estimated supplies cost
         breakdown['supplies'] = len(classes) * 50  # $50 per class estimate
@@ -1306,7 +2446,7 @@ class BudgetPlanner:
                 'seller_email': listing_data['seller_email'],
                 'seller_name': listing_data['seller_name'],
                 'contact': listing_data['contact'],
-                'image_url': self._generate_placeholder_image(listing_data),
+                'image_url': self.placeholder_image_url(listing_data),
                 'isbn': listing_data.get('isbn', ''),
                 'edition': listing_data.get('edition', ''),
                 'created_at': (base_time - timedelta(days=random.randint(0, 30), hours=random.randint(0, 23))).isoformat(),
@@ -1322,12 +2462,21 @@ class BudgetPlanner:
     def _load_json(self, filepath):
         """Load JSON file"""
         try:
-            with open(filepath, 'r') as f:
-                return json.load(f)
+            start = time.perf_counter()
+            with open(filepath, 'rb') as f:
+                raw = f.read()
+            read_done = time.perf_counter()
+            data = json.loads(raw)
         except:
             return []
+        label = self._json_file_label(filepath)
+        JSON_IO_SECONDS.observe(read_done - start, label, 'read')
+        JSON_PARSE_SECONDS.observe(time.perf_counter() - read_done, label)
+        JSON_READ_BYTES.inc(label, amount=len(raw))
+        return data
     
-    def _generate_placeholder_image(self, listing_data):
+    @staticmethod
+    def placeholder_image_url(listing_data):
         """Generate placeholder image URL based on category"""
         category = listing_data.get('category', 'textbooks')
         title = listing_data.get('title', 'Item')
@@ -1349,5 +2498,17 @@ class BudgetPlanner:
     
     def _save_json(self, filepath, data):
         """Save JSON file"""
+        start = time.perf_counter()
+        text = json.dumps(data, indent=2)
+        dumped = time.perf_counter()
         with open(filepath, 'w') as f:
-            json.dump(data, f, indent=2)
+            f.write(text)
+        label = self._json_file_label(filepath)
+        JSON_DUMP_SECONDS.observe(dumped - start, label)
+        JSON_IO_SECONDS.observe(time.perf_counter() - dumped, label, 'write')
+        # ASCII-only output (ensure_ascii), so characters == bytes
+        JSON_WRITTEN_BYTES.inc(label, amount=len(text))
+    
+    def _json_file_label(self, filepath):
+        """Metrics label for a JSON file: its name in data/, else 'other' (e.g. syllabus caches)"""
+        return os.path.basename(filepath) if os.path.dirname(filepath) == self.data_dir else 'other'
@@ -0,0 +1,242 @@
+"""
+Class Registry
+Indexed, hot-reloadable course catalog loaded from classes.json
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+
+_SPACES = re.compile(r'\s+')
+_ISBN_SEPARATORS = re.compile(r'[\s-]')
+_WORDS = re.compile(r'[a-z0-9]+')
+_ISBN10 = re.compile(r'[0-9]{9}[0-9X]')
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_class_code(code):
+    """'eecs  183' -> 'EECS 183'"""
+    return _SPACES.sub(' ', (code or '').strip()).upper()
+
+
+def normalize_isbn(isbn):
+    """'978-0-13-592903-2' -> '9780135929032'"""
+    return _ISBN_SEPARATORS.sub('', isbn or '').upper()
+
+
+def isbn13(isbn):
+    """Normalized ISBN in its 13-digit form: '0-13-592903-6' -> '9780135929036'"""
+    isbn = normalize_isbn(isbn)
+    if not _ISBN10.fullmatch(isbn):
+        return isbn
+    digits = '978' + isbn[:9]
+    total = sum(int(digit) * (3 if i % 2 else 1) for i, digit in enumerate(digits))
+    return digits + str(-total % 10)
+
+
+def title_words(title):
+    """"Thomas' Calculus (14th Ed.)" -> ('thomas', 'calculus', '14th', 'ed')"""
+    return tuple(_WORDS.findall((title or '').lower()))
+
+
+def validate_catalog(data):
+    """Course entries (each with its 'code') from a parsed classes file, or raise ValueError if it is malformed"""
+    if isinstance(data, dict):
+        if not all(isinstance(info, dict) for info in data.values()):
+            raise ValueError('Catalog courses must be objects')
+        entries = [dict(info, code=code) for code, info in data.items()]
+    elif isinstance(data, list):
+        entries = data
+    else:
+        raise ValueError('Catalog must be a list of courses or an object keyed by course code')
+
+    for entry in entries:
+        if not isinstance(entry, dict):
+            raise ValueError(f'Catalog course {entry!r} must be an object')
+        for key, value in entry.items():
+            if key in ('code', 'name', 'department'):
+                valid = value is None or isinstance(value, str)
+            elif key in ('supplies', 'electronics'):
+                valid = isinstance(value, list) and all(isinstance(item, str) for item in value)
+            elif key == 'textbooks':
+                valid = isinstance(value, list) and all(map(_valid_textbook, value))
+            else:
+                valid = True  # other fields are ignored
+            if not valid:
+                raise ValueError(f'Invalid catalog field {key!r} for course {entry.get("code")!r}')
+    return entries
+
+
+def _valid_textbook(textbook):
+    if isinstance(textbook, str):
+        return True
+    return (isinstance(textbook, dict)
+            and isinstance(textbook.get('title', ''), str)
+            and (textbook.get('isbn') is None or isinstance(textbook['isbn'], str))
+            and isinstance(textbook.get('required', True), bool))
+
+
+class ClassRegistry:
+    """Course catalog indexed by course code, department, textbook ISBN and textbook title.
+
+    classes.json holds a list of courses (or an object keyed by course code):
+
+        {"code": "EECS 183", "name": "...", "department": "EECS",
+         "textbooks": [{"title": "...", "isbn": "...", "required": true}, "Plain Title"],
+         "supplies": ["Calculator"], "electronics": []}
+
+    Entries override the built-in `defaults` with the same code. The file is
+    read on first use and re-read when its modification time changes (checked
+    at most every RELOAD_INTERVAL seconds); `version` increases on every
+    reload so callers can rebuild anything derived from the catalog. A file
+    that fails validate_catalog is logged and ignored, keeping the last good
+    catalog (or only the defaults, if none loaded yet).
+    """
+
+    RELOAD_INTERVAL = 2.0
+
+    def __init__(self, classes_file=None, defaults=None):
+        self.classes_file = classes_file
+        self.defaults = defaults or {}
+        self.version = 0
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._next_reload_check = 0
+        self._loaded = False
+        self._classes = {}
+        self._departments = {}
+        self._isbns = {}
+        self._textbooks = ({}, 0)
+        self._textbook_keys = {}
+
+    def reload(self, force=False):
+        """Re-index the catalog if the classes file changed; returns True if reloaded"""
+        try:
+            mtime = os.path.getmtime(self.classes_file) if self.classes_file else None
+        except OSError:
+            mtime = None
+        if self._loaded and not force and mtime == self._mtime:
+            return False
+
+        defaults = [dict(info, code=code) for code, info in self.defaults.items()]
+        try:
+            entries = []
+            if mtime is not None:
+                with open(self.classes_file, 'r') as f:
+                    entries = validate_catalog(json.load(f))
+            indexes = self._build_indexes(defaults + entries)
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            # Keep serving the last good catalog if the file is mid-edit or invalid
+            logger.warning('Ignoring invalid course catalog %s: %s', self.classes_file, e)
+            if self._loaded:
+                with self._lock:
+                    self._mtime = mtime  # not re-read until it changes again
+                return False
+            indexes = self._build_indexes(defaults)
+        with self._lock:
+            self._classes, self._departments, self._isbns, self._textbooks, self._textbook_keys = indexes
+            self._mtime = mtime
+            self._loaded = True
+            self.version += 1
+        return True
+
+    def get(self, code):
+        """Course by code (any case/spacing), or None"""
+        self._maybe_reload()
+        return self._classes.get(normalize_class_code(code))
+
+    def __contains__(self, code):
+        return self.get(code) is not None
+
+    def by_department(self, department):
+        """Courses in a department, in catalog order"""
+        self._maybe_reload()
+        codes = self._departments.get((department or '').strip().upper(), [])
+        return [self._classes[code] for code in codes]
+
+    def by_isbn(self, isbn):
+        """[{'class_code', 'title', 'required'}] for every course using the textbook"""
+        self._maybe_reload()
+        return list(self._isbns.get(normalize_isbn(isbn), []))
+
+    def refresh(self):
+        """Pick up a changed classes file (at most every RELOAD_INTERVAL); returns the catalog version"""
+        self._maybe_reload()
+        return self.version
+
+    def textbook_keys(self):
+        """{(class_code, textbook title): ISBNs} for every catalog textbook, to diff catalog versions"""
+        self._maybe_reload()
+        return self._textbook_keys
+
+    def match_textbooks(self, title, isbn=''):
+        """{(class_code, textbook title)} for the catalog textbooks a listing is for.
+
+        A listing matches a textbook with the same ISBN, or whose title appears
+        as a run of whole words in the listing title ("Campbell Biology (12th
+        Edition)" matches "Campbell Biology"). Titles are looked up by word
+        sequence in a dict, so the cost depends on the listing title's length,
+        not on the size of the catalog.
+        """
+        self._maybe_reload()
+        titles, longest = self._textbooks
+        matches = {(entry['class_code'], entry['title']) for entry in self._isbns.get(normalize_isbn(isbn), ())}
+        words = title_words(title)
+        for start in range(len(words)):
+            for end in range(start + 1, min(start + longest, len(words)) + 1):
+                matches.update(titles.get(words[start:end], ()))
+        return matches
+
+    def _maybe_reload(self):
+        """Load on first use, then reload if the reload interval has passed"""
+        now = time.monotonic()
+        if not self._loaded or now >= self._next_reload_check:
+            self._next_reload_check = now + self.RELOAD_INTERVAL
+            self.reload()
+
+    def _build_indexes(self, entries):
+        """Normalize catalog entries and build the code, department, ISBN and title indexes"""
+        classes = {}
+        for entry in entries:
+            code = normalize_class_code(entry.get('code'))
+            if not code:
+                continue
+            textbooks = []
+            for textbook in entry.get('textbooks', []):
+                if isinstance(textbook, str):
+                    textbook = {'title': textbook}
+                textbooks.append({
+                    'title': textbook.get('title', ''),
+                    'isbn': normalize_isbn(textbook.get('isbn')),
+                    'required': textbook.get('required', True)
+                })
+            classes[code] = {
+                'code': code,
+                'name': entry.get('name', ''),
+                'department': (entry.get('department') or code.split(' ')[0]).upper(),
+                'textbooks': textbooks,
+                'supplies': list(entry.get('supplies', [])),
+                'electronics': list(entry.get('electronics', []))
+            }
+
+        departments = {}
+        isbns = {}
+        titles = {}
+        keys = {}
+        for code, info in classes.items():
+            departments.setdefault(info['department'], []).append(code)
+            for textbook in info['textbooks']:
+                if textbook['isbn']:
+                    isbns.setdefault(textbook['isbn'], []).append(
+                        {'class_code': code, 'title': textbook['title'], 'required': textbook['required']})
+                words = title_words(textbook['title'])
+                if words:
+                    titles.setdefault(words, []).append((code, textbook['title']))
+                keys[(code, textbook['title'])] = keys.get((code, textbook['title']), ()) + (textbook['isbn'],)
+        longest = max(map(len, titles), default=0)
+        return classes, departments, isbns, (titles, longest), keys
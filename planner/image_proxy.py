@@ -0,0 +1,303 @@
+"""
+Remote Image Proxy
+Fetches remote listing images once and serves them (optionally resized) from a local LRU disk cache
+"""
+
+import hashlib
+import mimetypes
+import os
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from planner.images import FORMATS, VARIANTS, Image, render_variant
+
+
+class _AllowedHostRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """Follows redirects only to hosts the proxy is allowed to fetch from"""
+
+    def __init__(self, proxy):
+        super().__init__()
+        self.proxy = proxy
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        if not self.proxy.is_allowed(newurl):
+            raise urllib.error.HTTPError(newurl, 403, 'Redirect to a host that is not allowed', headers, fp)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+class ImageProxy:
+    """Local cache of remote images, bounded by a disk budget.
+
+    Each remote URL is fetched once (concurrent requests for the same URL
+    share one download) and stored under the SHA-256 of the URL as
+    <cache_dir>/<2 hex>/<hash><ext>; resized variants are written next to it
+    on first request when Pillow is installed. When the cache exceeds
+    `max_bytes` the least recently used URLs (original and variants
+    together) are deleted. Recency survives restarts through file
+    modification times. Only http(s) URLs on `allowed_hosts` (a host matches
+    itself and its subdomains; "host:port" entries match exactly, e.g. a
+    local stub server) are fetched, and failures are remembered for
+    FAILURE_TTL seconds so a dead upstream is not retried on every page view.
+    """
+
+    DEFAULT_HOSTS = ('pixabay.com', 'unsplash.com', 'via.placeholder.com')
+    MAX_CACHE_BYTES = 512 * 1024 * 1024
+    MAX_IMAGE_BYTES = 10 * 1024 * 1024
+    FAILURE_TTL = 300
+    MAX_FAILURES = 1024
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, cache_dir, url_prefix, allowed_hosts=DEFAULT_HOSTS,
+                 max_bytes=MAX_CACHE_BYTES, timeout=5.0):
+        self.cache_dir = cache_dir
+        self.url_prefix = url_prefix
+        self.allowed_hosts = {host.lower() for host in allowed_hosts}
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self._opener = urllib.request.build_opener(_AllowedHostRedirectHandler(self))
+        self._lock = threading.Lock()
+        self._entries = None
+        self._sizes = {}
+        self._total_bytes = 0
+        self._inflight = {}
+        self._failures = {}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def is_allowed(self, url):
+        """Whether a URL is http(s) on an allowed host"""
+        try:
+            parts = urllib.parse.urlsplit(url or '')
+            host = (parts.hostname or '').lower()
+            netloc = f'{host}:{parts.port}' if parts.port else host
+        except ValueError:
+            return False
+        if parts.scheme not in ('http', 'https') or not host:
+            return False
+        return netloc in self.allowed_hosts or any(
+            host == allowed or host.endswith('.' + allowed) for allowed in self.allowed_hosts)
+
+    def proxy_url(self, url, variant=None, fmt=None):
+        """Local URL serving a remote image (or one of its variants), or None if it cannot be proxied"""
+        if not self.is_allowed(url):
+            return None
+        params = {'url': url}
+        if variant:
+            params['variant'] = variant
+        if fmt:
+            params['format'] = fmt
+        return f'{self.url_prefix}?{urllib.parse.urlencode(params)}'
+
+    def variants_for(self, url):
+        """{variant: {format: local url}} for a proxyable remote image, or None.
+
+        Without Pillow every variant is the proxied original, listed as 'jpeg'
+        (the format every browser takes) only.
+        """
+        if not self.is_allowed(url):
+            return None
+        if Image is None:
+            return {variant: {'jpeg': self.proxy_url(url)} for variant in VARIANTS}
+        return {variant: {fmt: self.proxy_url(url, variant, fmt) for fmt in FORMATS} for variant in VARIANTS}
+
+    def get(self, url, variant=None, fmt=None):
+        """{'path', 'content_type'} of the cached image, fetching it first if needed, or an error dict"""
+        if not self.is_allowed(url):
+            return {'error': 'Image host not allowed', 'status': 403}
+        if variant and variant not in VARIANTS:
+            return {'error': 'Unknown image variant', 'status': 400}
+        fmt = fmt if fmt in FORMATS else 'jpeg'
+
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        original = self._get_original(key, url)
+        if 'error' in original:
+            return original
+        if not variant or Image is None:
+            return original
+
+        path = os.path.join(os.path.dirname(original['path']), f'{key}.{variant}{FORMATS[fmt][0]}')
+        rendered = {'path': path, 'content_type': mimetypes.guess_type(path)[0]}
+        if os.path.exists(path):
+            return rendered
+
+        # Concurrent requests for the same variant share one render
+        render_key = f'{key}.{variant}.{fmt}'
+        with self._lock:
+            if os.path.exists(path):
+                return rendered
+            future = self._inflight.get(render_key)
+            owner = future is None
+            if owner:
+                future = self._inflight[render_key] = Future()
+        if not owner:
+            return future.result()
+
+        try:
+            render_variant(original['path'], path, variant, fmt)
+            result = rendered
+        except Exception:
+            result = original  # not decodable by Pillow; serve it as fetched
+        with self._lock:
+            del self._inflight[render_key]
+        future.set_result(result)
+        if result is rendered:
+            self._record(key, os.path.basename(original['path']))
+        return result
+
+    def _get_original(self, key, url):
+        """Cached original for a URL, downloading it once across concurrent callers"""
+        with self._lock:
+            entries = self._get_entries()
+            name = entries.get(key)
+            if name is not None:
+                entries.move_to_end(key)
+            else:
+                failure = self._failures.get(key)
+                if failure and failure[0] > time.monotonic():
+                    return dict(failure[1])
+                future = self._inflight.get(key)
+                owner = future is None
+                if owner:
+                    future = self._inflight[key] = Future()
+
+        if name is not None:
+            path = self._path(key, name)
+            try:
+                os.utime(path)
+                return {'path': path, 'content_type': mimetypes.guess_type(name)[0]}
+            except FileNotFoundError:
+                with self._lock:
+                    self._forget(key)
+                return self._get_original(key, url)
+
+        if not owner:
+            return future.result()
+
+        try:
+            result = self._download(key, url)
+        except Exception as e:
+            result = {'error': f'Could not fetch image: {e}', 'status': 502}
+        if 'error' not in result:
+            self._record(key, os.path.basename(result['path']))
+        with self._lock:
+            del self._inflight[key]
+            if 'error' in result:
+                now = time.monotonic()
+                if len(self._failures) >= self.MAX_FAILURES:
+                    self._failures = {k: f for k, f in self._failures.items() if f[0] > now}
+                self._failures[key] = (now + self.FAILURE_TTL, result)
+        future.set_result(result)
+        return result
+
+    def _download(self, key, url):
+        """Stream a remote image into the cache; returns {'path', 'content_type'} or an error dict"""
+        request = urllib.request.Request(url, headers={'User-Agent': 'LehighMarketplace-ImageProxy/1.0',
+                                                       'Accept': 'image/*'})
+        with self._opener.open(request, timeout=self.timeout) as response:
+            content_type = response.headers.get_content_type()
+            if not content_type.startswith('image/'):
+                return {'error': f'Not an image ({content_type})', 'status': 502}
+            extension = mimetypes.guess_extension(content_type) or ''
+            if extension == '.jpe':
+                extension = '.jpg'
+
+            path = self._path(key, key + extension)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.fetch-')
+            try:
+                size = 0
+                with os.fdopen(fd, 'wb') as temp:
+                    while True:
+                        chunk = response.read(self.CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        size += len(chunk)
+                        if size > self.MAX_IMAGE_BYTES:
+                            raise ValueError('image is too large')
+                        temp.write(chunk)
+                os.replace(temp_path, path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+        return {'path': path, 'content_type': content_type}
+
+    def _path(self, key, name):
+        return os.path.join(self.cache_dir, key[:2], name)
+
+    def _get_entries(self):
+        """URL hash -> original file name, least recently used first; callers hold the lock"""
+        if self._entries is None:
+            found = {}
+            for directory, _, files in os.walk(self.cache_dir):
+                for name in files:
+                    if name.startswith('.'):
+                        continue
+                    path = os.path.join(directory, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    key = name.split('.', 1)[0]
+                    entry = found.setdefault(key, {'name': None, 'size': 0, 'used': 0})
+                    entry['size'] += stat.st_size
+                    entry['used'] = max(entry['used'], stat.st_mtime)
+                    if name.count('.') <= 1:
+                        entry['name'] = name
+            self._entries = OrderedDict()
+            self._sizes = {}
+            self._total_bytes = 0
+            for key, entry in sorted(found.items(), key=lambda item: item[1]['used']):
+                if entry['name'] is None:
+                    continue  # variants left behind without their original
+                self._entries[key] = entry['name']
+                self._sizes[key] = entry['size']
+                self._total_bytes += entry['size']
+        return self._entries
+
+    def _record(self, key, name):
+        """Re-measure a URL's files after a write and evict least recently used URLs over budget"""
+        directory = os.path.join(self.cache_dir, key[:2])
+        size = 0
+        for file_name in os.listdir(directory):
+            if file_name.split('.', 1)[0] == key:
+                size += os.path.getsize(os.path.join(directory, file_name))
+
+        with self._lock:
+            entries = self._get_entries()
+            self._total_bytes += size - self._sizes.get(key, 0)
+            entries[key] = name
+            entries.move_to_end(key)
+            self._sizes[key] = size
+            evicted = []
+            while self._total_bytes > self.max_bytes and len(entries) > 1:
+                old_key, _ = entries.popitem(last=False)
+                self._total_bytes -= self._sizes.pop(old_key, 0)
+                evicted.append(old_key)
+
+        for old_key in evicted:
+            self._delete_files(old_key)
+
+    def _forget(self, key):
+        """Drop a URL from the index; callers hold the lock"""
+        if self._entries is not None and self._entries.pop(key, None) is not None:
+            self._total_bytes -= self._sizes.pop(key, 0)
+
+    def _delete_files(self, key):
+        """Remove a URL's original and variants from disk"""
+        directory = os.path.join(self.cache_dir, key[:2])
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return
+        for file_name in names:
+            if file_name.split('.', 1)[0] == key:
+                try:
+                    os.remove(os.path.join(directory, file_name))
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,205 @@
+"""
+Listing Images
+Resized, recompressed variants (card thumbnail, detail view) of uploaded listing photos
+"""
+
+import os
+import tempfile
+import threading
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # optional: without Pillow listings keep serving the original upload
+    Image = None
+    ImageOps = None
+
+from planner.workers import process_pool
+
+
+# Variant name -> largest (width, height); images are only ever scaled down
+VARIANTS = {
+    'thumb': (400, 300),
+    'detail': (1200, 900)
+}
+
+# Output format -> (file extension, Pillow save options)
+FORMATS = {
+    'jpeg': ('.jpg', {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True}),
+    'webp': ('.webp', {'format': 'WEBP', 'quality': 80, 'method': 4})
+}
+
+
+def variant_name(filename, variant, fmt):
+    """'photo.png' -> 'photo.thumb.webp'"""
+    stem = os.path.splitext(filename)[0]
+    return f'{stem}.{variant}{FORMATS[fmt][0]}'
+
+
+def render_variants(source_path):
+    """Write every variant of an image next to it; returns {variant: {format: file name}}.
+
+    Runs in a worker process. EXIF orientation is applied to the pixels and
+    the metadata is not copied, so variants display upright and carry no
+    camera or location data. Each file is written under a temporary name and
+    renamed into place, so readers never see a partial image.
+    """
+    image = _open_upright(source_path, max(max(size) for size in VARIANTS.values()))
+    directory, filename = os.path.split(source_path)
+    rendered = {}
+    for variant, size in VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail(size, Image.LANCZOS)
+        rendered[variant] = {}
+        for fmt in FORMATS:
+            name = variant_name(filename, variant, fmt)
+            _save_atomic(resized, os.path.join(directory, name), fmt)
+            rendered[variant][fmt] = name
+    return rendered
+
+
+def render_variant(source_path, target_path, variant, fmt):
+    """Write one variant of an image to target_path (same processing as render_variants)"""
+    image = _open_upright(source_path, max(VARIANTS[variant]))
+    image.thumbnail(VARIANTS[variant], Image.LANCZOS)
+    _save_atomic(image, target_path, fmt)
+
+
+def _open_upright(source_path, largest):
+    """Decoded RGB image with EXIF orientation applied, at least `largest` px where possible"""
+    with Image.open(source_path) as image:
+        # Let the JPEG decoder downscale while decoding instead of after
+        image.draft('RGB', (largest, largest))
+        return _flatten(ImageOps.exif_transpose(image))
+
+
+def _save_atomic(image, path, fmt):
+    """Save through a uniquely named temporary file, so concurrent writers of one variant never share it"""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.render-')
+    try:
+        with os.fdopen(fd, 'wb') as temp:
+            image.save(temp, **FORMATS[fmt][1])
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _join_url_path(directory, name):
+    return f'{directory}/{name}' if directory else name
+
+
+def _flatten(image):
+    """RGB copy of an image, with any transparency composited onto white"""
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    if image.mode != 'RGB':
+        return image.convert('RGB')
+    return image
+
+
+class ImagePipeline:
+    """Generates listing image variants in a background process pool.
+
+    submit() queues an uploaded file and returns immediately; variants_for()
+    answers from an in-memory map filled as workers finish (or, for files
+    processed before a restart, from the variant files on disk). Until an
+    image's variants exist, callers keep using the original upload. Without
+    Pillow installed nothing is queued and every image is served as uploaded.
+    """
+
+    WORKERS = 2
+
+    def __init__(self, upload_dir, url_prefix, workers=WORKERS):
+        self.upload_dir = upload_dir
+        self.url_prefix = url_prefix.rstrip('/') + '/'
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._pool = None
+        self._variants = {}
+
+    @property
+    def available(self):
+        return Image is not None
+
+    def submit(self, filename):
+        """Queue variant generation for a file in the upload directory; returns the future or None"""
+        if not self.available:
+            return None
+        with self._lock:
+            if self._pool is None:
+                self._pool = process_pool(self.workers)
+            future = self._pool.submit(render_variants, os.path.join(self.upload_dir, filename))
+        future.add_done_callback(lambda done: self._finish(filename, done))
+        return future
+
+    def variants_for(self, image_url):
+        """{variant: {format: url}} for an uploaded image's finished variants, or None"""
+        if not image_url or not image_url.startswith(self.url_prefix):
+            return None
+        filename = image_url[len(self.url_prefix):]
+        with self._lock:
+            if filename in self._variants:
+                names = self._variants[filename]
+            else:
+                names = self._variants[filename] = self._scan(filename)
+        if not names:
+            return None
+        return {variant: {fmt: self.url_prefix + name for fmt, name in formats.items()}
+                for variant, formats in names.items()}
+
+    def attach_variants(self, listings, proxy=None):
+        """Copies of listings with 'image_variants' (image URL -> variants).
+
+        Uploaded images get their generated variants; remote images get local
+        URLs from `proxy` (an ImagePipeline-compatible variants_for()) if given.
+        """
+        result = []
+        for listing in listings:
+            images = list(listing.get('image_urls') or [])
+            if listing.get('image_url') and listing['image_url'] not in images:
+                images.insert(0, listing['image_url'])
+            variants = {}
+            for url in images:
+                found = self.variants_for(url) or (proxy.variants_for(url) if proxy else None)
+                if found:
+                    variants[url] = found
+            result.append(dict(listing, image_variants=variants))
+        return result
+
+    def discard(self, filename):
+        """Delete an image's variant files and forget them"""
+        with self._lock:
+            self._variants.pop(filename, None)
+        for variant in VARIANTS:
+            for fmt in FORMATS:
+                try:
+                    os.remove(os.path.join(self.upload_dir, variant_name(filename, variant, fmt)))
+                except FileNotFoundError:
+                    pass
+
+    def _finish(self, filename, future):
+        """Record a worker's output (runs when it completes)"""
+        try:
+            directory = os.path.dirname(filename)
+            names = {variant: {fmt: _join_url_path(directory, name) for fmt, name in formats.items()}
+                     for variant, formats in future.result().items()}
+        except Exception:
+            names = None  # unreadable or unsupported image: keep serving the original
+        with self._lock:
+            self._variants[filename] = names
+
+    def _scan(self, filename):
+        """Variant names for a file if all of them already exist on disk, else None"""
+        names = {}
+        for variant in VARIANTS:
+            names[variant] = {}
+            for fmt in FORMATS:
+                name = variant_name(filename, variant, fmt)
+                if not os.path.exists(os.path.join(self.upload_dir, name)):
+                    return None
+                names[variant][fmt] = name
+        return names
@@ -0,0 +1,271 @@
+"""
+Content Moderation Engine
+Precompiled, hot-reloadable moderation rules for marketplace text
+"""
+
+import json
+import os
+import re
+import threading
+import time
+
+
+# Settings shared by every context unless a context overrides them
+_BASE_RULES = {
+    # Matched anywhere in the lowercased text
+    'profanity': [],
+    # Matched only as whole words
+    'profanity_words': [],
+    # Also match profanity after undoing digit/symbol substitutions (n1ck -> nick)
+    'leetspeak': False,
+    # Regular expressions searched in the lowercased text
+    'scam_patterns': [],
+    # Caps and repetition checks only apply to text longer than this (null disables them)
+    'spam_min_length': None,
+    # A run of this many identical characters is treated as spam
+    'max_repeat': 6,
+    'reasons': {
+        'profanity': 'Inappropriate language detected',
+        'caps': 'Please do not use all caps',
+        'spam': 'Spam detected',
+        'scam': 'Suspicious content detected. Please use safe payment methods.'
+    }
+}
+
+_MESSAGE_PROFANITY = [
+    'fuck', 'shit', 'ass', 'bitch', 'damn', 'crap', 'hell',
+    'bastard', 'dick', 'pussy', 'cock', 'slut', 'whore'
+]
+
+# Built-in rules per context, used wherever the rules file does not override them
+DEFAULT_RULES = {
+    'message': {
+        'profanity': _MESSAGE_PROFANITY,
+        'scam_patterns': [
+            r'venmo.*\$\d+',
+            r'paypal.*\$\d+',
+            r'cash.*app',
+            r'send.*money',
+            r'bitcoin',
+            r'cryptocurrency'
+        ],
+        'spam_min_length': 20
+    },
+    # Listing titles and descriptions: whole words only, so "class" or "glass" pass
+    'listing': {
+        'profanity_words': _MESSAGE_PROFANITY,
+        'reasons': {'profanity': 'Listing contains inappropriate language'}
+    },
+    'nickname': {
+        'profanity': [
+            # Swear words
+            'arse', 'arsehead', 'arsehole', 'ass', 'asshole', 'ass hole',
+            'bastard', 'bitch', 'bloody', 'bollocks', 'brotherfucker', 'bugger', 'bullshit',
+            'child-fucker', 'cock', 'cocksucker', 'crap', 'cunt',
+            'dammit', 'damn', 'damned', 'damn it', 'dick', 'dick-head', 'dickhead', 'dumb ass', 'dumb-ass', 'dumbass', 'dyke',
+            'fag', 'faggot', 'father-fucker', 'fatherfucker', 'fuck', 'fucked', 'fucker', 'fucking',
+            'god dammit', 'goddammit', 'god damn', 'goddamn', 'goddamned', 'goddamnit', 'godsdamn',
+            'hell', 'holy shit', 'horseshit',
+            'jackarse', 'jack-ass', 'jackass', 'jesus christ', 'jesus fuck', 'jesus harold christ', 'jesus h. christ', 'jesus wept',
+            'kike',
+            'mental',
+            'mother fucker', 'mother-fucker', 'motherfucker',
+            'nigger', 'nigga', 'nigra',  # n-word and variants
+            'pigfucker', 'piss', 'prick', 'pussy',
+            'shit', 'shit ass', 'shite', 'sibling fucker', 'sisterfuck', 'sisterfucker', 'slut', 'son of a bitch', 'son of a whore', 'spastic', 'sweet jesus',
+            'tranny', 'twat',
+            'wanker',
+            # Additional offensive terms
+            'admin', 'administrator', 'moderator', 'mod', 'root',
+            'nazi', 'hitler', 'kill', 'death', 'murder', 'hate'
+        ],
+        'leetspeak': True,
+        'reasons': {'profanity': 'Nickname contains inappropriate content'}
+    }
+}
+
+# Leetspeak substitutions, applied in order
+_LEETSPEAK_REPLACEMENTS = [
+    (re.compile(r'[1!]'), 'i'),
+    (re.compile(r'[3]'), 'e'),
+    (re.compile(r'[4]'), 'a'),
+    (re.compile(r'[5]'), 's'),
+    (re.compile(r'[7]'), 't'),
+    (re.compile(r'[0]'), 'o'),
+]
+_DIGITS = re.compile(r'[0-9]')
+
+
+def build_trie_pattern(words):
+    """Build a regex alternation of literal words with shared prefixes factored out.
+
+    ['car', 'cat', 'dog'] becomes 'ca(?:r|t)|dog', so the regex engine walks a
+    trie of the word list at each position instead of retrying every word.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True  # end of word
+
+    def to_pattern(node):
+        alternatives = [re.escape(char) + to_pattern(child)
+                        for char, child in sorted(node.items()) if char]
+        if not alternatives:
+            return ''
+        if len(alternatives) == 1 and '' not in node:
+            return alternatives[0]
+        pattern = '(?:' + '|'.join(alternatives) + ')'
+        return pattern + '?' if '' in node else pattern
+
+    return to_pattern(trie) if trie else '(?!)'
+
+
+def validate_rules(rules):
+    """Return a parsed rules file unchanged, or raise ValueError if it is not shaped like DEFAULT_RULES"""
+    if not isinstance(rules, dict):
+        raise ValueError('Moderation rules must be an object of contexts')
+    for context, settings in rules.items():
+        if not isinstance(settings, dict):
+            raise ValueError(f'Moderation rules for {context!r} must be an object')
+        for key, value in settings.items():
+            if key in ('profanity', 'profanity_words', 'scam_patterns'):
+                valid = isinstance(value, list) and all(isinstance(item, str) for item in value)
+            elif key == 'reasons':
+                valid = isinstance(value, dict) and all(isinstance(item, str) for item in value.values())
+            elif key == 'leetspeak':
+                valid = isinstance(value, bool)
+            elif key == 'spam_min_length':
+                valid = value is None or (isinstance(value, int) and not isinstance(value, bool))
+            elif key == 'max_repeat':
+                valid = isinstance(value, int) and not isinstance(value, bool)
+            else:
+                valid = False
+            if not valid:
+                raise ValueError(f'Invalid moderation setting {context}.{key}')
+    return rules
+
+
+class ModerationEngine:
+    """Checks user text against compiled moderation rules.
+
+    Rules are grouped by context ('message', 'listing', 'nickname'). Each
+    context's word lists are compiled into a single trie-shaped regex and its
+    scam patterns into one alternation, so a check is a couple of regex passes
+    no matter how many rules there are. Verdicts are not cached: a check of
+    a chat-sized message costs less than hashing it and probing a shared
+    cache would. The rules file is re-read when its modification time
+    changes (checked at most every RELOAD_INTERVAL seconds).
+    """
+
+    RELOAD_INTERVAL = 2.0
+
+    def __init__(self, rules_file=None):
+        self.rules_file = rules_file
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._next_reload_check = 0
+        self._contexts = self._compile_all({})
+        self.reload()
+
+    def reload(self, force=False):
+        """Recompile the rules if the rules file changed; returns True if reloaded"""
+        if not self.rules_file:
+            return False
+        try:
+            mtime = os.path.getmtime(self.rules_file)
+        except OSError:
+            return False
+        if not force and mtime == self._mtime:
+            return False
+
+        try:
+            with open(self.rules_file, 'r') as f:
+                compiled = self._compile_all(validate_rules(json.load(f)))
+        except (OSError, ValueError, TypeError, re.error):
+            # Keep serving the last good rules if the file is mid-edit or invalid
+            return False
+
+        with self._lock:
+            self._contexts = compiled
+            self._mtime = mtime
+        return True
+
+    def check(self, content, context='message'):
+        """Moderate a piece of text, returning {'allowed': bool, 'reason': str}"""
+        self._maybe_reload()
+        return self._evaluate(content, self._contexts[context])
+
+    def check_many(self, contents, context='message'):
+        """Moderate a batch of texts, evaluating each distinct text once"""
+        verdicts = {}
+        for content in contents:
+            if content not in verdicts:
+                verdicts[content] = self.check(content, context)
+        return [dict(verdicts[content]) for content in contents]
+
+    def _evaluate(self, content, rules):
+        """Run one context's compiled rules over the text"""
+        reasons = rules['reasons']
+        content_lower = content.lower()
+
+        profanity = rules['profanity']
+        if profanity:
+            variants = [content_lower]
+            if rules['leetspeak']:
+                variants.append(_DIGITS.sub('', content_lower))
+                leet = content_lower
+                for pattern, replacement in _LEETSPEAK_REPLACEMENTS:
+                    leet = pattern.sub(replacement, leet)
+                variants.append(leet)
+            if any(profanity.search(variant) for variant in variants):
+                return {'allowed': False, 'reason': reasons['profanity']}
+
+        # Spam detection (all caps or long runs of one character)
+        if rules['spam_min_length'] is not None and len(content) > rules['spam_min_length']:
+            if content.isupper():
+                return {'allowed': False, 'reason': reasons['caps']}
+            if rules['repeat'].search(content):
+                return {'allowed': False, 'reason': reasons['spam']}
+
+        if rules['scam'] and rules['scam'].search(content_lower):
+            return {'allowed': False, 'reason': reasons['scam']}
+
+        return {'allowed': True, 'reason': ''}
+
+    def _maybe_reload(self):
+        """Reload the rules file if the reload interval has passed"""
+        now = time.monotonic()
+        if now >= self._next_reload_check:
+            self._next_reload_check = now + self.RELOAD_INTERVAL
+            self.reload()
+
+    def _compile_all(self, rules):
+        """Compile every context, file settings merged over the built-in defaults"""
+        return {context: self._compile(dict(defaults, **rules.get(context, {})))
+                for context, defaults in DEFAULT_RULES.items()}
+
+    def _compile(self, rules):
+        """Compile one context's rules (merged over the base settings) into regexes"""
+        merged = dict(_BASE_RULES, **rules)
+        merged['reasons'] = dict(_BASE_RULES['reasons'], **rules.get('reasons', {}))
+
+        profanity_parts = []
+        if merged['profanity']:
+            profanity_parts.append(build_trie_pattern(merged['profanity']))
+        if merged['profanity_words']:
+            profanity_parts.append(r'\b(?:%s)\b' % build_trie_pattern(merged['profanity_words']))
+
+        scam_patterns = merged['scam_patterns']
+        max_repeat = max(int(merged['max_repeat']), 2)
+        spam_min_length = merged['spam_min_length']
+
+        return {
+            'profanity': re.compile('|'.join(profanity_parts)) if profanity_parts else None,
+            'leetspeak': bool(merged['leetspeak']),
+            'scam': re.compile('|'.join(f'(?:{p})' for p in scam_patterns)) if scam_patterns else None,
+            'repeat': re.compile(r'(.)\1{%d}' % (max_repeat - 1), re.DOTALL),
+            'spam_min_length': int(spam_min_length) if spam_min_length is not None else None,
+            'reasons': merged['reasons']
+        }
@@ -0,0 +1,240 @@
+"""
+Price Sources
+Pluggable price-comparison sources queried concurrently with a shared TTL cache
+"""
+
+import json
+import threading
+import time
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from planner.class_registry import isbn13
+
+
+class PriceSource:
+    """A platform that can quote a price for a book.
+
+    Subclasses implement fetch(), returning an offer dict ({'price',
+    'condition', 'link', 'availability', ...}) or None when the platform has
+    no offer. fetch() is given the seconds left of the source's timeout and
+    should not block for longer (pass it to any network call). Offers from
+    sources marked `cacheable` are kept for the aggregator's TTL.
+    """
+
+    cacheable = True
+
+    def __init__(self, name, timeout=2.0):
+        self.name = name
+        self.timeout = timeout
+
+    def fetch(self, title, isbn, author, timeout):
+        raise NotImplementedError
+
+
+class StaticPriceSource(PriceSource):
+    """Fixed offer from configuration (fixtures, offline development, demos)"""
+
+    def __init__(self, name, price, condition='', availability='', link='#', timeout=2.0, **extra):
+        super().__init__(name, timeout)
+        self.offer = dict(extra, price=float(price), condition=condition,
+                          availability=availability, link=link)
+
+    def fetch(self, title, isbn, author, timeout):
+        return dict(self.offer)
+
+
+class HttpPriceSource(PriceSource):
+    """Offer from a JSON HTTP endpoint.
+
+    `url` is a template filled with the URL-encoded {title}, {isbn} and
+    {author}; the endpoint answers with an offer object, or an object without
+    a `price` when it has none. The whole request, including reading the
+    body, must finish within the timeout. Point it at a local stub server to
+    test offline.
+    """
+
+    MAX_RESPONSE_BYTES = 64 * 1024
+
+    def __init__(self, name, url, timeout=2.0, headers=None):
+        super().__init__(name, timeout)
+        self.url = url
+        self.headers = headers or {}
+
+    def fetch(self, title, isbn, author, timeout):
+        deadline = time.monotonic() + timeout
+        quote = urllib.parse.quote
+        url = self.url.format(title=quote(title or ''), isbn=quote(isbn or ''), author=quote(author or ''))
+        request = urllib.request.Request(url, headers=dict(self.headers, Accept='application/json'))
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            # The socket timeout applies per read, so a slowly trickling body is cut off at the deadline
+            body = b''
+            while True:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f'{self.name} did not answer in time')
+                chunk = response.read1(8192)
+                if not chunk:
+                    break
+                body += chunk
+                if len(body) > self.MAX_RESPONSE_BYTES:
+                    raise ValueError(f'{self.name} response is too large')
+        offer = json.loads(body)
+        if not isinstance(offer, dict) or offer.get('price') is None:
+            return None
+        offer['price'] = float(offer['price'])
+        return offer
+
+
+class MarketplacePriceSource(PriceSource):
+    """Our own active listings for the ISBN, always read fresh"""
+
+    cacheable = False
+
+    def __init__(self, planner, name='Lehigh Marketplace', timeout=1.0):
+        super().__init__(name, timeout)
+        self.planner = planner
+
+    def fetch(self, title, isbn, author, timeout):
+        if not isbn:
+            return None
+        summary = self.planner.get_isbn_summary(isbn)
+        if not summary['count']:
+            return None
+        lowest = summary['lowest']
+        return {
+            'price': summary['min_price'],
+            'median_price': summary['median_price'],
+            'condition': lowest['condition'],
+            'link': f"/listing/{lowest['id']}",
+            'availability': f"{summary['count']} listing{'s' if summary['count'] != 1 else ''} available"
+        }
+
+
+def load_price_sources(config_file):
+    """Build sources from a JSON list of {'type': 'static' | 'http', 'name', ...} entries"""
+    try:
+        with open(config_file, 'r') as f:
+            entries = json.load(f)
+    except (OSError, ValueError):
+        return []
+
+    sources = []
+    for entry in entries:
+        entry = dict(entry)
+        source_type = entry.pop('type', 'static')
+        if source_type == 'http':
+            sources.append(HttpPriceSource(**entry))
+        elif source_type == 'static':
+            sources.append(StaticPriceSource(**entry))
+    return sources
+
+
+class PriceAggregator:
+    """Queries every source at once and collects whatever answers in time.
+
+    Each source runs on a shared thread pool and gets its own timeout, all
+    measured from the same start, so a comparison takes as long as the
+    slowest source allowed to answer rather than the sum of all of them.
+    The timeout is passed to the source's fetch, so a slow fetch gives up
+    instead of holding its pool thread. A source with MAX_PENDING_PER_SOURCE
+    fetches still running gets no new ones until they finish, so one stalled
+    platform cannot take over the pool. Sources that fail, time out or are
+    skipped are listed in `unavailable`. Offers are cached per (source, ISBN
+    or title) for CACHE_TTL seconds and shared by every request thread; ISBNs
+    are keyed in their 13-digit form, so hyphenated and ISBN-10 spellings of
+    a book share an entry. The cache is in memory, so each server process
+    (e.g. each Gunicorn worker) keeps its own and queries the sources itself.
+    """
+
+    CACHE_TTL = 600
+    CACHE_SIZE = 2048
+    MAX_PENDING_PER_SOURCE = 2
+
+    def __init__(self, sources, max_workers=8):
+        self.sources = list(sources)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='price-source')
+        self._cache_lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._pending_lock = threading.Lock()
+        self._pending = {}
+
+    def compare(self, title='', isbn='', author=''):
+        """Return {'offers': [(source name, offer)], 'unavailable': [source name]}"""
+        lookup = isbn13(isbn) or (title or '').strip().lower()
+        start = time.monotonic()
+
+        results = {}
+        pending = []
+        unavailable = []
+        for source in self.sources:
+            cached = self._cache_get((source.name, lookup)) if source.cacheable else None
+            if cached is not None:
+                results[source.name] = cached[0]
+                continue
+            future = self._submit(source, start, title, isbn, author)
+            if future is None:
+                unavailable.append(source.name)
+            else:
+                pending.append((source, future))
+
+        for source, future in sorted(pending, key=lambda item: item[0].timeout):
+            try:
+                offer = future.result(timeout=max(start + source.timeout - time.monotonic(), 0))
+            except FutureTimeoutError:
+                future.cancel()
+                unavailable.append(source.name)
+                continue
+            except Exception:
+                unavailable.append(source.name)
+                continue
+            results[source.name] = offer
+            if source.cacheable:
+                self._cache_put((source.name, lookup), offer)
+
+        offers = [(source.name, results[source.name]) for source in self.sources
+                  if results.get(source.name)]
+        return {'offers': offers, 'unavailable': unavailable}
+
+    def _submit(self, source, start, title, isbn, author):
+        """Start a fetch with the rest of the source's timeout, or None if it has too many running"""
+        with self._pending_lock:
+            if self._pending.get(source.name, 0) >= self.MAX_PENDING_PER_SOURCE:
+                return None
+            self._pending[source.name] = self._pending.get(source.name, 0) + 1
+
+        def fetch():
+            return source.fetch(title, isbn, author, max(start + source.timeout - time.monotonic(), 0.01))
+
+        future = self._executor.submit(fetch)
+        future.add_done_callback(lambda done: self._release(source.name))
+        return future
+
+    def _release(self, name):
+        with self._pending_lock:
+            self._pending[name] -= 1
+
+    def clear_cache(self):
+        with self._cache_lock:
+            self._cache.clear()
+
+    def _cache_get(self, key):
+        """Cached (offer,) tuple, or None if missing or expired"""
+        with self._cache_lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            expires, offer = entry
+            if expires < time.monotonic():
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return (offer,)
+
+    def _cache_put(self, key, offer):
+        with self._cache_lock:
+            self._cache[key] = (time.monotonic() + self.CACHE_TTL, offer)
+            self._cache.move_to_end(key)
+            if len(self._cache) > self.CACHE_SIZE:
+                self._cache.popitem(last=False)
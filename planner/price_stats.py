@@ -0,0 +1,76 @@
+"""
+Price Statistics
+Streaming quantile sketch for listing price history
+"""
+
+import bisect
+import math
+
+
+class QuantileSketch:
+    """Log-bucket quantile sketch with bounded relative error (DDSketch-style).
+
+    Values are counted in logarithmic buckets, so any quantile is within
+    `relative_accuracy` of the true value, memory is bounded by the value range
+    rather than the number of values, and values can be removed as well as
+    added (listings get edited and deleted). A price range of $1-$10,000 at 1%
+    accuracy needs at most ~460 buckets.
+    """
+
+    # Values below this are counted as zero
+    MIN_VALUE = 0.01
+
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._bins = {}
+        self._keys = []
+        self._zero_count = 0
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value):
+        """Count a value"""
+        self._adjust(value, 1)
+
+    def remove(self, value):
+        """Uncount a previously added value"""
+        self._adjust(value, -1)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def quantile(self, q):
+        """Approximate q-quantile (0 <= q <= 1), or None if the sketch is empty"""
+        if self.count <= 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self._zero_count
+        if rank < seen:
+            return 0.0
+        for key in self._keys:
+            seen += self._bins[key]
+            if rank < seen:
+                return 2 * self._gamma ** key / (self._gamma + 1)
+        return 2 * self._gamma ** self._keys[-1] / (self._gamma + 1)
+
+    def _adjust(self, value, delta):
+        """Add delta to the count of value's bucket"""
+        value = float(value)
+        self.count += delta
+        self.total += value * delta
+        if value < self.MIN_VALUE:
+            self._zero_count += delta
+            return
+
+        key = math.ceil(math.log(value) / self._log_gamma)
+        count = self._bins.get(key, 0) + delta
+        if count > 0:
+            if key not in self._bins:
+                bisect.insort(self._keys, key)
+            self._bins[key] = count
+        elif key in self._bins:
+            del self._bins[key]
+            self._keys.pop(bisect.bisect_left(self._keys, key))
@@ -0,0 +1,100 @@
+"""
+Content-Addressed Storage
+Files stored under the SHA-256 of their bytes, so identical uploads share one copy
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+import threading
+
+
+class ContentStore:
+    """Stores files at <root>/<first hex chars>/<sha256><extension>.
+
+    Files are keyed by digest alone: the extension is metadata recorded by
+    the first upload of those bytes (it decides the served content type), so
+    the same bytes uploaded as .jpeg and .jpg are stored once. Uploads are
+    hashed while they stream to a temporary file in the same directory tree;
+    if a file with that digest already exists the temporary copy is dropped,
+    otherwise it is renamed into place. Sharding by digest prefix keeps
+    directories small.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, root, shard_width=2):
+        self.root = root
+        self.shard_width = shard_width
+        self._name_pattern = re.compile(rf'([0-9a-f]{{{shard_width}}})/([0-9a-f]{{64}})(\.[a-z0-9]+)?')
+        self._derived_pattern = re.compile(rf'([0-9a-f]{{{shard_width}}})/([0-9a-f]{{64}})(\.[a-z0-9]+)*')
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def path_for(self, digest, extension=''):
+        """Where the file with this digest is (or would be) stored"""
+        return os.path.join(self.root, digest[:self.shard_width], f'{digest}{extension}')
+
+    def name_for(self, digest, extension=''):
+        """The file's path relative to the root, with '/' separators (for URLs)"""
+        return f'{digest[:self.shard_width]}/{digest}{extension}'
+
+    def parse_name(self, name):
+        """(digest, extension) if name is a stored file's relative name, else None"""
+        match = self._name_pattern.fullmatch(name or '')
+        if not match or not match.group(2).startswith(match.group(1)):
+            return None
+        return match.group(2), match.group(3) or ''
+
+    def find(self, digest):
+        """Path of the stored file with this digest, whatever its extension, or None"""
+        directory = os.path.join(self.root, digest[:self.shard_width])
+        try:
+            names = sorted(os.listdir(directory))
+        except FileNotFoundError:
+            return None
+        for name in names:
+            # Skip derived files (<digest>.thumb.jpg, <digest>.pdf.analysis.json)
+            if name == digest or (name.startswith(digest + '.') and name.count('.') == 1):
+                return os.path.join(directory, name)
+        return None
+
+    def digest_of(self, name):
+        """Digest a stored file, or a file derived from one (<digest>.thumb.jpg), is named after"""
+        match = self._derived_pattern.fullmatch(name or '')
+        if not match or not match.group(2).startswith(match.group(1)):
+            return None
+        return match.group(2)
+
+    def put_stream(self, stream, extension=''):
+        """Store a readable binary stream; returns (digest, path, created).
+
+        `extension` is used when the bytes are new; otherwise `path` is the
+        existing copy, with the extension it was first stored under.
+        """
+        hasher = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=self.root, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as temp:
+                while True:
+                    chunk = stream.read(self.CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    temp.write(chunk)
+
+            digest = hasher.hexdigest()
+            with self._lock:
+                existing = self.find(digest)
+                if existing:
+                    os.remove(temp_path)
+                    return digest, existing, False
+                path = self.path_for(digest, extension)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp_path, path)
+            return digest, path, True
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
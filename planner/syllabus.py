@@ -0,0 +1,139 @@
+"""
+Syllabus Parsing
+Text extraction (PDF, DOCX, plain text) and detection of class codes, ISBNs and notes
+"""
+
+import os
+import re
+import zipfile
+import zlib
+from xml.etree import ElementTree
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # optional: fall back to the built-in stream scanner
+    PdfReader = None
+
+
+# Course codes such as "EECS 183", "CHEM-101" or "MATH021"
+CLASS_CODE_PATTERN = re.compile(r'\b(?!ISBN)([A-Z]{2,4})[ \t-]?(\d{2,3}[A-Z]?)\b')
+
+# ISBN-13 / ISBN-10, optionally hyphenated or spaced
+ISBN_PATTERN = re.compile(r'\b(?:97[89][\s-]?)?(?:\d[\s-]?){9}[\dXx]\b')
+
+# Lines telling students which editions are acceptable
+EDITION_NOTE_PATTERN = re.compile(r'[^\n.]*\b(?:previous|older|earlier|any|prior)\s+editions?\b[^\n.]*\.?', re.IGNORECASE)
+
+# Old binary formats (.doc): fall back to runs of printable text
+_PRINTABLE_RUNS = re.compile(rb'[\x20-\x7e\r\n\t]{4,}')
+
+_PDF_STREAM = re.compile(rb'stream\r?\n(.*?)\r?\nendstream', re.DOTALL)
+_PDF_TEXT_BLOCK = re.compile(rb'BT(.*?)ET', re.DOTALL)
+_PDF_STRING = re.compile(rb'\((?:\\.|[^\\)])*\)\s*Tj|\[(?:[^\]]*)\]\s*TJ', re.DOTALL)
+_PDF_LITERAL = re.compile(rb'\(((?:\\.|[^\\)])*)\)', re.DOTALL)
+_PDF_ESCAPES = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b', b'f': b'\f',
+                b'(': b'(', b')': b')', b'\\': b'\\'}
+
+_WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+
+def extract_text(filepath):
+    """Extract the text of a PDF, DOCX or plain-text syllabus"""
+    extension = os.path.splitext(filepath)[1].lower()
+    if extension == '.pdf':
+        return _extract_pdf_text(filepath)
+    if extension == '.docx':
+        return _extract_docx_text(filepath)
+    with open(filepath, 'rb') as f:
+        data = f.read()
+    if extension == '.doc':
+        return '\n'.join(run.decode('latin-1') for run in _PRINTABLE_RUNS.findall(data))
+    return data.decode('utf-8', errors='replace')
+
+
+def analyze_syllabus(filepath):
+    """Extract a syllabus's text and the class codes, ISBNs and edition notes in it.
+
+    Runs in a worker process, so it only returns plain data; matching against
+    the class registry happens in the web process.
+    """
+    text = extract_text(filepath)
+    class_codes = list(dict.fromkeys(f'{dept} {number}' for dept, number in CLASS_CODE_PATTERN.findall(text)))
+    isbns = list(dict.fromkeys(isbn for isbn in (_clean_isbn(m) for m in ISBN_PATTERN.findall(text))
+                               if is_valid_isbn(isbn)))
+    notes = [match.group(0).strip() for match in EDITION_NOTE_PATTERN.finditer(text)]
+    return {
+        'text': text,
+        'class_codes': class_codes,
+        'isbns': isbns,
+        'instructor_notes': ' '.join(dict.fromkeys(notes))
+    }
+
+
+def is_valid_isbn(isbn):
+    """Check an ISBN-10 or ISBN-13 checksum"""
+    if len(isbn) == 13 and isbn.isdigit():
+        return sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(isbn)) % 10 == 0
+    if len(isbn) == 10 and isbn[:9].isdigit() and (isbn[9].isdigit() or isbn[9] == 'X'):
+        digits = [10 if d == 'X' else int(d) for d in isbn]
+        return sum(d * (10 - i) for i, d in enumerate(digits)) % 11 == 0
+    return False
+
+
+def _clean_isbn(match):
+    return re.sub(r'[\s-]', '', match).upper()
+
+
+def _extract_docx_text(filepath):
+    """Paragraph text of word/document.xml"""
+    with zipfile.ZipFile(filepath) as archive:
+        root = ElementTree.fromstring(archive.read('word/document.xml'))
+    paragraphs = []
+    for paragraph in root.iter(f'{_WORD_NS}p'):
+        paragraphs.append(''.join(node.text or '' for node in paragraph.iter(f'{_WORD_NS}t')))
+    return '\n'.join(paragraphs)
+
+
+def _extract_pdf_text(filepath):
+    """PDF text via pypdf when installed, otherwise by scanning content streams"""
+    if PdfReader is not None:
+        reader = PdfReader(filepath)
+        return '\n'.join(page.extract_text() or '' for page in reader.pages)
+
+    with open(filepath, 'rb') as f:
+        data = f.read()
+    lines = []
+    for stream in _PDF_STREAM.findall(data):
+        try:
+            stream = zlib.decompress(stream)
+        except zlib.error:
+            pass  # uncompressed stream
+        for block in _PDF_TEXT_BLOCK.findall(stream):
+            for operation in _PDF_STRING.findall(block):
+                text = b''.join(_unescape_pdf_string(s) for s in _PDF_LITERAL.findall(operation))
+                lines.append(text.decode('latin-1'))
+    return '\n'.join(lines)
+
+
+def _unescape_pdf_string(literal):
+    """Undo backslash escapes in a PDF literal string"""
+    out = bytearray()
+    i = 0
+    while i < len(literal):
+        char = literal[i:i + 1]
+        if char == b'\\' and i + 1 < len(literal):
+            following = literal[i + 1:i + 2]
+            if following in _PDF_ESCAPES:
+                out += _PDF_ESCAPES[following]
+                i += 2
+                continue
+            octal = re.match(rb'[0-7]{1,3}', literal[i + 1:i + 4])
+            if octal:
+                out.append(int(octal.group(0), 8) & 0xFF)
+                i += 1 + len(octal.group(0))
+                continue
+            i += 1
+            continue
+        out += char
+        i += 1
+    return bytes(out)
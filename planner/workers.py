@@ -0,0 +1,28 @@
+"""
+Worker Processes
+Process pools for CPU-bound jobs (syllabus parsing, listing image variants)
+"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Name the launching script is re-imported under in every spawned worker
+WORKER_MAIN_NAME = '__mp_main__'
+
+
+def is_worker_import(module_name):
+    """Whether a module is being imported by a spawned worker rather than by the app"""
+    return module_name == WORKER_MAIN_NAME
+
+
+def process_pool(max_workers):
+    """Process pool for module-level job functions (pickled by reference).
+
+    Workers are spawned, not forked, so they do not inherit the app's threads
+    and locks, and each imports only the module of the job it runs. Spawning
+    also re-imports the launching script as __mp_main__: app.py checks
+    is_worker_import(__name__) and skips building the planner there, so a
+    worker never loads the data files.
+    """
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
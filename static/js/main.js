@@ -417,6 +417,109 @@ function showNotification(message, type = 'info') {
     }, 3000);
 }
 
+// Long-poll a versioned messaging endpoint. The first request returns at once;
+// later ones pass the last seen version and block server-side until something
+// changes (304 on timeout). onChange receives each new payload while isActive()
+// stays true.
+async function longPoll(url, headers, onChange, isActive, wait = 25) {
+    let version = null;
+    while (isActive()) {
+        try {
+            const sep = url.includes('?') ? '&' : '?';
+            const query = version ? `${sep}wait=${wait}&since=${version}` : '';
+            const res = await fetch(url + query, { headers });
+            if (res.status === 304) continue;
+            if (!res.ok) throw new Error(`HTTP ${res.status}`);
+            version = res.headers.get('X-Messages-Version');
+            const data = await res.json();
+            if (isActive()) onChange(data);
+        } catch (err) {
+            console.error('Long-poll error:', err);
+            await new Promise(resolve => setTimeout(resolve, 3000));
+        }
+    }
+}
+
+// Paged message history for the chat modal (messages page and listing page).
+// The newest page is long-polled, older pages are fetched as the user scrolls
+// up. Loaded messages are merged by id and rendered with the page's
+// displayMessages().
+const MESSAGE_PAGE_SIZE = 30;
+let loadedMessages = new Map();
+let olderMessagesCursor;  // undefined until the first page arrives
+let loadingOlderMessages = false;
+
+function resetLoadedMessages() {
+    loadedMessages = new Map();
+    olderMessagesCursor = undefined;
+}
+
+function mergeMessagePage(page, isOlder) {
+    page.messages.forEach(msg => loadedMessages.set(msg.id, msg));
+    if (isOlder || olderMessagesCursor === undefined) {
+        olderMessagesCursor = page.has_more ? page.next_before : null;
+    }
+}
+
+function showLoadedMessages(preserveScroll = false) {
+    const container = document.getElementById('chatMessages');
+    const fromBottom = container.scrollHeight - container.scrollTop;
+    const messages = [...loadedMessages.values()].sort((a, b) => a.timestamp.localeCompare(b.timestamp));
+    displayMessages(messages);
+    if (preserveScroll) {
+        container.scrollTop = container.scrollHeight - fromBottom;
+    }
+}
+
+async function loadOlderMessages(conversationId, email) {
+    if (!olderMessagesCursor || loadingOlderMessages) return;
+    loadingOlderMessages = true;
+    try {
+        const params = new URLSearchParams({ limit: MESSAGE_PAGE_SIZE, before: olderMessagesCursor });
+        const res = await fetch(`/api/messages/conversation/${conversationId}?${params}`, {
+            headers: { 'X-User-Email': email }
+        });
+        if (!res.ok) {
+            throw new Error('Failed to load older messages');
+        }
+        mergeMessagePage(await res.json(), true);
+        showLoadedMessages(true);
+    } catch (err) {
+        console.error('Error loading older messages:', err);
+    } finally {
+        loadingOlderMessages = false;
+    }
+}
+
+// Navbar unread badge. Polls the cheap unread_count endpoint, passing the last
+// seen version so unchanged counts come back as an empty 304.
+let unreadBadgeVersion = null;
+
+async function refreshUnreadBadge() {
+    const email = localStorage.getItem('userEmail');
+    const badge = document.getElementById('navUnreadBadge');
+    if (!email || !badge) return;
+    
+    try {
+        const query = unreadBadgeVersion ? `?since=${unreadBadgeVersion}` : '';
+        const res = await fetch(`/api/messages/unread_count${query}`, {
+            headers: { 'X-User-Email': email }
+        });
+        if (res.status === 304 || !res.ok) return;
+        unreadBadgeVersion = res.headers.get('X-Messages-Version');
+        const data = await res.json();
+        badge.textContent = data.unread_count > 99 ? '99+' : data.unread_count;
+        badge.style.display = data.unread_count > 0 ? 'inline-block' : 'none';
+    } catch (err) {
+        console.error('Error refreshing unread badge:', err);
+    }
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+    refreshUnreadBadge();
+    setInterval(refreshUnreadBadge, 15000);
+});
+
 // Add CSS animations
 const style = document.createElement('style');
 style.textContent = `
@@ -0,0 +1,117 @@
+"""
+Shared fixtures: a local HTTP server standing in for remote image hosts and APIs,
+and a BudgetPlanner working on a scratch copy of data/
+"""
+
+import http.server
+import io
+import os
+import shutil
+import sys
+import threading
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def jpeg_bytes(size=(64, 48), color='red'):
+    """A small JPEG, or arbitrary bytes when Pillow is not installed"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return b'\xff\xd8\xff\xe0' + b'\0' * 256
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+class StubServer:
+    """Threaded HTTP server answering from a route table.
+
+    routes maps a path (without the query string) to a callable taking the
+    request handler and returning (status, headers dict, body bytes). Every
+    request is recorded in `requests` as (method, path with query).
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.requests = []
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_HEAD(self):
+                self._answer(send_body=False)
+
+            def do_GET(self):
+                self._answer(send_body=True)
+
+            def _answer(self, send_body):
+                with stub._lock:
+                    stub.requests.append((self.command, self.path))
+                route = stub.routes.get(self.path.split('?', 1)[0])
+                status, headers, body = route(self) if route else (404, {'Content-Type': 'text/plain'}, b'not found')
+                try:
+                    self.send_response(status)
+                    for name, value in headers.items():
+                        self.send_header(name, value)
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    if send_body:
+                        self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client gave up (timeout tests)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self.host = f'127.0.0.1:{self._server.server_port}'
+        self.base_url = f'http://{self.host}'
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True)
+        self._thread.start()
+
+    def url(self, path):
+        return self.base_url + path
+
+    def hits(self, path):
+        """Number of requests made for a path (query string ignored)"""
+        with self._lock:
+            return sum(1 for _, requested in self.requests if requested.split('?', 1)[0] == path)
+
+    def image(self, path, body=None, content_type='image/jpeg', delay=0):
+        """Serve an image at path, optionally after a delay"""
+        body = jpeg_bytes() if body is None else body
+
+        def route(handler):
+            time.sleep(delay)
+            return 200, {'Content-Type': content_type}, body
+
+        self.routes[path] = route
+
+    def redirect(self, path, location, code=302):
+        self.routes[path] = lambda handler: (code, {'Location': location}, b'')
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def stub_server():
+    server = StubServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def planner(tmp_path, monkeypatch):
+    """BudgetPlanner over a copy of the repo's data files, with tmp_path as the working directory"""
+    from planner.budget_planner import BudgetPlanner
+    shutil.copytree(os.path.join(ROOT, 'data'), tmp_path / 'data')
+    monkeypatch.chdir(tmp_path)
+    return BudgetPlanner()
@@ -0,0 +1,119 @@
+import json
+import time
+
+import pytest
+
+import check_images
+from check_images import BROKEN, OK, UNREACHABLE, check_urls, fix_broken_images, probe
+
+
+@pytest.fixture
+def image_host(stub_server):
+    stub_server.image('/ok.jpg')
+    stub_server.image('/slow.jpg', delay=1.0)
+    stub_server.image('/page.html', b'<html></html>', content_type='text/html')
+    stub_server.redirect('/moved.jpg', '/ok.jpg')
+    stub_server.redirect('/moved-missing.jpg', '/missing.jpg')
+    stub_server.routes['/error.jpg'] = lambda handler: (503, {'Content-Type': 'text/plain'}, b'down')
+    return stub_server
+
+
+def test_image_is_ok(image_host):
+    result = probe(image_host.url('/ok.jpg'))
+    assert result == {'status': OK, 'code': 200, 'content_type': 'image/jpeg', 'error': None}
+    assert image_host.requests == [('HEAD', '/ok.jpg')]
+
+
+def test_missing_image_is_broken(image_host):
+    result = probe(image_host.url('/missing.jpg'))
+    assert result['status'] == BROKEN
+    assert result['code'] == 404
+
+
+def test_non_image_is_broken(image_host):
+    result = probe(image_host.url('/page.html'))
+    assert result['status'] == BROKEN
+    assert result['error'] == 'not an image'
+
+
+def test_server_errors_are_unreachable(image_host):
+    assert probe(image_host.url('/error.jpg'))['status'] == UNREACHABLE
+
+
+def test_timeout_is_unreachable(image_host):
+    start = time.monotonic()
+    result = probe(image_host.url('/slow.jpg'), timeout=0.2)
+    assert result['status'] == UNREACHABLE
+    assert result['code'] is None
+    assert time.monotonic() - start < 0.9
+
+
+def test_redirects_are_followed(image_host):
+    assert probe(image_host.url('/moved.jpg'))['status'] == OK
+    missing = probe(image_host.url('/moved-missing.jpg'))
+    assert (missing['status'], missing['code']) == (BROKEN, 404)
+
+
+def test_head_rejected_falls_back_to_a_ranged_get(stub_server):
+    def no_head(handler):
+        if handler.command == 'HEAD':
+            return 405, {'Content-Type': 'text/plain'}, b''
+        assert handler.headers['Range'] == 'bytes=0-0'
+        return 206, {'Content-Type': 'image/png'}, b'\x89'
+
+    stub_server.routes['/no-head.png'] = no_head
+    result = probe(stub_server.url('/no-head.png'))
+    assert (result['status'], result['code']) == (OK, 206)
+    assert stub_server.requests == [('HEAD', '/no-head.png'), ('GET', '/no-head.png')]
+
+
+def test_relative_urls_use_the_base_url(image_host):
+    assert probe('/ok.jpg', base_url=image_host.base_url)['status'] == OK
+
+
+def test_concurrent_results_keep_their_urls_and_order(stub_server):
+    # Earlier URLs answer later, so probes finish in reverse order
+    paths = [f'/img{i}.jpg' for i in range(8)]
+    for i, path in enumerate(paths):
+        if i % 2:
+            stub_server.image(path, delay=0.05 * (len(paths) - i))
+    urls = [stub_server.url(path) for path in paths]
+
+    results = check_urls(urls, workers=8, timeout=2.0)
+
+    assert list(results) == urls
+    assert [results[url]['status'] for url in urls] == [BROKEN, OK] * 4
+    assert not any(result['cached'] for result in results.values())
+
+
+def test_fresh_cache_entries_are_reused(image_host):
+    urls = [image_host.url('/ok.jpg'), image_host.url('/missing.jpg')]
+    cache = {}
+    check_urls(urls, cache=cache)
+    results = check_urls(urls, cache=cache)
+    assert all(result['cached'] for result in results.values())
+    assert image_host.hits('/ok.jpg') == 1
+
+    cache[urls[0]]['checked_at'] -= check_images.CACHE_TTL + 1
+    results = check_urls(urls, cache=cache)
+    assert not results[urls[0]]['cached'] and results[urls[1]]['cached']
+    assert image_host.hits('/ok.jpg') == 2
+
+
+def test_fix_replaces_only_broken_images(tmp_path, image_host):
+    ok, missing, slow = image_host.url('/ok.jpg'), image_host.url('/missing.jpg'), image_host.url('/slow.jpg')
+    listings = [
+        {'id': 'a', 'category': 'Books', 'image_url': missing, 'image_urls': [missing, ok]},
+        {'id': 'b', 'category': 'Books', 'image_url': missing},
+        {'id': 'c', 'category': 'Books', 'image_url': slow},
+    ]
+    listings_file = tmp_path / 'listings.json'
+    listings_file.write_text(json.dumps(listings))
+
+    results = check_urls([ok, missing, slow], timeout=0.2)
+    assert fix_broken_images(str(listings_file), results) == ['a', 'b']
+
+    fixed = json.loads(listings_file.read_text())
+    assert fixed[0]['image_url'] == ok and fixed[0]['image_urls'] == [ok]
+    assert fixed[1]['image_url'] == check_images.BudgetPlanner.placeholder_image_url(listings[1])
+    assert fixed[2]['image_url'] == slow  # unreachable may be transient; left alone
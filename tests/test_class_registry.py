@@ -0,0 +1,59 @@
+import itertools
+import json
+import os
+
+import pytest
+
+from planner.class_registry import ClassRegistry, validate_catalog
+
+_mtimes = itertools.count(1_000_000, 10)
+
+CATALOG = [{'code': 'EECS 183', 'name': 'Intro', 'department': 'EECS',
+            'textbooks': [{'title': 'Programming in C', 'isbn': '978-0-13-000000-1'}], 'supplies': []}]
+
+
+def write_catalog(path, data):
+    path.write_text(json.dumps(data))
+    # A new mtime for every write, so the reload always notices it
+    mtime = next(_mtimes)
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.mark.parametrize('data', [
+    ['EECS 183'],
+    [None],
+    [{'code': 'X 1', 'textbooks': [1]}],
+    [{'code': 'X 1', 'supplies': 'Calculator'}],
+    {'X 1': 'not an object'},
+    'not a catalog',
+])
+def test_validate_catalog_rejects_malformed_files(data):
+    with pytest.raises(ValueError):
+        validate_catalog(data)
+
+
+def test_malformed_reload_keeps_the_last_good_catalog(tmp_path):
+    classes_file = tmp_path / 'classes.json'
+    write_catalog(classes_file, CATALOG)
+    registry = ClassRegistry(str(classes_file))
+    version = registry.refresh()
+    assert registry.get('eecs 183')['name'] == 'Intro'
+
+    for data in (['EECS 183'], [None], [{'code': 'X 1', 'textbooks': [1]}]):
+        write_catalog(classes_file, data)
+        assert registry.reload() is False
+        assert registry.refresh() == version
+        assert registry.get('EECS 183')['name'] == 'Intro'
+        assert registry.match_textbooks('Programming in C, 2nd edition') == {('EECS 183', 'Programming in C')}
+
+    write_catalog(classes_file, CATALOG + [{'code': 'MATH 21', 'name': 'Calculus'}])
+    assert registry.reload() is True
+    assert registry.get('MATH 21')['name'] == 'Calculus'
+
+
+def test_malformed_first_load_serves_the_defaults(tmp_path):
+    classes_file = tmp_path / 'classes.json'
+    write_catalog(classes_file, [None])
+    registry = ClassRegistry(str(classes_file), defaults={'MATH 21': {'name': 'Calculus'}})
+    assert registry.get('MATH 21')['name'] == 'Calculus'
+    assert registry.by_isbn('9780130000001') == []
@@ -0,0 +1,136 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from conftest import jpeg_bytes
+from planner import image_proxy
+from planner.image_proxy import ImageProxy
+
+
+@pytest.fixture
+def proxy(tmp_path, stub_server):
+    return ImageProxy(str(tmp_path / 'cache'), '/images/proxy', allowed_hosts=[stub_server.host], timeout=2.0)
+
+
+def test_is_allowed_matches_hosts_subdomains_and_exact_ports(tmp_path):
+    proxy = ImageProxy(str(tmp_path), '/p', allowed_hosts=['pixabay.com', '127.0.0.1:8000'])
+    assert proxy.is_allowed('https://pixabay.com/a.jpg')
+    assert proxy.is_allowed('https://cdn.pixabay.com/a.jpg')
+    assert proxy.is_allowed('http://127.0.0.1:8000/a.jpg')
+    assert not proxy.is_allowed('http://127.0.0.1:8001/a.jpg')
+    assert not proxy.is_allowed('https://evilpixabay.com/a.jpg')
+    assert not proxy.is_allowed('ftp://pixabay.com/a.jpg')
+    assert not proxy.is_allowed('/uploads/a.jpg')
+    assert proxy.proxy_url('https://example.com/a.jpg') is None
+
+
+def test_disallowed_host_is_never_fetched(proxy, stub_server):
+    stub_server.image('/a.jpg')
+    other = stub_server.url('/a.jpg').replace('127.0.0.1', 'localhost')
+    assert proxy.get(other)['status'] == 403
+    assert stub_server.requests == []
+
+
+def test_redirect_to_disallowed_host_is_refused(proxy, stub_server):
+    stub_server.image('/target.jpg')
+    stub_server.redirect('/moved.jpg', stub_server.url('/target.jpg').replace('127.0.0.1', 'localhost'))
+    result = proxy.get(stub_server.url('/moved.jpg'))
+    assert result['status'] == 502
+    assert stub_server.hits('/target.jpg') == 0
+
+
+def test_redirect_within_allowed_hosts_is_followed(proxy, stub_server):
+    stub_server.image('/target.jpg')
+    stub_server.redirect('/moved.jpg', stub_server.url('/target.jpg'))
+    result = proxy.get(stub_server.url('/moved.jpg'))
+    assert 'error' not in result
+    with open(result['path'], 'rb') as f:
+        assert f.read() == jpeg_bytes()
+
+
+def test_concurrent_gets_share_one_download(proxy, stub_server):
+    stub_server.image('/slow.jpg', delay=0.3)
+    url = stub_server.url('/slow.jpg')
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: proxy.get(url), range(8)))
+    assert stub_server.hits('/slow.jpg') == 1
+    assert len({result['path'] for result in results}) == 1
+    assert results[0]['content_type'] == 'image/jpeg'
+
+
+def test_concurrent_variant_requests_share_one_render(proxy, stub_server, monkeypatch):
+    if image_proxy.Image is None:
+        pytest.skip('variants need Pillow')
+    stub_server.image('/big.jpg', jpeg_bytes((1200, 900)))
+    url = stub_server.url('/big.jpg')
+    proxy.get(url)
+
+    renders = []
+    lock = threading.Lock()
+    render_variant = image_proxy.render_variant
+
+    def counting_render(*args):
+        with lock:
+            renders.append(args)
+        time.sleep(0.2)
+        render_variant(*args)
+
+    monkeypatch.setattr(image_proxy, 'render_variant', counting_render)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: proxy.get(url, 'thumb', 'webp'), range(8)))
+    assert len(renders) == 1
+    assert {result['path'] for result in results} == {renders[0][1]}
+    assert results[0]['content_type'] == 'image/webp'
+
+
+def test_least_recently_used_images_are_evicted_over_max_bytes(tmp_path, stub_server):
+    body = jpeg_bytes()
+    proxy = ImageProxy(str(tmp_path / 'cache'), '/p', allowed_hosts=[stub_server.host],
+                       max_bytes=2 * len(body) + len(body) // 2)
+    for name in ('a', 'b', 'c'):
+        stub_server.image(f'/{name}.jpg', body)
+    a = proxy.get(stub_server.url('/a.jpg'))
+    b = proxy.get(stub_server.url('/b.jpg'))
+    proxy.get(stub_server.url('/a.jpg'))  # a becomes the most recently used
+    c = proxy.get(stub_server.url('/c.jpg'))
+
+    assert os.path.exists(a['path']) and os.path.exists(c['path'])
+    assert not os.path.exists(b['path'])
+    assert stub_server.hits('/a.jpg') == 1
+
+    proxy.get(stub_server.url('/b.jpg'))
+    assert stub_server.hits('/b.jpg') == 2
+
+
+def test_cache_index_is_rebuilt_from_disk(tmp_path, stub_server):
+    stub_server.image('/a.jpg')
+    cache_dir = str(tmp_path / 'cache')
+    first = ImageProxy(cache_dir, '/p', allowed_hosts=[stub_server.host]).get(stub_server.url('/a.jpg'))
+    second = ImageProxy(cache_dir, '/p', allowed_hosts=[stub_server.host]).get(stub_server.url('/a.jpg'))
+    assert first['path'] == second['path']
+    assert stub_server.hits('/a.jpg') == 1
+
+
+def test_failures_are_remembered_for_the_failure_ttl(proxy, stub_server):
+    url = stub_server.url('/missing.jpg')
+    first = proxy.get(url)
+    second = proxy.get(url)
+    assert first['status'] == second['status'] == 502
+    assert stub_server.hits('/missing.jpg') == 1
+
+    proxy.FAILURE_TTL = 0.1
+    proxy.get(stub_server.url('/other-missing.jpg'))
+    time.sleep(0.2)
+    stub_server.image('/other-missing.jpg')
+    assert 'error' not in proxy.get(stub_server.url('/other-missing.jpg'))
+    assert stub_server.hits('/other-missing.jpg') == 2
+
+
+def test_non_image_responses_are_rejected(proxy, stub_server):
+    stub_server.image('/page.jpg', b'<html></html>', content_type='text/html')
+    result = proxy.get(stub_server.url('/page.jpg'))
+    assert result['status'] == 502
+    assert 'Not an image' in result['error']
@@ -0,0 +1,87 @@
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from planner.budget_planner import BudgetPlanner
+
+
+def listing_data(**overrides):
+    data = {'title': 'Campbell Biology (12th Edition)', 'description': 'Lightly used', 'price': 40,
+            'condition': 'Good', 'category': 'textbooks', 'isbn': '978-0-13-518874-3',
+            'seller_email': 'seller@lehigh.edu'}
+    data.update(overrides)
+    return data
+
+
+@pytest.mark.parametrize('price', [float('nan'), 'inf', '-Infinity', 'forty', None])
+def test_non_finite_prices_are_rejected(planner, price):
+    planner.suggest_price(listing_data())  # build the price indexes first
+    before = planner.get_marketplace_listings()
+
+    assert planner.create_marketplace_listing(listing_data(price=price))['status'] == 400
+    listing = planner.create_marketplace_listing(listing_data())
+    assert planner.update_listing(listing['id'], {'price': price})['status'] == 400
+    result = planner.import_marketplace_listings([listing_data(price=price), listing_data(price='12.5')])
+
+    assert [item['index'] for item in result['rejected']] == [0]
+    assert result['created'][0]['price'] == 12.5
+    assert len(planner.get_marketplace_listings()) == len(before) + 2
+    assert math.isfinite(planner.get_listing(listing['id'])['price'])
+    assert 'error' not in planner.suggest_price(listing_data())
+
+
+def test_indexes_skip_non_finite_prices_already_on_disk(planner):
+    listings = planner._load_json(planner.listings_file)
+    listings.append(dict(listing_data(price=float('inf')), id='listing_bad', status='active'))
+    planner._save_json(planner.listings_file, listings)
+
+    assert 'error' not in planner.suggest_price(listing_data())
+    assert planner.get_isbn_summary('9780135188743') is not None
+    planner.delete_listing('listing_bad')
+
+
+def test_concurrent_edits_are_not_lost(planner):
+    isbn = '9780135188743'
+    planner.get_isbn_summary(isbn)  # build the ISBN index so the edits update it
+    created = [planner.create_marketplace_listing(listing_data(title=f'Organic Chemistry copy {i}', price=10 + i))
+               for i in range(6)]
+
+    def edit(i):
+        listing = created[i % len(created)]
+        if i < len(created):
+            planner.update_listing(listing['id'], {'price': 100 + i})
+        elif i < 2 * len(created):
+            planner.toggle_bookmark(listing['id'], f'fan{i}@lehigh.edu')
+        else:
+            planner.mark_listing_sold(listing['id'])
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(edit, range(3 * len(created))))
+
+    for i, listing in enumerate(created):
+        saved = planner.get_listing(listing['id'])
+        assert (saved['price'], saved['bookmarks'], saved['status']) == (100 + i, 1, 'sold')
+    assert planner.get_isbn_summary(isbn) == BudgetPlanner().get_isbn_summary(isbn)
+
+
+def test_lazy_index_builds_see_each_concurrent_write_once(planner):
+    isbn = '9780135188743'
+
+    def create(i):
+        planner.create_marketplace_listing(listing_data(title=f'Campbell Biology copy {i}', price=20 + i))
+
+    def rebuild(i):
+        # Drop the indexes so the next read builds them while creates are landing
+        with planner._stats_lock:
+            planner._isbn_listings = None
+            planner._price_history = None
+        planner.get_isbn_summary(isbn)
+        planner.suggest_price(listing_data())
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda i: (create if i % 2 else rebuild)(i), range(80)))
+
+    fresh = BudgetPlanner()
+    assert planner.get_isbn_summary(isbn) == fresh.get_isbn_summary(isbn)
+    assert planner.suggest_price(listing_data()) == fresh.suggest_price(listing_data())
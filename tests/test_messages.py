@@ -0,0 +1,47 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from planner.budget_planner import BudgetPlanner
+
+
+def test_concurrent_sends_keep_every_conversation_on_disk(planner):
+    senders = [f'buyer{i}@lehigh.edu' for i in range(12)]
+
+    def send(i):
+        sender = senders[i % len(senders)]
+        return planner.send_message({'sender_email': sender, 'recipient_email': 'seller@lehigh.edu',
+                                     'listing_id': f'listing_{i % len(senders)}', 'content': f'msg number {i}'})
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        sent = list(pool.map(send, range(48)))
+    assert all('error' not in message for message in sent)
+
+    with open(planner.conversations_file) as f:
+        on_disk = {conv['id']: conv for conv in json.load(f)}
+    conversation_ids = {message['conversation_id'] for message in sent}
+    assert len(conversation_ids) == len(senders)
+    assert conversation_ids <= set(on_disk)
+
+    latest = {}
+    for message in sent:
+        if message['timestamp'] >= latest.get(message['conversation_id'], {}).get('timestamp', ''):
+            latest[message['conversation_id']] = message
+    for conversation_id, message in latest.items():
+        assert on_disk[conversation_id]['last_message'] == message['content']
+        assert on_disk[conversation_id]['last_message_time'] == message['timestamp']
+
+    # A fresh planner sees the same inbox
+    inbox = {conv['id'] for conv in BudgetPlanner().get_conversations('seller@lehigh.edu')}
+    assert conversation_ids <= inbox
+
+
+def test_deleted_conversation_is_removed_from_disk(planner):
+    message = planner.send_message({'sender_email': 'a@lehigh.edu', 'recipient_email': 'b@lehigh.edu',
+                                    'listing_id': 'listing_x', 'content': 'is this available'})
+    assert planner.delete_conversation('c@lehigh.edu', message['conversation_id'])['status'] == 403
+    assert planner.delete_conversation('a@lehigh.edu', message['conversation_id'])['success']
+    assert planner.delete_conversation('a@lehigh.edu', message['conversation_id'])['status'] == 404
+
+    with open(planner.conversations_file) as f:
+        assert message['conversation_id'] not in {conv['id'] for conv in json.load(f)}
+    assert message['conversation_id'] not in {conv['id'] for conv in planner.get_conversations('b@lehigh.edu')}
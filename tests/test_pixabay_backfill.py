@@ -0,0 +1,144 @@
+import json
+import os
+import urllib.parse
+
+import pytest
+
+import update_listing_images_pixabay as backfill
+from update_listing_images_pixabay import PixabayClient, update_listings_with_pixabay_images
+
+TITLES = ['Desk Chair', 'Chemistry Goggles', 'Graph Paper', 'Poster Frame']
+
+
+@pytest.fixture
+def listings_file(tmp_path):
+    path = tmp_path / 'listings.json'
+    listings = [{'id': f'listing_test_{i}', 'title': title, 'image_url': None} for i, title in enumerate(TITLES)]
+    path.write_text(json.dumps(listings, indent=2))
+    return str(path)
+
+
+@pytest.fixture
+def pixabay_api(stub_server):
+    """Stub search API: one hit per query, except queries listed in `failing` (HTTP 500) or `empty`"""
+    api = {'queries': [], 'failing': set(), 'empty': set()}
+
+    def search(handler):
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(handler.path).query)['q'][0]
+        api['queries'].append(query)
+        if query in api['failing']:
+            return 500, {'Content-Type': 'application/json'}, b'{}'
+        hits = [] if query in api['empty'] else [{'largeImageURL': image_url(query)}]
+        return 200, {'Content-Type': 'application/json'}, json.dumps({'hits': hits}).encode()
+
+    stub_server.routes['/api/'] = search
+    api['url'] = stub_server.url('/api/')
+    return api
+
+
+def image_url(query):
+    return 'https://cdn.pixabay.com/' + query.replace(' ', '-').lower() + '.jpg'
+
+
+def run(listings_file, pixabay_api, **kwargs):
+    client = PixabayClient(base_url=pixabay_api['url'], api_key='test', workers=2, rate=0,
+                           retries=0, timeout=2.0, cache_file=None)
+    return update_listings_with_pixabay_images(listings_file, listings_file + '.checkpoint', client,
+                                               workers=kwargs.pop('workers', 2), **kwargs)
+
+
+def read(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def test_backfill_applies_found_images_and_removes_the_checkpoint(listings_file, pixabay_api):
+    pixabay_api['empty'].add('Graph Paper')
+    summary = run(listings_file, pixabay_api)
+
+    assert summary == {'total': 4, 'updated': 3, 'not_found': 1, 'errors': 0}
+    images = {listing['title']: listing['image_url'] for listing in read(listings_file)}
+    assert images == {title: None if title == 'Graph Paper' else image_url(title) for title in TITLES}
+    assert not os.path.exists(listings_file + '.checkpoint')
+
+
+def test_backfill_resumes_from_the_checkpoint(listings_file, pixabay_api):
+    with open(listings_file + '.checkpoint', 'w') as f:
+        json.dump({'listings_file': listings_file,
+                   'done': {'listing_test_0': 'https://cdn.pixabay.com/saved.jpg', 'listing_test_1': None}}, f)
+
+    summary = run(listings_file, pixabay_api)
+
+    assert sorted(pixabay_api['queries']) == ['Graph Paper', 'Poster Frame']
+    assert summary['updated'] == 3
+    assert read(listings_file)[0]['image_url'] == 'https://cdn.pixabay.com/saved.jpg'
+
+
+def test_checkpoint_for_another_listings_file_is_ignored(listings_file, pixabay_api):
+    with open(listings_file + '.checkpoint', 'w') as f:
+        json.dump({'listings_file': 'elsewhere.json', 'done': {'listing_test_0': None}}, f)
+    run(listings_file, pixabay_api)
+    assert len(pixabay_api['queries']) == len(TITLES)
+
+
+def test_errors_are_retried_on_the_next_run(listings_file, pixabay_api):
+    pixabay_api['failing'].add('Chemistry Goggles')
+    first = run(listings_file, pixabay_api)
+
+    assert first['errors'] == 1
+    assert read(listings_file)[1]['image_url'] is None
+    checkpoint = read(listings_file + '.checkpoint')
+    assert 'listing_test_1' not in checkpoint['done'] and len(checkpoint['done']) == 3
+
+    pixabay_api['failing'].clear()
+    pixabay_api['queries'].clear()
+    second = run(listings_file, pixabay_api)
+
+    assert pixabay_api['queries'] == ['Chemistry Goggles']
+    assert second['errors'] == 0
+    assert read(listings_file)[1]['image_url'] == image_url('Chemistry Goggles')
+    assert not os.path.exists(listings_file + '.checkpoint')
+
+
+def test_interrupted_search_saves_progress_and_leaves_listings_intact(listings_file, pixabay_api, monkeypatch):
+    original = read(listings_file)
+    get_pixabay_image = backfill.get_pixabay_image
+
+    def interrupted(client, listing):
+        if listing['title'] == TITLES[-1]:  # last, so no search is still running afterwards
+            raise KeyboardInterrupt
+        return get_pixabay_image(client, listing)
+
+    monkeypatch.setattr(backfill, 'get_pixabay_image', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        run(listings_file, pixabay_api, workers=1)
+
+    assert read(listings_file) == original
+    done = read(listings_file + '.checkpoint')['done']
+    assert set(done) <= {'listing_test_0', 'listing_test_1', 'listing_test_2'}
+
+    monkeypatch.setattr(backfill, 'get_pixabay_image', get_pixabay_image)
+    pixabay_api['queries'].clear()
+    summary = run(listings_file, pixabay_api)
+    assert sorted(pixabay_api['queries']) == sorted(listing['title'] for listing in original
+                                                    if listing['id'] not in done)
+    assert summary['updated'] == 4
+
+
+def test_interrupted_write_leaves_listings_intact(listings_file, pixabay_api, monkeypatch):
+    original_text = open(listings_file).read()
+    dump = json.dump
+
+    def interrupted_dump(data, f, **kwargs):
+        if isinstance(data, list):  # the listings, not the checkpoint
+            f.write('[{"id": "listing_test_0", ')
+            raise KeyboardInterrupt
+        dump(data, f, **kwargs)
+
+    monkeypatch.setattr(backfill.json, 'dump', interrupted_dump)
+    with pytest.raises(KeyboardInterrupt):
+        run(listings_file, pixabay_api)
+
+    assert open(listings_file).read() == original_text
+    directory = os.path.dirname(listings_file)
+    assert not [name for name in os.listdir(directory) if name.startswith('.tmp-')]
@@ -0,0 +1,106 @@
+import json
+import threading
+import time
+
+import pytest
+
+from planner.price_sources import HttpPriceSource, PriceAggregator, PriceSource, StaticPriceSource
+
+
+def offer_route(price, delay=0):
+    def route(handler):
+        time.sleep(delay)
+        return 200, {'Content-Type': 'application/json'}, json.dumps({'price': price, 'condition': 'Used'}).encode()
+    return route
+
+
+class BlockingSource(PriceSource):
+    """Source whose fetches wait until released, counting how many were started"""
+
+    def __init__(self, name, timeout=0.1):
+        super().__init__(name, timeout)
+        self.release = threading.Event()
+        self.calls = 0
+
+    def fetch(self, title, isbn, author, timeout):
+        self.calls += 1
+        self.release.wait(5)
+        return {'price': 1.0}
+
+
+@pytest.fixture
+def price_host(stub_server):
+    stub_server.routes['/fast'] = offer_route(42.5)
+    stub_server.routes['/slow'] = offer_route(10, delay=1.0)
+    stub_server.routes['/broken'] = lambda handler: (500, {'Content-Type': 'text/plain'}, b'down')
+    return stub_server
+
+
+def http_source(server, name, path, timeout=0.3):
+    return HttpPriceSource(name, server.url(path) + '?isbn={isbn}&title={title}', timeout=timeout)
+
+
+def test_slow_and_failing_sources_do_not_block_the_rest(price_host):
+    aggregator = PriceAggregator([http_source(price_host, 'Slow', '/slow'),
+                                  http_source(price_host, 'Broken', '/broken'),
+                                  http_source(price_host, 'Fast', '/fast'),
+                                  StaticPriceSource('Static', 30)])
+    start = time.monotonic()
+    result = aggregator.compare(title='Campbell Biology', isbn='9780135188743')
+
+    assert time.monotonic() - start < 0.8
+    assert [name for name, _ in result['offers']] == ['Fast', 'Static']
+    assert dict(result['offers'])['Fast']['price'] == 42.5
+    assert sorted(result['unavailable']) == ['Broken', 'Slow']
+
+
+def test_each_source_gets_its_own_timeout(price_host):
+    patient = http_source(price_host, 'Patient', '/slow', timeout=2.0)
+    aggregator = PriceAggregator([patient, http_source(price_host, 'Impatient', '/slow', timeout=0.2)])
+    result = aggregator.compare(isbn='9780135188743')
+    assert [name for name, _ in result['offers']] == ['Patient']
+    assert result['unavailable'] == ['Impatient']
+
+
+def test_stalled_source_gets_at_most_max_pending_fetches():
+    stalled = BlockingSource('Stalled')
+    aggregator = PriceAggregator([stalled, StaticPriceSource('Static', 30)])
+    try:
+        for i in range(PriceAggregator.MAX_PENDING_PER_SOURCE + 2):
+            result = aggregator.compare(isbn=f'97801351887{i:02d}')
+            assert result['unavailable'] == ['Stalled']
+            assert [name for name, _ in result['offers']] == ['Static']
+        assert stalled.calls == PriceAggregator.MAX_PENDING_PER_SOURCE
+    finally:
+        stalled.release.set()
+
+    deadline = time.monotonic() + 2
+    while aggregator._pending.get('Stalled') and time.monotonic() < deadline:
+        time.sleep(0.01)
+    stalled.timeout = 1.0
+    assert [name for name, _ in aggregator.compare(isbn='9780000000000')['offers']] == ['Stalled', 'Static']
+
+
+def test_offers_are_cached_by_normalized_isbn_until_the_ttl(price_host):
+    aggregator = PriceAggregator([http_source(price_host, 'Fast', '/fast')])
+    for isbn in ('978-0-13-592903-2', '9780135929032', '0-13-592903-6', ' 0135929036 '):
+        assert aggregator.compare(isbn=isbn)['offers'][0][1]['price'] == 42.5
+    assert price_host.hits('/fast') == 1
+
+    aggregator.compare(isbn='9780306406157')
+    assert price_host.hits('/fast') == 2
+
+    aggregator.CACHE_TTL = 0.1
+    aggregator.compare(title='Campbell Biology')
+    aggregator.compare(title='  campbell biology ')
+    assert price_host.hits('/fast') == 3
+    time.sleep(0.15)
+    aggregator.compare(title='Campbell Biology')
+    assert price_host.hits('/fast') == 4
+
+
+def test_failures_are_not_cached(price_host):
+    aggregator = PriceAggregator([http_source(price_host, 'Broken', '/broken')])
+    aggregator.compare(isbn='9780135929032')
+    aggregator.compare(isbn='9780135929032')
+    assert price_host.hits('/broken') == 2
@@ -1,9 +1,37 @@
+"""
+Backfill listing images from the Pixabay search API.
+
+Searches run concurrently over a pooled HTTP session, rate limited and
+retried with backoff. Query results are cached on disk and progress is
+checkpointed, so an interrupted run picks up where it stopped. listings.json
+is rewritten once at the end, applying only the image URLs found.
+
+    python update_listing_images_pixabay.py [--workers 4] [--rate 1.5]
+        [--base-url http://127.0.0.1:8000/api/] [--fresh]
+"""
+
+import argparse
 import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Optional
+
 import requests
-from typing import Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Pixabay API key - you'll need to get one from https://pixabay.com/api/docs/
-PIXABAY_API_KEY = "53267698-c01f2790dff42aed080dadb01"  # Get free key from pixabay.com/api/
+PIXABAY_API_KEY = os.environ.get("PIXABAY_API_KEY", "")  # Get free key from pixabay.com/api/
+
+# Search endpoint; point it at a local stub API to test the backfill offline
+PIXABAY_API_URL = os.environ.get("PIXABAY_API_URL", "https://pixabay.com/api/")
+
+LISTINGS_FILE = "data/listings.json"
+CACHE_FILE = "data/pixabay_cache.json"
+CHECKPOINT_FILE = "data/pixabay_checkpoint.json"
 
 # Mapping of listing IDs to specific Pixabay search queries for better matches
 PIXABAY_SEARCH_QUERIES = {
@@ -37,14 +65,57 @@ PIXABAY_SEARCH_QUERIES = {
 }
 
 
-def get_pixabay_image(query: str) -> Optional[str]:
-    """
-    Fetch an image URL from Pixabay based on search query.
-    Returns the URL of the best matching image.
+class RateLimiter:
+    """Spaces calls at least 1/rate seconds apart across all worker threads"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class PixabayClient:
+    """Pixabay image search with a pooled session, rate limiting, retries and a query cache.
+
+    Retries (with exponential backoff, honoring Retry-After) cover connection
+    errors, 429 and 5xx responses. The cache maps a query to its image URL, or
+    to None when Pixabay had no results; failed requests are not cached.
     """
-    try:
+
+    def __init__(self, base_url: str = PIXABAY_API_URL, api_key: str = PIXABAY_API_KEY,
+                 workers: int = 4, rate: float = 1.5, retries: int = 3, timeout: float = 10.0,
+                 cache_file: Optional[str] = CACHE_FILE):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.rate_limiter = RateLimiter(rate)
+        self.cache_file = cache_file
+        self.cache = _read_json(cache_file, {}) if cache_file else {}
+        self._cache_lock = threading.Lock()
+
+        retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=frozenset(["GET"]), respect_retry_after_header=True)
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def search(self, query: str) -> Optional[str]:
+        """URL of the most popular matching photo, or None (raises on request failure)"""
+        with self._cache_lock:
+            if query in self.cache:
+                return self.cache[query]
+
         params = {
-            "key": PIXABAY_API_KEY,
+            "key": self.api_key,
             "q": query,
             "image_type": "photo",
             "per_page": 3,
@@ -52,89 +123,182 @@ def get_pixabay_image(query: str) -> Optional[str]:
             "min_width": 500,
             "min_height": 500,
         }
-        
-        response = requests.get("https://pixabay.com/api/", params=params)
+        self.rate_limiter.wait()
+        response = self.session.get(self.base_url, params=params, timeout=self.timeout)
         response.raise_for_status()
-        
-        data = response.json()
-        
-        if data["hits"]:
-            # Get the first result (most popular)
-            image_url = data["hits"][0]["largeImageURL"]
-            return image_url
-        else:
-            print(f"  ⚠️  No results found for: {query}")
-            return None
-            
-    except requests.exceptions.RequestException as e:
-        print(f"  ❌ Error fetching from Pixabay for '{query}': {e}")
+        hits = response.json().get("hits") or []
+        # Get the first result (most popular)
+        image_url = hits[0]["largeImageURL"] if hits else None
+
+        with self._cache_lock:
+            self.cache[query] = image_url
+        return image_url
+
+    def save_cache(self):
+        if self.cache_file:
+            with self._cache_lock:
+                cache = dict(self.cache)
+            _write_json_atomic(self.cache_file, cache)
+
+
+def get_pixabay_image(client: PixabayClient, listing: Dict) -> Dict:
+    """Search for a listing's image, falling back to its title; returns a result record"""
+    title = listing.get("title", "Unknown")
+    # Get search query for this listing
+    queries = [PIXABAY_SEARCH_QUERIES.get(listing.get("id"), title)]
+    if title not in queries:
+        queries.append(title)
+
+    for query in queries:
+        try:
+            image_url = client.search(query)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            return {"status": "error", "query": query, "error": str(e)}
+        if image_url:
+            return {"status": "found", "query": query, "image_url": image_url}
+    return {"status": "not_found", "query": queries[-1]}
+
+
+def update_listings_with_pixabay_images(listings_file: str = LISTINGS_FILE,
+                                        checkpoint_file: str = CHECKPOINT_FILE,
+                                        client: Optional[PixabayClient] = None,
+                                        workers: int = 4, checkpoint_every: int = 10,
+                                        fresh: bool = False) -> Optional[Dict]:
+    """Search images for every listing not already done and apply them to listings.json.
+
+    Finished listings (found or not found; errors are retried next run) are
+    recorded in the checkpoint file as they complete. Returns a summary, or
+    None if listings.json is missing.
+    """
+    listings = _read_json(listings_file, None)
+    if listings is None:
+        print("❌ listings.json not found!")
         return None
 
+    client = client or PixabayClient(workers=workers)
+    checkpoint = {} if fresh else _read_json(checkpoint_file, {})
+    done = checkpoint.get("done", {}) if checkpoint.get("listings_file") == listings_file else {}
+    pending = [l for l in listings if l.get("id") not in done]
+
+    print(f"🖼️  Fetching images from Pixabay for {len(pending)} of {len(listings)} listings "
+          f"({len(done)} already done, {workers} workers)...\n")
 
-def update_listings_with_pixabay_images():
-    """Read listings.json and update image_urls with Pixabay images."""
-    
-    # Read current listings
+    def save_progress():
+        _write_json_atomic(checkpoint_file, {"listings_file": listings_file, "done": done})
+        client.save_cache()
+
+    errors = 0
+    completed = 0
+    executor = ThreadPoolExecutor(max_workers=workers)
     try:
-        with open("data/listings.json", "r") as f:
-            listings = json.load(f)
-    except FileNotFoundError:
-        print("❌ listings.json not found!")
-        return
-    
-    print(f"🖼️  Fetching images from Pixabay for {len(listings)} listings...\n")
-    
+        futures = {executor.submit(get_pixabay_image, client, listing): listing for listing in pending}
+        for future in as_completed(futures):
+            listing = futures[future]
+            result = future.result()
+            listing_id = listing.get("id")
+            if result["status"] == "found":
+                done[listing_id] = result["image_url"]
+                print(f"📍 {listing_id}: {listing.get('title', 'Unknown')} ✅ ('{result['query']}')")
+            elif result["status"] == "not_found":
+                done[listing_id] = None
+                print(f"📍 {listing_id}: {listing.get('title', 'Unknown')} ⚠️  No results found")
+            else:
+                errors += 1
+                print(f"📍 {listing_id}: ❌ Error fetching from Pixabay for '{result['query']}': {result['error']}")
+
+            completed += 1
+            if completed % checkpoint_every == 0:
+                save_progress()
+    except KeyboardInterrupt:
+        executor.shutdown(wait=False, cancel_futures=True)
+        save_progress()
+        print(f"\n⏸️  Interrupted; progress saved to {checkpoint_file}. Run again to resume.")
+        raise
+    executor.shutdown()
+    save_progress()
+
+    # Re-read so listings edited while the backfill ran are not overwritten
+    listings = _read_json(listings_file, [])
     updated_count = 0
-    failed_count = 0
-    
     for listing in listings:
-        listing_id = listing.get("id")
-        title = listing.get("title", "Unknown")
-        
-        # Get search query for this listing
-        search_query = PIXABAY_SEARCH_QUERIES.get(listing_id, title)
-        
-        print(f"📍 {listing_id}: {title}")
-        print(f"   Searching: '{search_query}'", end="")
-        
-        # Fetch image from Pixabay
-        image_url = get_pixabay_image(search_query)
-        
-        if image_url:
+        image_url = done.get(listing.get("id"))
+        if image_url and listing.get("image_url") != image_url:
             listing["image_url"] = image_url
-            print(f" ✅")
             updated_count += 1
-        else:
-            print(f" ⚠️  Using fallback")
-            # Try fallback with just the title
-            image_url = get_pixabay_image(title)
-            if image_url:
-                listing["image_url"] = image_url
-                updated_count += 1
-            else:
-                failed_count += 1
-    
-    # Save updated listings
+    _write_json_atomic(listings_file, listings)
+
+    summary = {
+        "total": len(listings),
+        "updated": updated_count,
+        "not_found": sum(1 for image_url in done.values() if not image_url),
+        "errors": errors
+    }
+    if not errors and os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)  # complete: the next run starts over
+
+    print(f"\n✅ Updated listings.json")
+    print(f"📊 Summary:")
+    print(f"   Total listings: {summary['total']}")
+    print(f"   Updated: {summary['updated']}")
+    print(f"   No results: {summary['not_found']}")
+    print(f"   Errors (retried next run): {summary['errors']}")
+    return summary
+
+
+def _read_json(path: str, default):
     try:
-        with open("data/listings.json", "w") as f:
-            json.dump(listings, f, indent=2)
-        print(f"\n✅ Updated listings.json")
-        print(f"📊 Summary:")
-        print(f"   Total listings: {len(listings)}")
-        print(f"   Updated: {updated_count}")
-        print(f"   Failed: {failed_count}")
-    except Exception as e:
-        print(f"❌ Error saving listings.json: {e}")
+        with open(path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return default
+
+
+def _write_json_atomic(path: str, data):
+    """Write JSON through a temporary file so an interrupted write never truncates it"""
+    directory = os.path.dirname(path) or "."
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".json")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Backfill listing images from Pixabay")
+    parser.add_argument("--base-url", default=PIXABAY_API_URL, help="Search API URL (e.g. a local stub)")
+    parser.add_argument("--listings", default=LISTINGS_FILE)
+    parser.add_argument("--cache", default=CACHE_FILE, help="Query -> image URL cache file")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=1.5,
+                        help="Most requests per second (Pixabay allows 100 per minute)")
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--checkpoint-every", type=int, default=10)
+    parser.add_argument("--fresh", action="store_true", help="Ignore any saved checkpoint")
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    if PIXABAY_API_KEY == "your_pixabay_api_key_here":
+    args = _parse_args()
+    if not PIXABAY_API_KEY or PIXABAY_API_KEY == "your_pixabay_api_key_here":
         print("❌ ERROR: You need to set your Pixabay API key!")
         print("\n📝 Steps to get a free Pixabay API key:")
         print("   1. Go to https://pixabay.com/api/")
         print("   2. Sign up for a free account")
         print("   3. Copy your API key")
-        print("   4. Replace 'your_pixabay_api_key_here' in this script with your key")
+        print("   4. Set the PIXABAY_API_KEY environment variable to your key")
         print("   5. Run the script again")
     else:
-        update_listings_with_pixabay_images()
+        pixabay = PixabayClient(base_url=args.base_url, workers=args.workers, rate=args.rate,
+                                retries=args.retries, timeout=args.timeout, cache_file=args.cache)
+        try:
+            update_listings_with_pixabay_images(args.listings, args.checkpoint, pixabay,
+                                                workers=args.workers, checkpoint_every=args.checkpoint_every,
+                                                fresh=args.fresh)
+        except KeyboardInterrupt:
+            pass